@@ -40,6 +40,10 @@ namespace dumpling.db
         [DataMember]
         public bool ExecutableImage { get; set; }
 
+        [NotMapped]
+        [DataMember]
+        public long? CompressedSize { get { return Artifact != null ? (long?)Artifact.CompressedSize : null; } }
+
         [Timestamp]
         public byte[] Timestamp { get; set; }
 
@@ -31,6 +31,60 @@ import errno
 import shutil
 import io
 import psutil
+import struct
+import Queue
+import collections
+import math
+import sqlite3
+import bisect
+import heapq
+import socket
+import ssl
+import select
+import urlparse
+import tarfile
+import fnmatch
+
+#scandir lists a directory along with the type of each entry so traversal needs far fewer stat calls, it is part of os
+#from python 3.5 and otherwise available from the scandir package
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+#fcntl is only available on unix, where it is used to clone files on filesystems which support reflinks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+#posix_fallocate reserves the disk space of a file up front, it is part of os from python 3.3 and is otherwise called from
+#the c runtime where it provides it
+def _load_posix_fallocate():
+    try:
+        from os import posix_fallocate
+        return posix_fallocate
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fallocate = getattr(libc, 'posix_fallocate64', None) or libc.posix_fallocate
+    except (ImportError, OSError, AttributeError, TypeError):
+        return None
+    fallocate.argtypes = [ ctypes.c_int, ctypes.c_int64, ctypes.c_int64 ]
+    #unlike the os function the c function returns the error rather than setting errno
+    def posix_fallocate(fd, offset, length):
+        err = fallocate(fd, offset, length)
+        if err != 0:
+            raise OSError(err, os.strerror(err))
+    return posix_fallocate
+
+_posix_fallocate = _load_posix_fallocate()
 
 def _json_format(obj):
     return json.dumps(obj, sort_keys=True, indent=4, separators=(',', ': '))
@@ -93,12 +147,19 @@ class Output:
         return result == 'y'
 
 class FileUtils:
+    s_zeros = ''
+    s_EntropySampleCount = 4
+    s_EntropySampleSize = 1024 * 16
+    s_EntropyThreshold = 7.5
+    s_DeflateMemLevel = 8
+    #leading bytes of formats which are already compressed
+    s_CompressedMagic = { 'gzip': '\x1f\x8b', 'zip': 'PK\x03\x04', 'bzip2': 'BZh', 'xz': '\xfd7zXZ\x00', '7z': '7z\xbc\xaf\x27\x1c', 'zstd': '\x28\xb5\x2f\xfd', 'png': '\x89PNG', 'jpeg': '\xff\xd8\xff' }
 
     @staticmethod
     def _hash(path):
         hash = hashlib.sha1()
-        with open(path, 'rb') as f:
-            BLOCKSIZE = 1024 * 8
+        with SparseFileReader(path) as f:
+            BLOCKSIZE = 1024 * 1024
             buf = f.read(BLOCKSIZE)
             while len(buf) > 0:
                 hash.update(buf)  
@@ -106,16 +167,104 @@ class FileUtils:
         return hash.hexdigest()
 
     @staticmethod
-    def _compress_and_hash(inpath, outpath):     
+    def _compress_and_hash(inpath, outpath, compression = None, level = 9):     
+        if compression == 'block':
+            hash, index = BlockGzip.Compress(inpath, outpath, level)
+            Output.Diagnostic('compressed %s into %d blocks'%(os.path.basename(inpath), len(index)))
+            return hash
         FileUtils._ensure_parent_dir(outpath)
-        with gzip.open(outpath, 'wb') as fComp:
-            with open(inpath, 'rb') as fDecomp:
-                shutil.copyfileobj(fDecomp, fComp)
-        return FileUtils._hash(outpath);
+        starttime = time.time()
+        hash = hashlib.sha1()
+        compressor = FileUtils._deflater(level)
+        crc = zlib.crc32('')
+        size = 0
+        with open(outpath, 'wb') as fComp:
+            with SparseFileReader(inpath) as fDecomp:
+                data = FileUtils._gzip_header(level)
+                fComp.write(data)
+                hash.update(data)
+                buf = fDecomp.read(SparseFileReader.s_ReadSize)
+                while buf:
+                    crc = zlib.crc32(buf, crc)
+                    size += len(buf)
+                    data = compressor.compress(buf)
+                    fComp.write(data)
+                    hash.update(data)
+                    buf = fDecomp.read(SparseFileReader.s_ReadSize)
+                data = compressor.flush() + FileUtils._gzip_trailer(crc, size)
+                fComp.write(data)
+                hash.update(data)
+        elapsed = max(time.time() - starttime, 0.001)
+        Output.Diagnostic('compressed %s at %.1f MB/s, %s Kb read from sparse holes'%(os.path.basename(inpath), size / elapsed / (1024 * 1024), str(fDecomp.holebytes / 1024)))
+        return hash.hexdigest()
+
+    #compresses content small enough to be held in memory into the same canonical gzip as _compress_and_hash
+    @staticmethod
+    def _compress_data(data, level = 9):
+        compressor = FileUtils._deflater(level)
+        data = FileUtils._gzip_header(level) + compressor.compress(data) + compressor.flush() + FileUtils._gzip_trailer(zlib.crc32(data), len(data))
+        return hashlib.sha1(data).hexdigest(), data
+
+    #returns a description of why the file at path is already compressed, or None if it is worth compressing.  files are
+    #identified by their leading bytes, or if sample is set by the byte entropy of slices sampled across the file being
+    #close to the 8 bits per byte of random data.
+    @staticmethod
+    def _detect_compressed(path, sample = True):
+        with SparseFileReader(path) as f:
+            header = f.read(8)
+            for format, magic in FileUtils.s_CompressedMagic.iteritems():
+                if header.startswith(magic):
+                    return '%s format'%(format)
+            if not sample:
+                return None
+            samples = [ ]
+            for i in range(FileUtils.s_EntropySampleCount):
+                f.seek((f.size - FileUtils.s_EntropySampleSize) * i / max(FileUtils.s_EntropySampleCount - 1, 1))
+                samples.append(f.read(FileUtils.s_EntropySampleSize))
+        entropy = FileUtils._entropy(''.join(samples))
+        return '%.2f bits per byte entropy'%(entropy) if entropy >= FileUtils.s_EntropyThreshold else None
+
+    @staticmethod
+    def _entropy(data):
+        if not data:
+            return 0.0
+        entropy = 0.0
+        for b in range(256):
+            count = data.count(chr(b))
+            if count > 0:
+                p = count / float(len(data))
+                entropy -= p * math.log(p, 2)
+        return entropy
+
+    #compares against a cached zero string, which is a memcmp rather than a per byte scan
+    @staticmethod
+    def _is_zero(data):
+        if len(FileUtils.s_zeros) < len(data):
+            FileUtils.s_zeros = '\0' * len(data)
+        return data == FileUtils.s_zeros[:len(data)]
+
+    #all gzip output is canonical so identical content compressed at the same level always produces the same bytes, and
+    #so the same artifact hash, on any machine at any time.  the header has no name and a zero mtime, and the deflate
+    #parameters are pinned rather than left to library defaults.
+    @staticmethod
+    def _deflater(level):
+        return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, FileUtils.s_DeflateMemLevel, zlib.Z_DEFAULT_STRATEGY)
+
+    @staticmethod
+    def _gzip_header(level = 9):
+        #magic, deflate method, no flags, zero mtime, extra flags for the level as written by gzip, unknown os
+        return struct.pack('<BBBBLBB', 0x1f, 0x8b, 8, 0, 0, 2 if level == 9 else 4 if level == 1 else 0, 255)
+
+    @staticmethod
+    def _gzip_trailer(crc, size):
+        return struct.pack('<LL', crc & 0xffffffff, size & 0xffffffff)
 
     @staticmethod
     def _decompress(inpath, outpath):
         FileUtils._ensure_parent_dir(outpath)
+        if BlockGzip.IsBlockGzip(inpath):
+            BlockGzip.Decompress(inpath, outpath)
+            return
         with gzip.open(inpath, 'rb') as fComp:
             with open(outpath, 'wb') as fDecomp:
                 shutil.copyfileobj(fComp, fDecomp)
@@ -133,22 +282,20 @@ class FileUtils:
             except:
                 return
 
+    #extends the open file f to size bytes, reserving its disk space up front where posix_fallocate is available so running
+    #out of space fails before anything is written rather than part way through.  elsewhere the file is left sparse.
     @staticmethod
-    def _enumerate_unique_files(paths):
-        files = set()
-        for p in paths:
-            p = p.rstrip('\\')
-            p = p.rstrip('/')
-            abspath = os.path.abspath(p)
-            if os.path.isdir(abspath):
-                for dirpath, dirnames, filenames in os.walk(abspath):
-                    for name in filenames:
-                        subpath = os.path.join(dirpath, name)
-                        files.add(subpath)
-            elif os.path.isfile(abspath): 
-                files.add(abspath)   
-        return files
-    
+    def _preallocate(f, size):
+        f.truncate(size)
+        if _posix_fallocate is None or size == 0:
+            return
+        try:
+            _posix_fallocate(f.fileno(), 0, size)
+        except OSError as e:
+            #filesystems which can't allocate without writing are left sparse
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+                raise
+
     @staticmethod
     def _try_remove(path):
         try:
@@ -160,9 +307,769 @@ class FileUtils:
                 raise 
             return False
     
+class FileWalker:
+    s_MaxThreads = 8
+
+    #enumerates the files under paths, yielding each as it is found.  directories are listed on several threads as listing
+    #is bound by the latency of the filesystem rather than the cpu.  each file is yielded once however many paths, hardlinks
+    #or symlinks lead to it, and symlinks to directories aren't followed.  include and exclude are lists of globs matched
+    #against the name of each entry and its path relative to the path it was found under, excluded directories are not
+    #traversed and if include is specified only matching files are yielded.  only files of at least minsize and at most
+    #maxsize bytes are yielded.
+    def __init__(self, paths, include = None, exclude = None, minsize = None, maxsize = None, maxthreads = None):
+        self._roots = [ os.path.abspath(p.rstrip('\\').rstrip('/') or p) for p in paths ]
+        self._include = include or [ ]
+        self._exclude = exclude or [ ]
+        self._minsize = minsize
+        self._maxsize = maxsize
+        self._maxthreads = maxthreads or FileWalker.s_MaxThreads
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._pending = 0
+        self._dirs = Queue.Queue()
+        self._results = Queue.Queue()
+
+    def __iter__(self):
+        for root in self._roots:
+            try:
+                st = os.stat(root)
+            except OSError:
+                continue
+            self._visit(root, [ (root, stat.S_ISDIR(st.st_mode), st) ])
+        if self._pending == 0:
+            self._results.put(None)
+        threads = [ threading.Thread(target=self._list_dirs) for i in range(self._maxthreads if self._pending > 0 else 0) ]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        #files are passed back a directory at a time to keep the queue and lock overhead per file low
+        files = self._results.get()
+        while files is not None:
+            for path in files:
+                yield path
+            files = self._results.get()
+        for thread in threads:
+            thread.join()
+
+    def _list_dirs(self):
+        item = self._dirs.get()
+        while item is not None:
+            root, dirpath = item
+            try:
+                self._visit(root, list(FileWalker._scan(dirpath)))
+            except OSError as e:
+                Output.Diagnostic('failed to list %s: %s'%(dirpath, e))
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    done = self._pending == 0
+            #the last directory to be listed ends the walk, as any directories found in it would have been pending
+            if done:
+                for i in range(self._maxthreads):
+                    self._dirs.put(None)
+                self._results.put(None)
+            item = self._dirs.get()
+
+    #queues the directories and passes back the files of a list of (path, isdir, stat) entries found under root
+    def _visit(self, root, entries):
+        if self._include or self._exclude:
+            entries = [ e for e in entries if self._filter(root, e[0], e[1]) ]
+        files = [ ]
+        dirs = [ ]
+        with self._lock:
+            for path, isdir, st in entries:
+                if isdir or (stat.S_ISREG(st.st_mode) and (self._minsize is None or st.st_size >= self._minsize) and (self._maxsize is None or st.st_size <= self._maxsize)):
+                    #files are identified by device and inode, where the filesystem doesn't report inodes they are identified by path
+                    key = (st.st_dev, st.st_ino) if st.st_ino != 0 else path
+                    if key not in self._seen:
+                        self._seen.add(key)
+                        (dirs if isdir else files).append(path)
+            self._pending += len(dirs)
+        for path in dirs:
+            self._dirs.put((root, path))
+        if len(files) > 0:
+            self._results.put(files)
+
+    def _filter(self, root, path, isdir):
+        relpath = os.path.relpath(path, root).replace('\\', '/')
+        if FileWalker._matches(path, relpath, self._exclude):
+            return False
+        return isdir or not self._include or FileWalker._matches(path, relpath, self._include)
+
+    @staticmethod
+    def _matches(path, relpath, globs):
+        name = os.path.basename(path)
+        return any(fnmatch.fnmatch(name, g) or fnmatch.fnmatch(relpath, g) for g in globs)
+
+    #yields the path of each entry of the directory, whether it is a directory, and its stat following any symlink to a file
+    @staticmethod
+    def _scan(dirpath):
+        if _scandir is not None:
+            for entry in _scandir(dirpath):
+                try:
+                    isdir = entry.is_dir(follow_symlinks=False)
+                    yield entry.path, isdir, entry.stat(follow_symlinks=not isdir)
+                except OSError:
+                    continue
+            return
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+                isdir = stat.S_ISDIR(st.st_mode)
+                yield path, isdir, os.stat(path) if stat.S_ISLNK(st.st_mode) else st
+            except OSError:
+                continue
+
+class SparseFileReader:
+    s_ReadSize = 1024 * 1024
+    #SEEK_DATA and SEEK_HOLE are only exposed by the os module in python 3, these are the linux values
+    s_SeekData = getattr(os, 'SEEK_DATA', 3 if sys.platform.startswith('linux') else None)
+    s_SeekHole = getattr(os, 'SEEK_HOLE', 4 if sys.platform.startswith('linux') else None)
+
+    #read only file which maps the holes of a sparse file when opened and returns zeros for them without reading, so
+    #sparse core files cost no disk reads for their unallocated ranges.  reads always return the requested size unless
+    #the end of the file is reached, so the content seen by callers is identical to reading the file normally.  only block
+    #compression also saves the cpu for holes, its all zero blocks reuse a cached member, a single member gzip still
+    #deflates the zeros as skipping them would change the compressed stream and so the artifact hash.
+    def __init__(self, path):
+        self._file = io.open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.holebytes = 0
+        self._pos = 0
+        self._holestarts = [ ]
+        self._holeends = [ ]
+        self._map_holes()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def read(self, size = -1):
+        remaining = self.size - self._pos if size < 0 else min(size, self.size - self._pos)
+        chunks = [ ]
+        while remaining > 0:
+            i = bisect.bisect_right(self._holestarts, self._pos)
+            if i > 0 and self._pos < self._holeends[i - 1]:
+                count = min(remaining, self._holeends[i - 1] - self._pos)
+                chunks.append('\0' * count)
+                self.holebytes += count
+            else:
+                nexthole = self._holestarts[i] if i < len(self._holestarts) else self.size
+                self._file.seek(self._pos)
+                data = self._file.read(min(remaining, nexthole - self._pos))
+                #the file was truncated while it was being read
+                if not data:
+                    break
+                count = len(data)
+                chunks.append(data)
+            self._pos += count
+            remaining -= count
+        return chunks[0] if len(chunks) == 1 else ''.join(chunks)
+
+    def seek(self, offset):
+        self._pos = max(min(offset, self.size), 0)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def _map_holes(self):
+        if SparseFileReader.s_SeekHole is None:
+            return
+        fd = self._file.fileno()
+        try:
+            pos = 0
+            while pos < self.size:
+                hole = os.lseek(fd, pos, SparseFileReader.s_SeekHole)
+                if hole >= self.size:
+                    break
+                try:
+                    pos = os.lseek(fd, hole, SparseFileReader.s_SeekData)
+                except OSError as e:
+                    #ENXIO means there is no data after the hole
+                    if e.errno != errno.ENXIO:
+                        raise
+                    pos = self.size
+                self._holestarts.append(hole)
+                self._holeends.append(pos)
+        except OSError:
+            #the file system doesn't support finding holes so read the whole file
+            self._holestarts = [ ]
+            self._holeends = [ ]
+        os.lseek(fd, 0, os.SEEK_SET)
+
+class BlockGzip:
+    s_BlockSize = 1024 * 1024 * 4
+    s_MaxThreads = multiprocessing.cpu_count()
+    s_HeaderSize = 24
+    s_TrailerSize = 8
+    s_lock = threading.Lock()
+    s_threadpool = None
+    s_zeromembers = { }
+
+    #block gzip files are a sequence of independent gzip members each holding one fixed size block of the source file, so
+    #any gzip reader sees the original content.  every member header carries a 'DL' extra subfield with the size of the
+    #member and of its uncompressed block, which lets the block index be recovered by hopping from header to header.
+    #index entries are tuples of (offset, size, uncompressed offset, uncompressed size).
+    @staticmethod
+    def Compress(inpath, outpath, level = 9, blocksize = None):
+        blocksize = blocksize or BlockGzip.s_BlockSize
+        threadpool = BlockGzip._get_threadpool()
+        maxpending = threadpool._maxthreads * 2
+        pending = collections.deque()
+        hasher = hashlib.sha1()
+        index = [ ]
+        FileUtils._ensure_parent_dir(outpath)
+        with SparseFileReader(inpath) as fDecomp:
+            with open(outpath, 'wb') as fComp:
+                while True:
+                    block = fDecomp.read(blocksize)
+                    #an empty file is still written as a single empty member so the output is a valid gzip file
+                    if block or not (pending or index):
+                        pending.append(threadpool.submit(BlockGzip._compress_block, block, level))
+                    #write completed members in order, keeping at most maxpending blocks in memory
+                    while pending and (not block or len(pending) >= maxpending):
+                        member, usize = pending.popleft().result()
+                        fComp.write(member)
+                        hasher.update(member)
+                        offset, uoffset = (index[-1][0] + index[-1][1], index[-1][2] + index[-1][3]) if index else (0, 0)
+                        index.append((offset, len(member), uoffset, usize))
+                    if not block:
+                        break
+        return hasher.hexdigest(), index
+
+    @staticmethod
+    def Decompress(inpath, outpath, index = None):
+        index = index or BlockGzip.ReadIndex(inpath)
+        threadpool = BlockGzip._get_threadpool()
+        maxpending = threadpool._maxthreads * 2
+        pending = collections.deque()
+        FileUtils._ensure_parent_dir(outpath)
+        with open(outpath, 'wb') as fDecomp:
+            for entry in index:
+                pending.append(threadpool.submit(BlockGzip._inflate_member, inpath, entry))
+                if len(pending) >= maxpending:
+                    fDecomp.write(pending.popleft().result())
+            while pending:
+                fDecomp.write(pending.popleft().result())
+
+    #reads length bytes of the uncompressed content starting at offset, inflating only the members which overlap the range
+    @staticmethod
+    def Read(path, offset, length, index = None):
+        index = index or BlockGzip.ReadIndex(path)
+        chunks = [ ]
+        for entry in index:
+            if entry[2] + entry[3] <= offset or entry[2] >= offset + length:
+                continue
+            block = BlockGzip._inflate_member(path, entry)
+            chunks.append(block[max(offset - entry[2], 0):offset + length - entry[2]])
+        return ''.join(chunks)
+
+    @staticmethod
+    def ReadIndex(path):
+        index = [ ]
+        offset = 0
+        uoffset = 0
+        with open(path, 'rb') as f:
+            header = f.read(BlockGzip.s_HeaderSize)
+            while header:
+                sizes = BlockGzip._parse_header(header)
+                if sizes is None:
+                    raise IOError('%s is not a block gzip file, invalid member header at offset %d'%(path, offset))
+                index.append((offset, sizes[0], uoffset, sizes[1]))
+                offset += sizes[0]
+                uoffset += sizes[1]
+                f.seek(offset)
+                header = f.read(BlockGzip.s_HeaderSize)
+        return index
+
+    @staticmethod
+    def IsBlockGzip(path):
+        with open(path, 'rb') as f:
+            return BlockGzip._parse_header(f.read(BlockGzip.s_HeaderSize)) is not None
+
+    @staticmethod
+    def _get_threadpool():
+        #compression uses its own pool so transfer threads can block on their blocks without starving the workers
+        with BlockGzip.s_lock:
+            if BlockGzip.s_threadpool is None:
+                BlockGzip.s_threadpool = ThreadPoolExecutor(BlockGzip.s_MaxThreads)
+        return BlockGzip.s_threadpool
+
+    @staticmethod
+    def _compress_block(block, level):
+        #all zero blocks, common in core files, always compress to the same member so each size is only compressed once
+        iszero = FileUtils._is_zero(block)
+        if iszero and (len(block), level) in BlockGzip.s_zeromembers:
+            return BlockGzip.s_zeromembers[(len(block), level)], len(block)
+        compressor = FileUtils._deflater(level)
+        deflated = compressor.compress(block) + compressor.flush()
+        membersize = BlockGzip.s_HeaderSize + len(deflated) + BlockGzip.s_TrailerSize
+        #gzip header with FEXTRA set, mtime 0, unknown os, and a single 8 byte 'DL' subfield holding the member and block sizes
+        header = struct.pack('<BBBBLBBH2sHLL', 0x1f, 0x8b, 8, 4, 0, 0, 255, 12, 'DL', 8, membersize, len(block))
+        member = header + deflated + FileUtils._gzip_trailer(zlib.crc32(block), len(block))
+        if iszero:
+            BlockGzip.s_zeromembers[(len(block), level)] = member
+        return member, len(block)
+
+    @staticmethod
+    def _parse_header(header):
+        if len(header) < BlockGzip.s_HeaderSize:
+            return None
+        id1, id2, cm, flg, mtime, xfl, os, xlen, si, slen, membersize, usize = struct.unpack('<BBBBLBBH2sHLL', header)
+        if (id1, id2, cm, flg, xlen, si, slen) != (0x1f, 0x8b, 8, 4, 12, 'DL', 8):
+            return None
+        return membersize, usize
+
+    @staticmethod
+    def _inflate_member(path, entry):
+        offset, size, uoffset, usize = entry
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            member = f.read(size)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        block = decompressor.decompress(buffer(member, BlockGzip.s_HeaderSize, size - BlockGzip.s_HeaderSize - BlockGzip.s_TrailerSize))
+        crc, isize = struct.unpack('<LL', member[-BlockGzip.s_TrailerSize:])
+        if len(block) != usize or zlib.crc32(block) & 0xffffffff != crc:
+            raise IOError('%s block at offset %d is corrupt'%(path, offset))
+        return block
+
+class ContentChunker:
+    s_PageSize = 1024 * 4
+    s_MinSize = 1024 * 16
+    s_AvgSize = 1024 * 64
+    s_MaxSize = 1024 * 256
+    s_ReadSize = 1024 * 1024
+
+    #yields the content of the file at path in content defined chunks.  this follows FastCDC's normalized chunking, but
+    #the boundary test is evaluated once per page on a crc of the page rather than with a per byte rolling hash, which
+    #keeps the chunking in native code and matches the page aligned layout of core files.  chunks are always whole pages
+    #except for the last chunk of the file.
+    @staticmethod
+    def Chunks(path):
+        pagesize = ContentChunker.s_PageSize
+        bits = int(math.log(ContentChunker.s_AvgSize // pagesize, 2))
+        #below the average size boundaries are harder to hit and above it they are easier, narrowing the size distribution
+        hardmask = (1 << (bits + 1)) - 1
+        easymask = (1 << max(bits - 1, 0)) - 1
+        with SparseFileReader(path) as f:
+            buf = ''
+            start = 0
+            pos = 0
+            eof = False
+            while True:
+                if not eof and len(buf) - pos < pagesize:
+                    more = f.read(ContentChunker.s_ReadSize)
+                    eof = not more
+                    buf = buf[start:] + more
+                    pos -= start
+                    start = 0
+                    continue
+                if pos >= len(buf):
+                    if start < len(buf):
+                        yield buf[start:]
+                    return
+                end = min(pos + pagesize, len(buf))
+                fingerprint = zlib.crc32(buffer(buf, pos, end - pos)) & 0xffffffff
+                pos = end
+                size = pos - start
+                mask = hardmask if size < ContentChunker.s_AvgSize else easymask
+                if size >= ContentChunker.s_MaxSize or (size >= ContentChunker.s_MinSize and fingerprint & mask == 0):
+                    yield buf[start:pos]
+                    start = pos
+
+class CompressedFileStream:
+    s_BufferSize = 1024 * 1024
+    s_BufferCount = 4
+
+    #iterable gzip stream of the file at inpath, the file is read once on a reader thread into a bounded set of reusable
+    #buffers, compressed and hashed on a compressor thread, and the compressed chunks are yielded to the consumer as they
+    #are produced.  hash, size and compressedsize are only valid once the stream has been fully consumed, as is sendtime,
+    #the time the consumer spent on the chunks not counting the time it waited for them to be compressed.  if slots is a
+    #semaphore each buffer is compressed holding it, so the stream shares the cpus with other compression without holding
+    #them while the consumer waits on the network.
+    def __init__(self, inpath, level = 9, buffsize = None, buffcount = None, slots = None):
+        self._inpath = inpath
+        self._level = level
+        self._slots = slots
+        self._buffsize = buffsize or CompressedFileStream.s_BufferSize
+        buffcount = buffcount or CompressedFileStream.s_BufferCount
+        self._free = Queue.Queue()
+        for i in range(buffcount):
+            self._free.put(bytearray(self._buffsize))
+        self._filled = Queue.Queue(buffcount)
+        self._compressed = Queue.Queue(buffcount)
+        self._cancelled = threading.Event()
+        self._exception = None
+        self._hasher = hashlib.sha1()
+        self.hash = None
+        self.size = 0
+        self.compressedsize = 0
+        self.sendtime = 0
+
+    def __iter__(self):
+        for target in (self._read_file, self._compress_buffers):
+            thread = threading.Thread(target=target, args=())
+            thread.setDaemon(True)
+            thread.start()
+        starttime = time.time()
+        waittime = 0
+        try:
+            while True:
+                waitstart = time.time()
+                chunk = self._compressed.get()
+                waittime += time.time() - waitstart
+                if chunk is None:
+                    break
+                yield chunk
+            if self._exception is not None:
+                raise self._exception
+            self.hash = self._hasher.hexdigest()
+            self.sendtime = time.time() - starttime - waittime
+        finally:
+            #if the consumer abandoned the stream early release the producer threads
+            self._cancelled.set()
+
+    def _put(self, queue, item):
+        while not self._cancelled.is_set():
+            try:
+                queue.put(item, True, 0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get(self, queue):
+        while not self._cancelled.is_set():
+            try:
+                return queue.get(True, 0.1)
+            except Queue.Empty:
+                pass
+        return None
+
+    def _read_file(self):
+        try:
+            with SparseFileReader(self._inpath) as fDecomp:
+                buf = self._get(self._free)
+                while buf is not None:
+                    cbyte = fDecomp.readinto(buf)
+                    if not cbyte or not self._put(self._filled, (buf, cbyte)):
+                        break
+                    buf = self._get(self._free)
+        except Exception as e:
+            self._exception = e
+        self._put(self._filled, None)
+
+    def _compress_buffers(self):
+        try:
+            compressor = FileUtils._deflater(self._level)
+            crc = zlib.crc32('')
+            self._emit(FileUtils._gzip_header(self._level))
+            item = self._get(self._filled)
+            while item is not None:
+                buf, cbyte = item
+                data = buffer(buf, 0, cbyte)
+                crc = zlib.crc32(data, crc)
+                self.size += cbyte
+                compressed = self._deflate(compressor.compress, data)
+                #the read buffer can be reused as soon as its contents have been handed to the compressor
+                self._free.put(buf)
+                if compressed:
+                    self._emit(compressed)
+                item = self._get(self._filled)
+            self._emit(self._deflate(compressor.flush) + FileUtils._gzip_trailer(crc, self.size))
+        except Exception as e:
+            self._exception = self._exception or e
+        self._put(self._compressed, None)
+
+    def _deflate(self, func, *args):
+        if self._slots is None:
+            return func(*args)
+        with self._slots:
+            return func(*args)
+
+    def _emit(self, chunk):
+        self._hasher.update(chunk)
+        self.compressedsize += len(chunk)
+        self._put(self._compressed, chunk)
+
+class CompressionTuner:
+    s_Levels = [ 1, 3, 6, 9 ]
+    s_SampleCount = 4
+    s_SampleSize = 1024 * 1024
+    s_MinSampledSize = 1024 * 1024 * 32
+    s_Smoothing = 0.3
+
+    #chooses the gzip level for each file which minimizes the estimated time to compress and upload it.  the compression
+    #speed and ratio of each candidate level are measured on slices sampled across the file, as the start of a core file
+    #is mostly headers and isn't representative of the rest.  the upload speed is the configured link speed in MB/s, or
+    #the smoothed speed of the uploads measured so far.  until an upload speed is known, and for files too small for the
+    #sampling to pay off, the most recently chosen level is used.
+    def __init__(self, level = 9, linkspeed = None, pipelined = False):
+        self.level = level
+        self._lock = threading.Lock()
+        self._linkspeed = linkspeed * 1024 * 1024 if linkspeed else None
+        self._measured = None
+        #when compression and upload overlap the slower of the two dominates, otherwise they add up
+        self._pipelined = pipelined
+
+    def RecordUpload(self, size, elapsed):
+        if elapsed <= 0 or size <= 0:
+            return
+        with self._lock:
+            speed = size / elapsed
+            self._measured = speed if self._measured is None else self._measured + CompressionTuner.s_Smoothing * (speed - self._measured)
+
+    def ChooseLevel(self, path):
+        linkspeed = self._linkspeed or self._measured
+        size = os.path.getsize(path)
+        if linkspeed is None or size < CompressionTuner.s_MinSampledSize:
+            return self.level
+        samples = self._read_samples(path, size)
+        best = None
+        for level in CompressionTuner.s_Levels:
+            elapsed, compressed = self._compress_samples(level, samples)
+            compspeed = sum(len(s) for s in samples) / max(elapsed, 0.0001)
+            ratio = compressed / float(sum(len(s) for s in samples))
+            comptime = size / compspeed
+            uploadtime = size * ratio / linkspeed
+            estimate = max(comptime, uploadtime) if self._pipelined else comptime + uploadtime
+            if best is None or estimate < best[0]:
+                best = (estimate, level, compspeed, ratio)
+        estimate, self.level, compspeed, ratio = best
+        Output.Diagnostic('compression level %d chosen for %s: %.1f MB/s compression, %.0f%% ratio, %.1f MB/s %s upload, estimated %.1fs'%(self.level, os.path.basename(path), compspeed / (1024 * 1024), ratio * 100, linkspeed / (1024 * 1024), 'configured' if self._linkspeed else 'measured', estimate))
+        return self.level
+
+    #returns the time taken to compress the samples at level and their compressed size
+    def _compress_samples(self, level, samples):
+        starttime = time.time()
+        compressed = 0
+        for sample in samples:
+            compressor = FileUtils._deflater(level)
+            compressed += len(compressor.compress(sample)) + len(compressor.flush())
+        return time.time() - starttime, compressed
+
+    def _read_samples(self, path, size):
+        samples = [ ]
+        with SparseFileReader(path) as f:
+            for i in range(CompressionTuner.s_SampleCount):
+                f.seek((size - CompressionTuner.s_SampleSize) * i / max(CompressionTuner.s_SampleCount - 1, 1))
+                samples.append(f.read(CompressionTuner.s_SampleSize))
+        return samples
+
+class ArtifactBundle:
+    s_ManifestName = 'manifest.json'
+    s_BlockSize = 512
+
+    #many small files uploaded as a single tar stream.  the manifest of the hash and localpath of every file is the first
+    #member, followed by the compressed content of each distinct file named by its hash, so the service stores each member
+    #exactly as if the file had been uploaded on its own.
+    def __init__(self):
+        self.manifest = [ ]
+        self.size = 0
+        self._members = collections.OrderedDict()
+
+    def Add(self, localpath, hash, data):
+        self.manifest.append({ 'hash': hash, 'localpath': localpath })
+        if hash not in self._members:
+            self._members[hash] = data
+            self.size += len(data)
+
+    #iterating the bundle yields the tar stream, which is then sent with chunked transfer encoding
+    def __iter__(self):
+        for data in ArtifactBundle._tar_member(ArtifactBundle.s_ManifestName, json.dumps(self.manifest)):
+            yield data
+        for hash, member in self._members.iteritems():
+            for data in ArtifactBundle._tar_member(hash, member):
+                yield data
+        yield '\0' * (ArtifactBundle.s_BlockSize * 2)
+
+    @staticmethod
+    def _tar_member(name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        yield info.tobuf(tarfile.USTAR_FORMAT)
+        yield data
+        if len(data) % ArtifactBundle.s_BlockSize != 0:
+            yield '\0' * (ArtifactBundle.s_BlockSize - len(data) % ArtifactBundle.s_BlockSize)
+
+class TokenBucket:
+    s_BurstSeconds = 0.25
+    s_MinBurst = 1024 * 64
+
+    #caps the bandwidth shared by all transfer threads to rate bytes per second.  tokens accrue at the rate up to a burst
+    #of a quarter of a second, a transfer takes the tokens for what it sends and sleeps for any shortfall.  the tokens
+    #can go into debt so concurrent transfers queue up behind each other and share the rate.
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._capacity = max(self.rate * TokenBucket.s_BurstSeconds, TokenBucket.s_MinBurst)
+        self._tokens = self._capacity
+        self._lock = threading.Lock()
+        self._last = None
+        self._starttime = None
+        self._bytes = 0
+        self._throttled = 0.0
+
+    def Consume(self, count):
+        with self._lock:
+            now = time.time()
+            if self._starttime is None:
+                self._starttime = self._last = now
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self.rate) - count
+            self._last = now
+            self._bytes += count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self._throttled += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    #wraps a request body so it is sent within the bandwidth, bodies can be strings, files or iterables of strings
+    def Throttle(self, body):
+        if isinstance(body, str) or hasattr(body, 'read'):
+            return ThrottledReader(body, self)
+        return self._throttle_iter(body)
+
+    def LogSummary(self):
+        with self._lock:
+            if self._starttime is None:
+                return
+            elapsed = max(time.time() - self._starttime, 0.001)
+            Output.Diagnostic('bandwidth capped at %.2f MB/s, sent %.1f MB at an effective %.2f MB/s, transfers were throttled for %.1f seconds'%(self.rate / (1024 * 1024), self._bytes / (1024.0 * 1024), self._bytes / elapsed / (1024 * 1024), self._throttled))
+
+    def _throttle_iter(self, iterable):
+        for data in iterable:
+            self.Consume(len(data))
+            yield data
+
+class ThrottledReader:
+    #reads a string or file request body within the bandwidth of a token bucket.  the length lets the body still be sent
+    #with a content length rather than chunked.
+    def __init__(self, body, bucket):
+        if isinstance(body, str):
+            self._length = len(body)
+            body = io.BytesIO(body)
+        else:
+            self._length = os.fstat(body.fileno()).st_size - body.tell()
+        self._body = body
+        self._bucket = bucket
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size = -1):
+        data = self._body.read(size)
+        self._bucket.Consume(len(data))
+        return data
+
+class VerifiedFileWriter:
+    #inflates downloaded gzip content into path as it is received, hashing the compressed content as it goes.  the content
+    #is written to path.partial and only moved into place once Commit finds the hash matches, so path never holds a partial
+    #or corrupt file and the compressed content is never written to disk.  content of several gzip members, such as block
+    #gzip artifacts, is inflated member by member.  the inflated content is hashed too so it can be recorded in the hash cache
+    #without reading the file again.
+    def __init__(self, path):
+        FileUtils._ensure_parent_dir(path)
+        self.path = path
+        self.size = 0
+        self._partialpath = path + '.partial'
+        self._file = open(self._partialpath, 'wb')
+        self._hasher = hashlib.sha1()
+        self._contenthasher = hashlib.sha1()
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        self._hasher.update(data)
+        self.size += len(data)
+        while data:
+            self._write_content(self._inflater.decompress(data))
+            #input past the end of a member is the start of the next
+            data = self._inflater.unused_data
+            if data:
+                self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+    def contenthexdigest(self):
+        return self._contenthasher.hexdigest()
+
+    #flushes the inflated content to disk and renames it into place if the downloaded content matches hash, otherwise the
+    #partial file is removed and IOError raised
+    def Commit(self, hash):
+        try:
+            self._write_content(self._inflater.flush())
+            downhash = self._hasher.hexdigest()
+            if downhash != hash:
+                raise IOError('downloaded file did not match expected hash value Expected: %s Actual %s'%(hash, downhash))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            #rename replaces the file atomically other than on windows where it must be removed first
+            if platform.system().lower() == 'windows':
+                FileUtils._try_remove(self.path)
+            os.rename(self._partialpath, self.path)
+        except:
+            self.Abort()
+            raise
+
+    def Abort(self):
+        self._file.close()
+        FileUtils._try_remove(self._partialpath)
+
+    def _write_content(self, content):
+        self._contenthasher.update(content)
+        self._file.write(content)
+
 class DumplingService:
-    def __init__(self, baseurl):
+    s_ConnectTimeout = 30
+    s_RequestTimeout = 120
+    s_ReadSize = 1024 * 1024
+    #content downloads are redirected to storage so pools are kept for the service, storage and a few other hosts
+    s_PoolHosts = 4
+
+    #all requests share one session so connections to the service are kept alive and reused rather than paying a new
+    #tcp and tls handshake per request.  the pool holds maxconnections connections, which should match the number of
+    #concurrent transfers.  requests time out if a connection can't be made within the connect timeout, or if the
+    #service doesn't respond within timeout seconds.  content transfers and commits only have the connect timeout, as the service
+    #may take a long time to process large artifacts before responding.
+    def __init__(self, baseurl, maxconnections = None, timeout = None, bandwidth = None):
         self._dumplingUri = baseurl;
+        self._bandwidth = bandwidth
+        self._timeout = (DumplingService.s_ConnectTimeout, timeout or DumplingService.s_RequestTimeout)
+        self._transfertimeout = (DumplingService.s_ConnectTimeout, None)
+        self._session = requests.Session()
+        self._adapter = requests.adapters.HTTPAdapter(pool_connections=DumplingService.s_PoolHosts, pool_maxsize=maxconnections or ThreadPoolExecutor.s_MaxThreads)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+    #returns the number of requests made and of connections opened by the connection pools
+    def GetConnectionStats(self):
+        stats = { 'requests': 0, 'connections': 0 }
+        for key in self._adapter.poolmanager.pools.keys():
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+        return stats
+
+    def LogConnectionStats(self):
+        stats = self.GetConnectionStats()
+        Output.Diagnostic('%d requests made over %d connections, %d requests reused a connection'%(stats['requests'], stats['connections'], max(stats['requests'] - stats['connections'], 0)))
+        if self._bandwidth is not None:
+            self._bandwidth.LogSummary()
+
+    def _request(self, method, url, transfer = False, **kwargs):
+        #the bandwidth cap applies to the content uploaded by transfers
+        if transfer and self._bandwidth is not None and kwargs.get('data') is not None:
+            kwargs['data'] = self._bandwidth.Throttle(kwargs['data'])
+        return self._session.request(method, url, timeout=self._transfertimeout if transfer else self._timeout, **kwargs)
 
     def DownloadDebugger(self, outputdir):
         url = self._dumplingUri + 'api/tools/debug?'
@@ -182,7 +1089,7 @@ class DumplingService:
                                                                
         Output.Diagnostic('   url: %s'%(url))
                
-        response = requests.get(url);
+        response = self._request('get', url, transfer=True);
                   
         response.raise_for_status()
         
@@ -207,7 +1114,7 @@ class DumplingService:
                           
         Output.Diagnostic('   url: %s'%(url))
         
-        response = requests.get(url);
+        response = self._request('get', url, transfer=True);
 
         Output.Diagnostic('   response: %s'%(response))   
 
@@ -225,7 +1132,7 @@ class DumplingService:
 
         Output.Diagnostic('   url: %s'%(url))
 
-        response = requests.get(url);
+        response = self._request('get', url);
                           
         Output.Diagnostic('   response: %s'%(response))
                                                           
@@ -235,6 +1142,40 @@ class DumplingService:
 
     def UploadArtifact(self, dumpid, localpath, hash, file):
         
+        url = self.GetArtifactUploadUrl(dumpid, localpath, hash)
+
+        Output.Message('uploading artifact %s %s'%(hash, os.path.basename(localpath)))
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, data=file, transfer=True)
+
+        Output.Diagnostic('   response: %s'%(response.content))
+
+        response.raise_for_status()
+
+    def UploadArtifactBundle(self, dumpid, bundle):
+        url = self._dumplingUri  + 'api/'
+
+        #only include the dumpid if the not None
+        if dumpid is not None:
+            url = url + 'dumplings/' + dumpid + '/'
+
+        url = url + 'artifacts/bundles'
+
+        Output.Message('uploading bundle of %d artifacts'%(len(bundle.manifest)))
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, data=bundle, transfer=True)
+
+        Output.Diagnostic('   response: %s'%(response.content))
+
+        response.raise_for_status()
+
+        return response.json()
+
+    def GetArtifactUploadUrl(self, dumpid, localpath, hash):
         qargs = { 'hash': hash, 'localpath': localpath }
         
         url = self._dumplingUri  + 'api/'
@@ -243,43 +1184,288 @@ class DumplingService:
         if dumpid is not None:
             url = url + 'dumplings/' + dumpid + '/'
 
-        url = url + 'artifacts/uploads?' + urllib.urlencode(qargs)
+        return url + 'artifacts/uploads?' + urllib.urlencode(qargs)
 
-        Output.Message('uploading artifact %s %s'%(hash, os.path.basename(localpath)))
+    def GetArtifactLinksUrl(self, dumpid):
+        url = self._dumplingUri  + 'api/'
+
+        #only include the dumpid if the not None
+        if dumpid is not None:
+            url = url + 'dumplings/' + dumpid + '/'
+
+        return url + 'artifacts/links'
+
+    def GetArtifactUrl(self, hash):
+        return self._dumplingUri + 'api/artifacts/' + hash
+
+    def UploadArtifactStream(self, localpath, stream):
+        url = self._dumplingUri + 'api/artifacts/streams'
+
+        Output.Message('streaming artifact %s'%(os.path.basename(localpath)))
 
         Output.Diagnostic('   url: %s'%(url))
 
-        response = requests.post(url, data=file)
+        #passing the stream as an iterable sends it with chunked transfer encoding as it is compressed
+        response = self._request('post', url, data=stream, transfer=True)
 
         Output.Diagnostic('   response: %s'%(response.content))
 
         response.raise_for_status()
 
+        upload = response.json()
+
+        if upload['hash'] != stream.hash:
+            raise IOError('streamed artifact %s did not match expected hash value Expected: %s Actual %s'%(localpath, stream.hash, upload['hash']))
+
+        return upload['uploadId']
+
+    def CommitArtifactStream(self, dumpid, localpath, hash, uploadid):
+        qargs = { 'hash': hash, 'localpath': localpath }
+
+        url = self._dumplingUri  + 'api/'
+
+        #only include the dumpid if the not None
+        if dumpid is not None:
+            url = url + 'dumplings/' + dumpid + '/'
+
+        url = url + 'artifacts/streams/' + uploadid + '/commit?' + urllib.urlencode(qargs)
+
+        Output.Message('committing artifact %s %s'%(hash, os.path.basename(localpath)))
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, transfer=True)
+
+        Output.Diagnostic('   response: %s'%(response.content))
+
+        response.raise_for_status()
     
-    def DownloadArtifact(self, hash, downpath):  
+    def BeginUploadSession(self, localpath, hash, length, chunksize):
+        qargs = { 'hash': hash, 'length': length, 'chunksize': chunksize }
+
+        url = self._dumplingUri + 'api/artifacts/sessions?' + urllib.urlencode(qargs)
+
+        Output.Message('starting upload session %s %s'%(hash, os.path.basename(localpath)))
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url)
+
+        Output.Diagnostic('   response: %s'%(response.content))
+
+        response.raise_for_status()
+
+        return response.json()['sessionId']
+
+    def GetUploadSession(self, sessionid):
+        url = self._dumplingUri + 'api/artifacts/sessions/' + sessionid
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('get', url)
+
+        Output.Diagnostic('   response: %s'%(response.content))
+
+        #the session may have expired or been committed on the service
+        if response.status_code == 404:
+            return None
+
+        response.raise_for_status()
+
+        return response.json()
+
+    def UploadChunk(self, sessionid, index, data):
+        qargs = { 'hash': hashlib.sha1(data).hexdigest() }
+
+        url = self._dumplingUri + 'api/artifacts/sessions/' + sessionid + '/chunks/' + str(index) + '?' + urllib.urlencode(qargs)
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('put', url, data=data, transfer=True)
+
+        Output.Diagnostic('   response: %s'%(response))
+
+        response.raise_for_status()
+
+    def CommitUploadSession(self, dumpid, localpath, hash, sessionid):
+        qargs = { 'localpath': localpath }
+
+        url = self._dumplingUri  + 'api/'
+
+        #only include the dumpid if the not None
+        if dumpid is not None:
+            url = url + 'dumplings/' + dumpid + '/'
+
+        url = url + 'artifacts/sessions/' + sessionid + '/commit?' + urllib.urlencode(qargs)
+
+        Output.Message('committing artifact %s %s'%(hash, os.path.basename(localpath)))
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, transfer=True)
+
+        Output.Diagnostic('   response: %s'%(response.content))
+
+        response.raise_for_status()
+
+    def QueryContentChunks(self, hashes):
+        url = self._dumplingUri + 'api/chunks/query'
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, json=hashes)
+
+        response.raise_for_status()
+
+        missing = response.json()
+
+        Output.Diagnostic('   response: %d of %d chunks missing'%(len(missing), len(hashes)))
+
+        return missing
+
+    def PutContentChunk(self, hash, member):
+        url = self._dumplingUri + 'api/chunks/' + hash
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('put', url, data=member, transfer=True)
+
+        Output.Diagnostic('   response: %s'%(response))
+
+        response.raise_for_status()
+
+    def CommitArtifactRecipe(self, dumpid, localpath, recipe):
+        qargs = { 'localpath': localpath }
+
+        url = self._dumplingUri  + 'api/'
+
+        #only include the dumpid if the not None
+        if dumpid is not None:
+            url = url + 'dumplings/' + dumpid + '/'
+
+        url = url + 'artifacts/recipes?' + urllib.urlencode(qargs)
+
+        Output.Message('committing artifact recipe %s'%(os.path.basename(localpath)))
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, json={ 'chunks': recipe }, transfer=True)
+
+        Output.Diagnostic('   response: %s'%(response.content))
+
+        response.raise_for_status()
+
+        return response.json()
+
+    def QueryArtifacts(self, hashes):
+        url = self._dumplingUri + 'api/artifacts/query'
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, json=hashes)
+
+        response.raise_for_status()
+
+        present = response.json()
+
+        Output.Diagnostic('   response: %d of %d artifacts present'%(len(present), len(hashes)))
+
+        return present
+
+    def LinkArtifacts(self, dumpid, dictArtifacts):
+        url = self.GetArtifactLinksUrl(dumpid)
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('post', url, json=[ { 'hash': hash, 'localpath': localpath } for localpath, hash in dictArtifacts.iteritems() ])
+
+        response.raise_for_status()
+
+        missing = response.json()
+
+        Output.Diagnostic('   response: %d of %d artifacts missing'%(len(missing), len(dictArtifacts)))
+
+        return missing
+
+    def IsDumpIngested(self, dumpid):
+        url = self._dumplingUri  + 'api/dumplings/' + dumpid + '/manifest'
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('get', url)
+
+        response.raise_for_status()
+
+        manifest = response.json()
+
+        #the dump is only ingested once the dump file itself has been stored, not just when the dump has been created
+        return manifest is not None and any(da.get('hash') == dumpid for da in manifest['dumpArtifacts'])
+
+    #received, if given, is called with the size of each block of compressed content as it is received
+    def DownloadArtifact(self, hash, downpath, received = None):  
         if os.path.isdir(downpath):
             self._dumpSvc.DowloadArtifactToDirectory(hash, downpath)
 
             return
 
-        url = self._dumplingUri + 'api/artifacts/' + hash
+        url = self.GetArtifactUrl(hash)
 
         Output.Diagnostic('   url: %s'%(url))
         
-        response = requests.get(url, stream=True)
+        response = self._request('get', url, stream=True, transfer=True)
                                                      
         Output.Diagnostic('   response: %s'%(response))
                                     
         response.raise_for_status()
 
-        DumplingService._stream_compressed_file_from_response(response, hash, downpath)
+        return DumplingService._stream_compressed_file_from_response(response, hash, downpath, received)
         
+    #returns the url the content of the artifact is served from, which is where the service redirects to, so ranges of the
+    #content can be requested from it directly
+    def GetArtifactLocation(self, hash):
+        url = self.GetArtifactUrl(hash)
+
+        Output.Diagnostic('   url: %s'%(url))
+
+        response = self._request('get', url, allow_redirects=False, stream=True)
+
+        response.close()
+
+        Output.Diagnostic('   response: %s'%(response))
+
+        if response.is_redirect:
+            return urlparse.urljoin(url, response.headers['location'])
+
+        response.raise_for_status()
+
+        return url
+
+    #downloads length bytes of the content at url starting at offset, writing them at the same offset of file
+    def DownloadArtifactRange(self, url, offset, length, file):
+        response = self._request('get', url, headers={ 'Range': 'bytes=%d-%d'%(offset, offset + length - 1) }, stream=True, transfer=True)
+
+        response.raise_for_status()
+
+        if response.status_code != 206:
+            raise IOError('range requests are not supported by %s'%(url))
+
+        file.seek(offset)
+
+        received = 0
+
+        for chunk in response.iter_content(DumplingService.s_ReadSize):
+            file.write(chunk)
+            received += len(chunk)
+
+        if received != length:
+            raise IOError('range at offset %d of %s was incomplete, expected %d bytes received %d'%(offset, url, length, received))
+
     def DowloadArtifactToDirectory(self, hash, dirpath):
         url = self._dumplingUri + 'api/artifacts/' + hash
 
         Output.Diagnostic('   url: %s'%(url))
         
-        response = requests.get(url, stream=True)
+        response = self._request('get', url, stream=True, transfer=True)
                                                      
         Output.Diagnostic('   response: %s'%(response))
                                     
@@ -290,11 +1476,14 @@ class DumplingService:
         
         downpath = os.path.join(dirpath, filename)
         
-        DumplingService._stream_compressed_file_from_response(response, hash, downpath)
+        return DumplingService._stream_compressed_file_from_response(response, hash, downpath)
         
     def UploadDump(self, localpath, hash, origin, displayname, file):    
         dumplingid = self.CreateDump(hash, origin, displayname)
 
+        return self.UploadDumpContent(localpath, hash, file)
+
+    def UploadDumpContent(self, localpath, hash, file):
         qargs = { 'hash': hash, 'localpath': localpath  }
 
         url = self._dumplingUri + 'api/dumplings/uploads?' + str(urllib.urlencode(qargs))
@@ -303,7 +1492,7 @@ class DumplingService:
 
         Output.Diagnostic('   url: %s'%(url))
 
-        response = requests.post(url, data=file)
+        response = self._request('post', url, data=file, transfer=True)
                                      
         Output.Diagnostic('   response: %s'%(response))
                     
@@ -320,7 +1509,7 @@ class DumplingService:
 
         Output.Diagnostic('   url: %s'%(url))
         
-        response = requests.get(url)
+        response = self._request('get', url)
                                      
         Output.Diagnostic('   response: %s'%(response))
                     
@@ -337,7 +1526,7 @@ class DumplingService:
 
         Output.Diagnostic('   data: %s'%(_json_format(dictProps)))
 
-        response = requests.post(url, data=dictProps)    
+        response = self._request('post', url, data=dictProps)    
 
         response.raise_for_status()
                           
@@ -348,7 +1537,7 @@ class DumplingService:
         #write the zip archive a temp file
         tempPath = os.path.join(tempfile.gettempdir(), tempfile.mktemp())
         with open(tempPath, 'wb') as fd:
-            for chunk in response.iter_content(1024*8):
+            for chunk in response.iter_content(DumplingService.s_ReadSize):
                 fd.write(chunk)
         
         with open(tempPath, 'rb') as tempFile:
@@ -360,24 +1549,21 @@ class DumplingService:
         
         os.remove(tempPath)
         
+    #returns the hash of the inflated content
     @staticmethod
-    def _stream_compressed_file_from_response(response, hash, path):
-        #write the compressed blob to a temp file
-        tempPath = os.path.join(tempfile.gettempdir(), tempfile.mktemp())
-        hasher = hashlib.sha1()
-        with open(tempPath, 'wb') as fd:    
-            for chunk in response.iter_content(1024*8):
-                hasher.update(chunk)
-                fd.write(chunk)
-        downhash = hasher.hexdigest()
-        
-        if downhash != hash:
-            Output.Critical("ERROR: downloaded file did not match expected hash value Expected: %s Actual %s" % (hash, downhash))
-        else:
-            FileUtils._decompress(tempPath, path)
-            Output.Message('downloaded artifact %s %s'%(hash, os.path.basename(path)))      
-
-        os.remove(tempPath)
+    def _stream_compressed_file_from_response(response, hash, path, received = None):
+        writer = VerifiedFileWriter(path)
+        try:
+            for chunk in response.iter_content(DumplingService.s_ReadSize):
+                writer.write(chunk)
+                if received is not None:
+                    received(len(chunk))
+        except:
+            writer.Abort()
+            raise
+        writer.Commit(hash)
+        Output.Message('downloaded artifact %s %s'%(hash, os.path.basename(path)))
+        return writer.contenthexdigest()
                    
     @staticmethod
     def _stream_file_from_response(response, path):
@@ -386,122 +1572,1612 @@ class DumplingService:
         if os.path.isfile(path):
             os.remove(path)
         with open(path, 'wb') as fd:
-            for chunk in response.iter_content(1024*8):
+            for chunk in response.iter_content(DumplingService.s_ReadSize):
                 fd.write(chunk)     
      
-class Task:
+class UploadJournal:
+    s_JournalDir = os.path.join(os.path.expanduser('~'), '.dumpling', 'uploads')
+
+    #records the state of a chunked upload of a single local file so an interrupted upload can be resumed.  the compressed
+    #file is kept beside the journal until the upload is committed so resuming doesn't need to compress the file again.
+    def __init__(self, path, dictJournal = None):
+        self._lock = threading.Lock()
+        key = hashlib.sha1(os.path.abspath(path)).hexdigest()
+        self._journalpath = os.path.join(UploadJournal.s_JournalDir, key + '.json')
+        self.comppath = os.path.join(UploadJournal.s_JournalDir, key + '.gz')
+        self.__dict__.update(dictJournal or { })
+
+    @staticmethod
+    def Load(path):
+        journal = UploadJournal(path)
+        stats = os.stat(path)
+        try:
+            with open(journal._journalpath, 'r') as fJournal:
+                journal.__dict__.update(json.load(fJournal))
+        except (IOError, ValueError):
+            return None
+        #only resume if the source file is unchanged and the compressed file is still available
+        if journal.size != stats.st_size or journal.mtime != stats.st_mtime or not os.path.isfile(journal.comppath):
+            journal.Delete()
+            return None
+        return journal
+
+    @staticmethod
+    def Create(path, hash, chunksize):
+        stats = os.stat(path)
+        journal = UploadJournal(path, { 'path': os.path.abspath(path), 'size': stats.st_size, 'mtime': stats.st_mtime, 'hash': hash, 'chunksize': chunksize, 'sessionid': None, 'chunks': [ ] })
+        journal.length = os.path.getsize(journal.comppath)
+        return journal
+
+    def ChunkCount(self):
+        return (self.length + self.chunksize - 1) // self.chunksize
+
+    def Acknowledge(self, index):
+        with self._lock:
+            self.chunks.append(index)
+            self.Save()
+
+    def Save(self):
+        FileUtils._ensure_parent_dir(self._journalpath)
+        persisted = dict([(key, value) for key, value in self.__dict__.iteritems() if not key.startswith('_')])
+        #write to a temp file and rename so an interruption never leaves a truncated journal
+        with open(self._journalpath + '.tmp', 'w') as fJournal:
+            _json_format_tofile(persisted, fJournal)
+        if os.path.isfile(self._journalpath):
+            os.remove(self._journalpath)
+        os.rename(self._journalpath + '.tmp', self._journalpath)
+
+    def Delete(self):
+        FileUtils._try_remove(self._journalpath)
+        FileUtils._try_remove(self.comppath)
+
+class HashCache:
+    s_CachePath = os.path.join(os.path.expanduser('~'), '.dumpling', 'hashcache.db')
+
+    #persistent index of file content hashes and the hash of the artifact the content was last uploaded as, keyed by the
+    #file's (device, inode, size, mtime_ns) so unchanged files never need to be read again.  sqlite is used so the index
+    #can safely be shared by concurrent dumpling processes.
+    def __init__(self, path = None):
+        self._path = path or HashCache.s_CachePath
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def Get(self, abspath):
+        key = HashCache._get_key(abspath)
+        row = self._execute('SELECT hash, comphash FROM files WHERE key = ?', (key,)).fetchone()
+        return key, (None if row is None else { 'hash': row[0], 'comphash': row[1] })
+
+    def Set(self, key, hash, comphash):
+        self._execute('INSERT OR REPLACE INTO files (key, hash, comphash) VALUES (?, ?, ?)', (key, hash, comphash))
+
+    def _execute(self, query, args):
+        with self._lock:
+            if self._conn is None:
+                FileUtils._ensure_parent_dir(self._path)
+                self._conn = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+                self._conn.execute('CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, hash TEXT, comphash TEXT)')
+            return self._conn.execute(query, args)
+
+    @staticmethod
+    def _get_key(abspath):
+        stats = os.stat(abspath)
+        mtime_ns = int(round(stats.st_mtime * 1000000000))
+        #platforms which don't report inode numbers fall back to keying on the path
+        if stats.st_ino == 0:
+            return 'path:%s:%d:%d'%(os.path.abspath(abspath), stats.st_size, mtime_ns)
+        return '%d:%d:%d:%d'%(stats.st_dev, stats.st_ino, stats.st_size, mtime_ns)
+
+class ArtifactCache:
+    s_CacheDir = os.path.join(os.path.expanduser('~'), '.dumpling', 'cache')
+    s_MaxSize = 1024 * 1024 * 1024 * 10
+    #the FICLONE ioctl which clones a file on copy on write filesystems such as btrfs and xfs
+    s_Ficlone = 0x40049409
+
+    #store of downloaded artifact content keyed by artifact hash, which can safely be shared by concurrent dumpling
+    #processes.  content enters the store by rename so a file in it is always complete, and an sqlite index records the
+    #size and last use of each so the least recently used content is evicted once the store holds more than maxsize bytes.
+    #cached content is materialized by reflink where the filesystem supports it, otherwise by hardlink, and is only copied
+    #if the store is on another volume.
+    def __init__(self, path = None, maxsize = None):
+        self._dir = path or ArtifactCache.s_CacheDir
+        self._maxsize = maxsize or ArtifactCache.s_MaxSize
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.savedbytes = 0
+
+    #materializes the cached content of hash at path, returning whether it was cached
+    def Get(self, hash, path):
+        try:
+            if self._is_cached(hash):
+                ArtifactCache._materialize(self._get_path(hash), path)
+                self._execute('UPDATE artifacts SET used = ? WHERE hash = ?', (time.time(), hash))
+                with self._lock:
+                    self.hits += 1
+                    self.savedbytes += os.path.getsize(path)
+                return True
+        except (IOError, OSError, sqlite3.Error) as e:
+            Output.Diagnostic('failed to get cached artifact %s: %s'%(hash, e))
+        with self._lock:
+            self.misses += 1
+        return False
+
+    #adds the content at path to the store.  content larger than a quarter of the store isn't cached so a single dump can't
+    #evict the modules shared by many dumps.  the download of the content has already succeeded so failing to cache it is
+    #only reported.
+    def Put(self, hash, path):
+        try:
+            if os.path.getsize(path) > self._maxsize / 4:
+                return
+            if self._is_cached(hash):
+                self._execute('UPDATE artifacts SET used = ? WHERE hash = ?', (time.time(), hash))
+            else:
+                ArtifactCache._materialize(path, self._get_path(hash))
+                stats = os.stat(self._get_path(hash))
+                self._execute('INSERT OR REPLACE INTO artifacts (hash, size, mtime, used) VALUES (?, ?, ?, ?)', (hash, stats.st_size, stats.st_mtime, time.time()))
+            self._evict()
+        except (IOError, OSError, sqlite3.Error) as e:
+            Output.Diagnostic('failed to cache artifact %s: %s'%(hash, e))
+
+    def LogSummary(self):
+        if self.hits + self.misses > 0:
+            Output.Message('artifact cache: %d hits, %d misses, %.1f MB not downloaded'%(self.hits, self.misses, self.savedbytes / (1024.0 * 1024)))
+
+    def _get_path(self, hash):
+        return os.path.join(self._dir, hash[:2], hash)
+
+    #returns whether the store has the content of hash as it was cached.  content hardlinked to a downloaded file which was
+    #then edited in place no longer matches the size and modification time in the index, and is removed.
+    def _is_cached(self, hash):
+        row = self._execute('SELECT size, mtime FROM artifacts WHERE hash = ?', (hash,)).fetchone()
+        if row is None or not os.path.isfile(self._get_path(hash)):
+            return False
+        stats = os.stat(self._get_path(hash))
+        if (stats.st_size, stats.st_mtime) == (row[0], row[1]):
+            return True
+        Output.Diagnostic('cached artifact %s was changed after it was cached'%(hash))
+        self._remove(hash)
+        return False
+
+    #removes the least recently used content until the store is within its size.  another process may be evicting at the
+    #same time, or materializing content as it is removed, which then finds the content missing and downloads it instead.
+    #content which can't be removed, such as a file open on windows, is left to a later eviction.
+    def _evict(self):
+        total = self._execute('SELECT COALESCE(SUM(size), 0) FROM artifacts', ()).fetchone()[0]
+        if total <= self._maxsize:
+            return
+        evicted = [ ]
+        for hash, size in self._execute('SELECT hash, size FROM artifacts ORDER BY used', ()).fetchall():
+            if total <= self._maxsize:
+                break
+            evicted.append(hash)
+            total -= size
+        for hash in evicted:
+            try:
+                self._remove(hash)
+            except OSError as e:
+                Output.Diagnostic('failed to evict cached artifact %s: %s'%(hash, e))
+        Output.Diagnostic('evicted %d artifacts from the cache'%(len(evicted)))
+
+    #the index entry is only removed once the content is, so content which couldn't be removed is still accounted for
+    def _remove(self, hash):
+        FileUtils._try_remove(self._get_path(hash))
+        self._execute('DELETE FROM artifacts WHERE hash = ?', (hash,))
+
+    def _execute(self, query, args):
+        with self._lock:
+            if self._conn is None:
+                FileUtils._ensure_dir(self._dir)
+                self._conn = sqlite3.connect(os.path.join(self._dir, 'cache.db'), timeout=30, isolation_level=None, check_same_thread=False)
+                self._conn.execute('CREATE TABLE IF NOT EXISTS artifacts (hash TEXT PRIMARY KEY, size INTEGER, mtime REAL, used REAL)')
+            return self._conn.execute(query, args)
+
+    #links or copies src to a temp file beside dst and renames it into place, so dst is never seen incomplete
+    @staticmethod
+    def _materialize(src, dst):
+        if not os.path.isfile(src):
+            raise IOError(errno.ENOENT, 'no such file', src)
+        FileUtils._ensure_parent_dir(dst)
+        temppath = tempfile.mktemp(prefix=os.path.basename(dst) + '.', suffix='.partial', dir=os.path.dirname(dst))
+        try:
+            try:
+                ArtifactCache._reflink(src, temppath)
+            except (IOError, OSError):
+                FileUtils._try_remove(temppath)
+                try:
+                    os.link(src, temppath)
+                except (AttributeError, OSError):
+                    shutil.copyfile(src, temppath)
+            if platform.system().lower() == 'windows':
+                FileUtils._try_remove(dst)
+            os.rename(temppath, dst)
+        except:
+            FileUtils._try_remove(temppath)
+            raise
+
+    @staticmethod
+    def _reflink(src, dst):
+        if fcntl is None:
+            raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported on this platform')
+        with open(src, 'rb') as fSrc:
+            with open(dst, 'wb') as fDst:
+                fcntl.ioctl(fDst.fileno(), ArtifactCache.s_Ficlone, fSrc.fileno())
+
+class BloomFilter:
+    s_FilterPath = os.path.join(os.path.expanduser('~'), '.dumpling', 'confirmed.bloom')
+    s_Capacity = 100000
+    s_BitsPerEntry = 15
+    s_HashCount = 10
+
+    #bloom filter of sha1 hashes recently confirmed to exist on the service.  when the current generation reaches capacity
+    #it becomes the previous generation and a new one is started, so only recently confirmed hashes are remembered.
+    def __init__(self, path = None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._bitcount = BloomFilter.s_Capacity * BloomFilter.s_BitsPerEntry
+        self._count = 0
+        self._current = bytearray(self._bitcount // 8 + 1)
+        self._previous = bytearray(len(self._current))
+        if path is not None and os.path.isfile(path):
+            with open(path, 'rb') as fFilter:
+                data = fFilter.read()
+            #a filter saved with different parameters is discarded
+            if len(data) == 4 + 2 * len(self._current):
+                self._count = struct.unpack('<L', data[:4])[0]
+                self._current = bytearray(data[4:4 + len(self._current)])
+                self._previous = bytearray(data[4 + len(self._current):])
+
+    def __contains__(self, hash):
+        positions = self._positions(hash)
+        with self._lock:
+            return any(all(bits[i >> 3] & (1 << (i & 7)) for i in positions) for bits in (self._current, self._previous))
+
+    def Add(self, hash):
+        positions = self._positions(hash)
+        with self._lock:
+            if self._count >= BloomFilter.s_Capacity:
+                self._previous = self._current
+                self._current = bytearray(len(self._previous))
+                self._count = 0
+            for i in positions:
+                self._current[i >> 3] |= 1 << (i & 7)
+            self._count += 1
+
+    def Save(self):
+        if self._path is None:
+            return
+        FileUtils._ensure_parent_dir(self._path)
+        with self._lock:
+            with open(self._path + '.tmp', 'wb') as fFilter:
+                fFilter.write(struct.pack('<L', self._count))
+                fFilter.write(self._current)
+                fFilter.write(self._previous)
+        FileUtils._try_remove(self._path)
+        os.rename(self._path + '.tmp', self._path)
+
+    def _positions(self, hash):
+        #the hashes are already uniformly distributed so double hashing over two slices of the hash is sufficient
+        h1 = int(hash[:16], 16)
+        h2 = int(hash[16:32], 16) | 1
+        return [ (h1 + i * h2) % self._bitcount for i in range(BloomFilter.s_HashCount) ]
+
+class CancelledError(Exception):
+    pass
+
+class TimeoutError(Exception):
+    pass
+
+#waits on condvar, which must be held, until predicate is true returning False if timeout expires first.  the wait is done
+#in short slices as a wait without a timeout on a python 2 lock can't be interrupted by ctrl-c.
+def _wait_condition(condvar, predicate, timeout = None):
+    deadline = None if timeout is None else time.time() + timeout
+    while not predicate():
+        remaining = Future.s_WaitSlice if deadline is None else min(deadline - time.time(), Future.s_WaitSlice)
+        if remaining <= 0:
+            return False
+        condvar.wait(remaining)
+    return True
+
+class Future:
+    s_WaitSlice = 0.1
+    PENDING = 'pending'
+    RUNNING = 'running'
+    CANCELLED = 'cancelled'
+    FINISHED = 'finished'
+
     def __init__(self, func, args):
-        self.completed = False
         self.func = func
         self.args = args
-        self.result = None   
-        self.exception = None
+        self._state = Future.PENDING
+        self._result = None   
+        self._exception = None
+        self._callbacks = [ ]
         self._condvar = threading.Condition(threading.Lock())
 
+    def cancel(self):
+        with self._condvar:
+            if self._state == Future.RUNNING or self._state == Future.FINISHED:
+                return False
+            if self._state == Future.CANCELLED:
+                return True
+            self._state = Future.CANCELLED
+            self._condvar.notify_all()
+        self._invoke_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == Future.CANCELLED
+
+    def running(self):
+        return self._state == Future.RUNNING
+
+    def done(self):
+        return self._state == Future.CANCELLED or self._state == Future.FINISHED
+
+    #the completed attribute of tasks, from before futures were introduced
+    @property
+    def completed(self):
+        return self.done()
+
+    def add_done_callback(self, callback):
+        with self._condvar:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
     def execute(self):
+        with self._condvar:
+            if self._state != Future.PENDING:
+                return
+            self._state = Future.RUNNING
+        result = None
+        exception = None
         try:
-            self.result = self.func(*self.args[0:])
+            result = self.func(*self.args[0:])
         except Exception as e:                              
-            self.exception = e
-            print "workitem failed with exception: %s" % e
+            exception = e
+            Output.Message('workitem failed with exception: %s'%(e))
         finally:
-            self._condvar.acquire()
-            self.completed = True
-            self._condvar.notify_all()
-            self._condvar.release()
+            #release the arguments so completed futures don't hold on to them
+            self.func = self.args = None
+            self._complete(result, exception)
+
+    #futures created without a function are completed by whoever created them, returns False if already completed
+    def set_result(self, result):
+        return self._complete(result, None)
+
+    def set_exception(self, exception):
+        return self._complete(None, exception)
 
     def wait(self, timeout = None):
-        self._condvar.acquire()
-        if not self.completed:
-            self._condvar.wait(timeout)
-        self._condvar.release()
-    
-    def await_result(self, timeout = None):
-        self.wait(timeout)
-        if self.exception:
-            raise self.exception
-        return self.result
-        
-      
-class ThreadPool:
-    s_MaxThreads = multiprocessing.cpu_count()
+        with self._condvar:
+            return _wait_condition(self._condvar, self.done, timeout)
+
+    def result(self, timeout = None):
+        if not self.wait(timeout):
+            raise TimeoutError('work item did not complete within %s seconds'%(timeout))
+        if self._state == Future.CANCELLED:
+            raise CancelledError('work item was cancelled')
+        if self._exception:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout = None):
+        if not self.wait(timeout):
+            raise TimeoutError('work item did not complete within %s seconds'%(timeout))
+        if self._state == Future.CANCELLED:
+            raise CancelledError('work item was cancelled')
+        return self._exception
+
+    await_result = result
+
+    def _complete(self, result, exception):
+        with self._condvar:
+            if self._state == Future.FINISHED or self._state == Future.CANCELLED:
+                return False
+            self._result = result
+            self._exception = exception
+            self._state = Future.FINISHED
+            self._condvar.notify_all()
+        self._invoke_callbacks()
+        return True
+
+    def _invoke_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, [ ]
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                Output.Diagnostic('future callback failed with exception: %s'%(e))
+
+#work items were called tasks before futures were introduced
+Task = Future
+
+#yields the futures as they complete, raising TimeoutError if they haven't all completed within timeout seconds
+def as_completed(futures, timeout = None):
+    deadline = None if timeout is None else time.time() + timeout
+    futures = set(futures)
+    completed = Queue.Queue()
+    for future in futures:
+        future.add_done_callback(completed.put)
+    for i in range(len(futures)):
+        while True:
+            remaining = Future.s_WaitSlice if deadline is None else min(deadline - time.time(), Future.s_WaitSlice)
+            if remaining <= 0:
+                raise TimeoutError('%d of %d futures did not complete within %s seconds'%(len(futures) - i, len(futures), timeout))
+            try:
+                yield completed.get(True, remaining)
+                break
+            except Queue.Empty:
+                pass
 
-    def __init__(self, maxthreads = None):
-        self._condvar = threading.Condition(threading.RLock())
-        self._threadcount = 0
-        self._availcount = 0
+class ThreadPoolExecutor:
+    s_MaxThreads = multiprocessing.cpu_count()
+    s_QueueFactor = 4
+
+    #runs submitted work on up to maxthreads worker threads, which are started as needed and then reused.  at most
+    #maxqueued work items wait in the queue, further submissions block until there is room so producers can't get
+    #arbitrarily far ahead of the workers.  submissions from the workers themselves never block, as that could deadlock.
+    #queued work runs in order of priority, lowest first, and then in order of submission.
+    def __init__(self, maxthreads = None, maxqueued = None):
+        #the statics are looked up on the instance so those of a subclass, such as ThreadPool, apply
+        self._maxthreads = maxthreads or self.s_MaxThreads
+        self._maxqueued = maxqueued or self._maxthreads * self.s_QueueFactor
+        self._condvar = threading.Condition(threading.Lock())
         self._queue = [ ]
-        self._emptyevent = threading.Event()
-        self._emptyevent.set()
-        self._maxthreads = maxthreads or ThreadPool.s_MaxThreads
-    
-    def queue_work(self, func, args=()):
-        self._condvar.acquire()
-                          
-        self._emptyevent.clear()
-        
-        task = Task(func, args)
+        self._sequence = 0
+        self._threads = set()
+        self._idlecount = 0
+        self._pendingcount = 0
+        self._shutdown = False
+        self._cancelled = threading.Event()
+
+    def submit(self, func, *args):
+        return self.submit_priority((), func, *args)
+
+    def submit_priority(self, priority, func, *args):
+        future = Future(func, args)
+        with self._condvar:
+            if self._shutdown:
+                raise RuntimeError('cannot submit work after the executor has been shut down')
+            if threading.current_thread() not in self._threads:
+                _wait_condition(self._condvar, lambda: len(self._queue) < self._maxqueued or self._cancelled.is_set())
+            if self._cancelled.is_set():
+                future.cancel()
+                return future
+            heapq.heappush(self._queue, (priority, self._sequence, future))
+            self._sequence += 1
+            self._pendingcount += 1
+            if self._idlecount == 0 and len(self._threads) < self._maxthreads:
+                self._add_thread()
+            self._condvar.notify_all()
+        return future
+
+    #cancels all queued work and signals running work, which checks is_cancelled at safe points, to stop
+    def cancel(self):
+        self._cancelled.set()
+        with self._condvar:
+            queued, self._queue = self._queue, [ ]
+            self._pendingcount -= len(queued)
+            self._condvar.notify_all()
+        for priority, sequence, future in sorted(queued):
+            future.cancel()
+        return len(queued)
 
-        self._queue.append(task)
-        
-        if self._availcount == 0 and self._threadcount < self._maxthreads:
-            self._threadcount += 1
-            self._add_thread()
+    def is_cancelled(self):
+        return self._cancelled.is_set()
 
-        self._condvar.notify()
+    #waits until all submitted work has completed, returning False if it hasn't within timeout seconds
+    def wait(self, timeout = None):
+        with self._condvar:
+            return _wait_condition(self._condvar, lambda: self._pendingcount == 0, timeout)
 
-        self._condvar.release()
-        
-        return task
-                
-    def wait_on_pending_work(self):
-        self._emptyevent.wait()
+    def shutdown(self, wait = True):
+        with self._condvar:
+            self._shutdown = True
+            self._condvar.notify_all()
+        if wait:
+            self.wait()
 
     def _add_thread(self):
         thread = threading.Thread(target=self._process_queue_items, args=())
         thread.setDaemon(True)
+        self._threads.add(thread)
         thread.start()
 
     def _process_queue_items(self):
         while True:
-            self._condvar.acquire()
-            if len(self._queue) == 0: 
-                self._availcount = self._availcount + 1
-                if self._availcount == self._threadcount:
-                    self._emptyevent.set()
-                self._condvar.wait()
-                self._availcount = self._availcount - 1
-            task = self._queue.pop(0)
-            self._condvar.release()
-            task.execute()
+            with self._condvar:
+                self._idlecount += 1
+                while len(self._queue) == 0 and not self._shutdown:
+                    self._condvar.wait()
+                self._idlecount -= 1
+                if len(self._queue) == 0:
+                    self._threads.discard(threading.current_thread())
+                    return
+                priority, sequence, future = heapq.heappop(self._queue)
+                #wake any producer waiting for room in the queue
+                self._condvar.notify_all()
+            try:
+                future.execute()
+            finally:
+                with self._condvar:
+                    self._pendingcount -= 1
+                    self._condvar.notify_all()
+
+#the interface of the thread pool before it was replaced by the executor
+class ThreadPool(ThreadPoolExecutor):
+    s_MaxThreads = ThreadPoolExecutor.s_MaxThreads
+
+    def queue_work(self, func, args=()):
+        return self.submit(func, *args)
+                
+    def wait_on_pending_work(self):
+        self.wait()
  
         
-class FileTransferManager:
+class ConcurrencyLimiter:
+    s_InitialLimit = 4
+    s_MaxLimit = 32
+    s_Interval = 2.0
+    s_Backoff = 0.5
+    s_Tolerance = 0.1
+
+    #limits the number of concurrent network transfers, adjusting the limit with additive increase and multiplicative
+    #decrease.  the aggregate throughput is measured over fixed intervals, at the end of each interval the limit grows
+    #by one if transfers were waiting for the limit and the throughput didn't fall.  it is halved if any transfer failed
+    #in a way which indicates the service or the network is overloaded, or if raising the limit reduced the throughput.
+    def __init__(self, name, maxlimit = None, initial = None):
+        self.name = name
+        self._maxlimit = maxlimit or ConcurrencyLimiter.s_MaxLimit
+        self.limit = min(initial or ConcurrencyLimiter.s_InitialLimit, self._maxlimit)
+        self._condvar = threading.Condition(threading.Lock())
+        self._inflight = 0
+        self._starttime = None
+        self._lastlimit = self.limit
+        self._lastthroughput = None
+        self._limitseconds = 0.0
+        self._totalbytes = 0
+        self._reset_interval(time.time())
+
+    def Acquire(self, cancelled = None):
+        with self._condvar:
+            if self._starttime is None:
+                self._starttime = self._windowstart = time.time()
+            if self._inflight >= self.limit:
+                self._saturated = True
+                _wait_condition(self._condvar, lambda: self._inflight < self.limit or (cancelled is not None and cancelled()))
+                if self._inflight >= self.limit:
+                    raise CancelledError('transfers were cancelled')
+            self._inflight += 1
+
+    #acquires without blocking returning whether the limit allowed it, for callers which wait for the limit themselves
+    def TryAcquire(self):
+        with self._condvar:
+            if self._starttime is None:
+                self._starttime = self._windowstart = time.time()
+            if self._inflight >= self.limit:
+                self._saturated = True
+                return False
+            self._inflight += 1
+            return True
+
+    def Release(self, size, congested = False):
+        with self._condvar:
+            self._inflight -= 1
+            self._bytes += size
+            self._totalbytes += size
+            self._congested = self._congested or congested
+            now = time.time()
+            if now - self._windowstart >= ConcurrencyLimiter.s_Interval:
+                self._adjust(now)
+            self._condvar.notify_all()
+
+    def LogSummary(self):
+        with self._condvar:
+            if self._starttime is None:
+                return
+            elapsed = max(time.time() - self._starttime, 0.001)
+            average = (self._limitseconds + self.limit * (time.time() - self._windowstart)) / elapsed
+            Output.Diagnostic('%s concurrency settled at %d, averaged %.1f, %.1f MB/s aggregate throughput'%(self.name, self.limit, average, self._totalbytes / elapsed / (1024 * 1024)))
+
+    def _adjust(self, now):
+        elapsed = now - self._windowstart
+        throughput = self._bytes / elapsed
+        limit = self.limit
+        if self._congested:
+            limit = max(int(self.limit * ConcurrencyLimiter.s_Backoff), 1)
+        elif self._lastthroughput is not None and self.limit > self._lastlimit and throughput < self._lastthroughput * (1 - ConcurrencyLimiter.s_Tolerance):
+            limit = max(int(self.limit * ConcurrencyLimiter.s_Backoff), 1)
+        elif self._saturated and (self._lastthroughput is None or throughput >= self._lastthroughput * (1 - ConcurrencyLimiter.s_Tolerance)):
+            limit = min(self.limit + 1, self._maxlimit)
+        if limit != self.limit:
+            Output.Diagnostic('%s concurrency %d -> %d at %.1f MB/s%s'%(self.name, self.limit, limit, throughput / (1024 * 1024), ', congestion detected' if self._congested else ''))
+        self._limitseconds += self.limit * elapsed
+        self._lastlimit = self.limit
+        self._lastthroughput = throughput
+        self.limit = limit
+        self._reset_interval(now)
+
+    def _reset_interval(self, now):
+        self._windowstart = now
+        self._bytes = 0
+        self._saturated = False
+        self._congested = False
+
+class AsyncResponse:
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    #raises the same exception as a requests response so failures are handled the same by either transfer engine
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.exceptions.HTTPError('%d %s for url: %s'%(self.status_code, self.reason, self.url), response=self)
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncHttpRequest:
+    def __init__(self, method, url, body, headers, sink, future):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.headers = headers or { }
+        self.sink = sink
+        self.future = future
+        self.redirects = 0
+        self.retried = False
+        self.bodystart = body.tell() if body is not None and not isinstance(body, str) else None
+        url = urlparse.urlsplit(url)
+        self.key = (url.scheme, url.hostname, url.port or (443 if url.scheme == 'https' else 80))
+        self.path = (url.path or '/') + ('?' + url.query if url.query else '')
+        self.host = url.netloc.split('@')[-1]
+
+    #the request can be sent again if it failed on a reused connection before any of the response was received
+    def can_retry(self):
+        if self.retried or self.future.done():
+            return False
+        if self.bodystart is not None:
+            self.body.seek(self.bodystart)
+        self.retried = True
+        return True
+
+class AsyncHttpConnection:
+    CONNECTING = 0
+    HANDSHAKING = 1
+    IDLE = 2
+    SENDING = 3
+    RECEIVING = 4
+    CLOSED = 5
+
+    #a non-blocking http 1.1 connection driven by the event loop of an AsyncHttpClient.  the loop calls on_ready when the
+    #socket is ready for the events it wants, which advances the connection through connecting, the tls handshake,
+    #sending the request and receiving the response.  while a request is in progress the connection fails if no data is
+    #sent or received for idletimeout seconds.
+    def __init__(self, key, address, sslcontext, idletimeout):
+        self.key = key
+        self.reused = False
+        self.request = None
+        self.response = None
+        self.deadline = time.time() + AsyncHttpClient.s_ConnectTimeout
+        self._sslcontext = sslcontext
+        self._idletimeout = idletimeout
+        family, socktype, proto, canonname, sockaddr = address
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.setblocking(0)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.state = AsyncHttpConnection.CONNECTING
+        self.wantwrite = True
+        err = self.sock.connect_ex(sockaddr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.sock.close()
+            raise socket.error(err, os.strerror(err))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def start(self, request):
+        self.request = request
+        self.response = None
+        self._inbuf = ''
+        self._outbuf = '%s %s HTTP/1.1\r\nHost: %s\r\nAccept-Encoding: identity\r\nUser-Agent: dumpling\r\n'%(request.method.upper(), request.path, request.host)
+        for name, value in request.headers.iteritems():
+            self._outbuf += '%s: %s\r\n'%(name, value)
+        if isinstance(request.body, str):
+            self._outbuf += 'Content-Length: %d\r\n\r\n'%(len(request.body)) + request.body
+        elif request.body is not None:
+            self._outbuf += 'Content-Length: %d\r\n\r\n'%(os.fstat(request.body.fileno()).st_size - request.bodystart)
+        else:
+            self._outbuf += 'Content-Length: 0\r\n\r\n' if request.method.upper() in ('POST', 'PUT') else '\r\n'
+        if self.state == AsyncHttpConnection.IDLE:
+            self.reused = True
+            self._set_state(AsyncHttpConnection.SENDING)
+            self._progressed()
+
+    #advances the connection returning the completed request and its response, or None if the request is still in
+    #progress.  raises on failure, including the service closing an idle connection.
+    def on_ready(self):
+        try:
+            if self.state == AsyncHttpConnection.CONNECTING:
+                err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err != 0:
+                    raise socket.error(err, os.strerror(err))
+                if self.key[0] == 'https':
+                    self.sock = self._sslcontext.wrap_socket(self.sock, server_hostname=self.key[1], do_handshake_on_connect=False)
+                    self._set_state(AsyncHttpConnection.HANDSHAKING)
+                else:
+                    self._connected()
+            if self.state == AsyncHttpConnection.HANDSHAKING:
+                self.sock.do_handshake()
+                self._connected()
+            if self.state == AsyncHttpConnection.IDLE:
+                raise requests.exceptions.ConnectionError('idle connection closed by %s'%(self.key[1]))
+            if self.state == AsyncHttpConnection.SENDING:
+                self._send()
+            if self.state == AsyncHttpConnection.RECEIVING:
+                return self._receive()
+        except ssl.SSLWantReadError:
+            self.wantwrite = False
+        except ssl.SSLWantWriteError:
+            self.wantwrite = True
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        return None
+
+    def close(self):
+        self.state = AsyncHttpConnection.CLOSED
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+    def _set_state(self, state):
+        self.state = state
+        self.wantwrite = state in (AsyncHttpConnection.CONNECTING, AsyncHttpConnection.SENDING)
+
+    def _connected(self):
+        self.deadline = None
+        self._set_state(AsyncHttpConnection.SENDING if self.request is not None else AsyncHttpConnection.IDLE)
+        if self.request is not None:
+            self._progressed()
+
+    def _progressed(self):
+        self.deadline = time.time() + self._idletimeout
+
+    def timed_out(self):
+        if self.state in (AsyncHttpConnection.CONNECTING, AsyncHttpConnection.HANDSHAKING):
+            return requests.exceptions.ConnectTimeout('connecting to %s timed out after %d seconds'%(self.key[1], AsyncHttpClient.s_ConnectTimeout))
+        return requests.exceptions.ReadTimeout('no data was sent to or received from %s for %d seconds'%(self.key[1], self._idletimeout))
+
+    def _send(self):
+        while True:
+            if len(self._outbuf) == 0 and self.request.body is not None and not isinstance(self.request.body, str):
+                self._outbuf = self.request.body.read(AsyncHttpClient.s_BufferSize)
+            if len(self._outbuf) == 0:
+                self._set_state(AsyncHttpConnection.RECEIVING)
+                return
+            sent = self.sock.send(self._outbuf[:AsyncHttpClient.s_BufferSize])
+            self._outbuf = self._outbuf[sent:]
+            self._progressed()
+
+    def _receive(self):
+        while True:
+            data = self.sock.recv(AsyncHttpClient.s_BufferSize)
+            if len(data) == 0:
+                if self.response is not None and self.response['mode'] == 'close':
+                    return self._complete(False)
+                raise requests.exceptions.ConnectionError('connection closed by %s before the response completed'%(self.key[1]))
+            self._progressed()
+            self._inbuf += data
+            response = self._parse()
+            if response is not None:
+                return response
+
+    def _parse(self):
+        if self.response is None:
+            end = self._inbuf.find('\r\n\r\n')
+            if end < 0:
+                return None
+            lines = self._inbuf[:end].split('\r\n')
+            self._inbuf = self._inbuf[end + 4:]
+            status = lines[0].split(' ', 2)
+            headers = dict((name.strip().lower(), value.strip()) for name, sep, value in (l.partition(':') for l in lines[1:]))
+            #interim responses are skipped
+            if status[1] == '100':
+                return self._parse()
+            self.response = { 'version': status[0], 'status': int(status[1]), 'reason': status[2] if len(status) > 2 else '', 'headers': headers, 'content': [ ], 'remaining': 0, 'trailer': False, 'linebreak': False }
+            if self.request.method.upper() == 'HEAD' or self.response['status'] in (204, 304):
+                self.response['mode'] = 'length'
+            elif headers.get('transfer-encoding', '').lower() == 'chunked':
+                self.response['mode'] = 'chunked'
+            elif 'content-length' in headers:
+                self.response['mode'] = 'length'
+                self.response['remaining'] = int(headers['content-length'])
+            else:
+                self.response['mode'] = 'close'
+        response = self.response
+        if response['mode'] == 'close':
+            self._deliver(self._inbuf)
+            self._inbuf = ''
+            return None
+        if response['mode'] == 'length':
+            data = self._inbuf[:response['remaining']]
+            self._inbuf = self._inbuf[len(data):]
+            response['remaining'] -= len(data)
+            self._deliver(data)
+            return self._complete(True) if response['remaining'] == 0 else None
+        while True:
+            if response['trailer']:
+                #the trailer ends with an empty line, usually immediately
+                if self._inbuf.startswith('\r\n'):
+                    self._inbuf = self._inbuf[2:]
+                    return self._complete(True)
+                end = self._inbuf.find('\r\n\r\n')
+                if end < 0:
+                    return None
+                self._inbuf = self._inbuf[end + 4:]
+                return self._complete(True)
+            if response['remaining'] == 0:
+                #the data of each chunk is followed by a line break
+                if response['linebreak']:
+                    if len(self._inbuf) < 2:
+                        return None
+                    self._inbuf = self._inbuf[2:]
+                    response['linebreak'] = False
+                end = self._inbuf.find('\r\n')
+                if end < 0:
+                    return None
+                size = int(self._inbuf[:end].split(';')[0], 16)
+                self._inbuf = self._inbuf[end + 2:]
+                if size == 0:
+                    response['trailer'] = True
+                    continue
+                response['remaining'] = size
+                response['linebreak'] = True
+            data = self._inbuf[:response['remaining']]
+            self._inbuf = self._inbuf[len(data):]
+            response['remaining'] -= len(data)
+            self._deliver(data)
+            if response['remaining'] > 0:
+                return None
+
+    def _deliver(self, data):
+        if len(data) == 0:
+            return
+        if self.request.sink is not None and 200 <= self.response['status'] < 300:
+            self.request.sink.write(data)
+        else:
+            self.response['content'].append(data)
+
+    def _complete(self, keepalive):
+        response = self.response
+        headers = response['headers']
+        keepalive = keepalive and response['version'] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        request = self.request
+        result = AsyncResponse(request.url, response['status'], response['reason'], headers, ''.join(response['content']))
+        self.request = self.response = None
+        self.deadline = None
+        if keepalive:
+            self._set_state(AsyncHttpConnection.IDLE)
+        else:
+            self.close()
+        return request, result
+
+class AsyncHttpClient:
+    s_MaxConnections = 512
+    s_ConnectTimeout = 30
+    s_IdleTimeout = 120
+    s_BufferSize = 1024 * 64
+    s_MaxRedirects = 5
+    s_RedirectCodes = { 301, 302, 303, 307, 308 }
+
+    #makes http requests on a single event loop thread which multiplexes non-blocking keep-alive connections, so thousands
+    #of requests can be in flight without a thread for each.  requests can be made from any thread and complete their
+    #futures on the loop thread, so callbacks added to them must not block.  a request is sent once a connection to its
+    #host is free, up to maxconnections connections are opened.  a request fails if no data is sent or received on its
+    #connection for idletimeout seconds.  connections are made directly, the proxy environment variables aren't honoured
+    #and requests to hosts they would proxy fail, while the ca bundle variables are used to verify https hosts as requests does.
+    def __init__(self, maxconnections = None, idletimeout = None):
+        self.maxconnections = maxconnections or AsyncHttpClient.s_MaxConnections
+        self.idletimeout = idletimeout or AsyncHttpClient.s_IdleTimeout
+        self._lock = threading.Lock()
+        self._submitted = collections.deque()
+        self._waiting = collections.deque()
+        self._connections = set()
+        self._idle = { }
+        self._addresses = { }
+        self._sslcontext = None
+        self._thread = None
+        self._closed = False
+        self._requests = 0
+        self._connects = 0
+        self._wakeread, self._wakewrite = AsyncHttpClient._socket_pair()
+
+    def request(self, method, url, body = None, headers = None, sink = None):
+        future = Future(None, ())
+        with self._lock:
+            if self._closed:
+                raise CancelledError('the client is closed')
+            self._submitted.append(AsyncHttpRequest(method, url, body, headers, sink, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='dumpling-eventloop')
+                self._thread.setDaemon(True)
+                self._thread.start()
+        self._wake()
+        return future
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wake()
+        if thread is not None:
+            thread.join()
+        self._wakeread.close()
+        self._wakewrite.close()
+
+    def GetConnectionStats(self):
+        return { 'requests': self._requests, 'connections': self._connects }
+
+    #returns the proxies the environment configures for url, which the async engine can't use
+    @staticmethod
+    def GetProxies(url):
+        return requests.utils.get_environ_proxies(url)
+
+    def LogConnectionStats(self):
+        stats = self.GetConnectionStats()
+        Output.Diagnostic('%d event loop requests made over %d connections, %d requests reused a connection'%(stats['requests'], stats['connections'], max(stats['requests'] - stats['connections'], 0)))
+
+    def _wake(self):
+        try:
+            self._wakewrite.send('x')
+        except socket.error:
+            #the loop is already being woken if the buffer is full
+            pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._waiting.extend(self._submitted)
+                self._submitted.clear()
+                closed = self._closed
+            if closed:
+                break
+            self._dispatch()
+            for conn in self._wait_ready():
+                try:
+                    completed = conn.on_ready()
+                except Exception as e:
+                    self._fail(conn, e)
+                    continue
+                if completed is not None:
+                    self._complete(conn, *completed)
+            self._expire()
+        for conn in list(self._connections):
+            self._fail(conn, CancelledError('the client was closed'))
+        for request in self._waiting:
+            request.future.set_exception(CancelledError('the client was closed'))
+
+    #sends waiting requests on idle connections to their host or on new connections, closing idle connections to other
+    #hosts to make room if needed
+    def _dispatch(self):
+        while len(self._waiting) > 0:
+            request = self._waiting[0]
+            idle = self._idle.get(request.key)
+            if idle:
+                conn = idle.pop()
+            elif len(self._connections) < self.maxconnections or self._evict_idle():
+                try:
+                    conn = self._connect(request.key)
+                except Exception as e:
+                    self._waiting.popleft()
+                    request.future.set_exception(e if isinstance(e, requests.exceptions.RequestException) else requests.exceptions.ConnectionError(e))
+                    continue
+            else:
+                return
+            self._waiting.popleft()
+            conn.start(request)
+
+    def _connect(self, key):
+        #addresses are resolved once per host, the lookup blocks the loop but the service and storage hosts are few
+        address = self._addresses.get(key)
+        if address is None:
+            if AsyncHttpClient.GetProxies('%s://%s:%d/'%key):
+                raise requests.exceptions.ProxyError('%s would be reached through a proxy, which the async engine does not support'%(key[1]))
+            address = self._addresses[key] = socket.getaddrinfo(key[1], key[2], 0, socket.SOCK_STREAM)[0]
+        if key[0] == 'https' and self._sslcontext is None:
+            self._sslcontext = ssl.create_default_context(cafile=os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE') or requests.certs.where())
+        conn = AsyncHttpConnection(key, address, self._sslcontext, self.idletimeout)
+        self._connections.add(conn)
+        self._connects += 1
+        return conn
+
+    def _evict_idle(self):
+        for key, idle in self._idle.iteritems():
+            if idle:
+                self._close(idle.pop())
+                return True
+        return False
+
+    def _close(self, conn):
+        conn.close()
+        self._connections.discard(conn)
+        idle = self._idle.get(conn.key)
+        if idle and conn in idle:
+            idle.remove(conn)
+
+    def _complete(self, conn, request, response):
+        self._requests += 1
+        if conn.state == AsyncHttpConnection.IDLE:
+            self._idle.setdefault(conn.key, [ ]).append(conn)
+        else:
+            self._close(conn)
+        #downloads are redirected to storage
+        location = response.headers.get('location')
+        if response.status_code in AsyncHttpClient.s_RedirectCodes and location is not None and request.method.upper() in ('GET', 'HEAD') and request.redirects < AsyncHttpClient.s_MaxRedirects:
+            redirect = AsyncHttpRequest(request.method, urlparse.urljoin(request.url, location), None, request.headers, request.sink, request.future)
+            redirect.redirects = request.redirects + 1
+            self._waiting.append(redirect)
+            return
+        request.future.set_result(response)
+
+    def _fail(self, conn, e):
+        request = conn.request
+        self._close(conn)
+        if request is None:
+            return
+        if conn.reused and conn.response is None and request.can_retry():
+            self._waiting.appendleft(request)
+            return
+        if not isinstance(e, (requests.exceptions.RequestException, CancelledError)):
+            e = requests.exceptions.ConnectionError(e)
+        request.future.set_exception(e)
+
+    def _expire(self):
+        now = time.time()
+        for conn in [ c for c in self._connections if c.deadline is not None and c.deadline <= now ]:
+            self._fail(conn, conn.timed_out())
+
+    def _wait_ready(self):
+        conns = dict((c.fileno(), c) for c in self._connections)
+        deadlines = [ c.deadline for c in conns.itervalues() if c.deadline is not None ]
+        timeout = max(min(deadlines) - time.time(), 0) if deadlines else None
+        wakefd = self._wakeread.fileno()
+        #poll isn't limited in the number of descriptors as select is, select is used where poll isn't available
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(wakefd, select.POLLIN)
+            for fd, conn in conns.iteritems():
+                poller.register(fd, select.POLLOUT if conn.wantwrite else select.POLLIN)
+            ready = [ fd for fd, events in poller.poll(None if timeout is None else timeout * 1000) ]
+        else:
+            readable, writable, errored = select.select([ wakefd ] + [ fd for fd, c in conns.iteritems() if not c.wantwrite ], [ fd for fd, c in conns.iteritems() if c.wantwrite ], [ ], timeout)
+            ready = readable + writable
+        if wakefd in ready:
+            try:
+                self._wakeread.recv(4096)
+            except socket.error:
+                pass
+        return [ conns[fd] for fd in ready if fd in conns ]
+
+    @staticmethod
+    def _socket_pair():
+        if hasattr(socket, 'socketpair'):
+            pair = socket.socketpair()
+        else:
+            listener = socket.socket()
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            client = socket.create_connection(listener.getsockname())
+            server, address = listener.accept()
+            listener.close()
+            pair = (server, client)
+        for s in pair:
+            s.setblocking(0)
+        return pair
 
-    def __init__(self, dumpSvc, maxthreads = None):
+class FileTransferManager:
+    s_ChunkSize = 1024 * 1024 * 8
+    s_MaxChunksInFlight = 4
+    s_MaxChunkRetries = 5
+    s_ChunkRetryDelay = 1.0
+    s_ChunkQueryBatch = 256
+    s_UploadBatchSize = 1024
+    #at most this many transfers wait for the dump to be created, QueueFileUploads waits for it beyond that
+    s_MaxWaitingForDump = 1024
+    #compressed artifacts of at least the range threshold are downloaded as ranges of the range size, fetched concurrently
+    s_RangeThreshold = 1024 * 1024 * 64
+    s_RangeSize = 1024 * 1024 * 16
+    s_MaxRangesInFlight = 8
+    #files no larger than the bundle file size are uploaded together in bundles of up to the bundle size or file count,
+    #as long as there are enough of them to be worth bundling
+    s_BundleFileSize = 1024 * 64
+    s_BundleMaxSize = 1024 * 1024 * 16
+    s_BundleMaxFiles = 1024
+    s_BundleMinFiles = 8
+    #transfers are scheduled by priority class and then largest first, the lower the class the sooner it is transferred
+    s_PriorityDump = 0
+    s_PriorityCritical = 1
+    s_PriorityModule = 2
+    s_PriorityOther = 3
+    s_PriorityNames = [ 'dump', 'debug critical', 'module', 'other' ]
+    #the share of the cpus used for compression by background transfers
+    s_BackgroundCpuShare = 0.25
+    s_ModuleExtensions = { '.so', '.dll', '.dylib', '.exe', '.sys', '.pdb', '.dbg', '.debug' }
+    s_ModuleMagic = [ '\x7fELF', 'MZ', '\xcf\xfa\xed\xfe', '\xce\xfa\xed\xfe' ]
+    #http status codes which indicate the service is overloaded or throttling the client
+    s_CongestionStatusCodes = { 429, 502, 503, 504 }
+    #the runtime and debugger support modules needed to debug managed code
+    s_CriticalModules = { 'libcoreclr.so', 'libmscordaccore.so', 'libsos.so', 'libsosplugin.so', 'libcoreclr.dylib', 'libmscordaccore.dylib', 'coreclr.dll', 'mscordaccore.dll', 'sos.dll', 'clr.dll', 'mscordacwks.dll' }
+
+    #deadline is the time by which all transfers should complete, transfers which haven't started by then are cancelled.
+    #files no larger than bundlesize bytes are uploaded in bundles, if bundlesize is None every file is uploaded on its own.
+    def __init__(self, dumpSvc, maxthreads = None, transfermode = None, compression = None, hashcache = None, confirmed = None, compresslevel = None, linkspeed = None, deadline = None, compressthreads = None, bundlesize = None, cache = None):
+        self._deadline = deadline
+        self._cache = cache
+        self._bundlesize = bundlesize
+        #compression is limited to compressthreads files at a time, by default one per cpu, so it takes no more than a share
+        #of the cpus however many transfers the executor has in flight
+        self._compressslots = threading.BoundedSemaphore(compressthreads or ThreadPoolExecutor.s_MaxThreads)
+        self._transfers = { }
+        self._precompressed = { }
+        self._waitingfordump = 0
+        self._waitingcond = threading.Condition(threading.Lock())
+        self._jobs = [ ]
+        self._transferlock = threading.Lock()
         self._hashmap = { }
+        self._hashlock = threading.Lock()
+        self._hashcache = hashcache
+        self._confirmed = confirmed if confirmed is not None else BloomFilter()
+        self._unavailable = set()
         self._dumpSvc = dumpSvc
-        self._threadpool = ThreadPool(maxthreads)
-        self._threadpool._maxthreads
+        #the executor has enough workers for the most concurrent transfers the limiters allow, the limiters then decide
+        #how many of them transfer at once
+        self._maxthreads = maxthreads or ConcurrencyLimiter.s_MaxLimit
+        self._threadpool = ThreadPoolExecutor(self._maxthreads)
+        self._uploadlimiter = ConcurrencyLimiter('upload', maxthreads)
+        self._downloadlimiter = ConcurrencyLimiter('download', maxthreads)
+        self._transfermode = transfermode or 'file'
+        self._compression = compression or 'gzip'
+        self._tuner = None
+        self._level = 9
+        if compresslevel == 'adaptive':
+            self._tuner = CompressionTuner(linkspeed=linkspeed, pipelined=self._transfermode == 'stream')
+        elif compresslevel is not None:
+            self._level = int(compresslevel)
          
-    def QueueFileDownload(self, hash, abspath):
-        return self._threadpool.queue_work(self._dumpSvc.DownloadArtifact, args=(hash, abspath))
+    def QueueFileDownload(self, hash, abspath, priority = None, size = 0):
+        priority = FileTransferManager.s_PriorityOther if priority is None else priority
+        return self._queue_transfer(priority, size, abspath, self._download, hash, abspath, size)
+
+    #queues the downloads of a list of (hash, abspath, priority, size) tuples in schedule order.  each artifact is only
+    #downloaded once, to the first of its paths in schedule order, and then linked to any others, so artifacts shared by
+    #the dumps of a batch download are only transferred once.
+    def QueueFileDownloads(self, downloads):
+        downloads = sorted(downloads, key=lambda d: (d[2], -d[3]))
+        targets = collections.OrderedDict()
+        for hash, abspath, priority, size in downloads:
+            paths = targets.setdefault(hash, (priority, size, [ ]))[2]
+            if abspath not in paths:
+                paths.append(abspath)
+        shared = sum(len(paths) - 1 for priority, size, paths in targets.itervalues())
+        if shared > 0:
+            Output.Diagnostic('%d downloads are of artifacts already being downloaded and will be linked'%(shared))
+        futures = [ ]
+        for hash, (priority, size, paths) in targets.iteritems():
+            if len(paths) == 1:
+                futures.append(self.QueueFileDownload(hash, paths[0], priority, size))
+            else:
+                futures.extend(self._queue_shared_download(hash, paths, priority, size))
+        return futures
+
+    #downloads the artifact to the first of abspaths and then links it to the rest within the one transfer
+    def _queue_shared_download(self, hash, abspaths, priority, size):
+        return [ self._queue_transfer(priority, size, abspaths[0], self._download_shared, hash, abspaths, size) ]
+
+    def _download_shared(self, hash, abspaths, size):
+        self._download(hash, abspaths[0], size)
+        self._link_download(hash, abspaths[0], abspaths[1:])
+
+    #materializes the downloaded artifact at source at each of abspaths, recording them in the hash cache as the same
+    #content as source
+    def _link_download(self, hash, source, abspaths):
+        contenthash = None
+        if self._hashcache is not None:
+            key, entry = self._hashcache.Get(source)
+            contenthash = entry['hash'] if entry is not None and entry['comphash'] == hash else None
+        for abspath in abspaths:
+            ArtifactCache._materialize(source, abspath)
+            self._record_download(hash, abspath, contenthash)
+            Output.Message('linked artifact %s %s'%(hash, os.path.basename(abspath)))
         
-    def QueueFileUpload(self, dumpid, abspath):
-        return self._threadpool.queue_work(self._compress_and_upload, args=(dumpid, abspath))
+    def QueueFileUpload(self, dumpid, abspath, priority = None, size = None):
+        priority = FileTransferManager._get_upload_priority(abspath) if priority is None else priority
+        size = os.path.getsize(abspath) if size is None else size
+        if isinstance(dumpid, Future) and not dumpid.done() and self._reserve_precompress(abspath):
+            transfer = self._track(priority, abspath)
+            transfer.add_done_callback(lambda t: self._discard_precompressed(abspath))
+            self._submit(transfer, priority, size, self._precompress, transfer, priority, size, dumpid, abspath)
+            return transfer
+        return self._queue_registered_transfer(priority, size, abspath, dumpid, self._compress_and_upload, abspath)
+
+    #while the dump is being created a few of its files are compressed ahead, as many as there are executor threads, so
+    #they're ready to upload once it has been.  the rest are compressed when they're uploaded as holding every compressed
+    #file until the dump is created could take as much temp space as all of them.
+    def _reserve_precompress(self, abspath):
+        if self._transfermode != 'file':
+            return False
+        if self._hashcache is not None:
+            key, entry = self._hashcache.Get(abspath)
+            if entry is not None and entry['comphash'] is not None:
+                return False
+        with self._transferlock:
+            if len(self._precompressed) >= self._maxthreads or abspath in self._precompressed:
+                return False
+            self._precompressed[abspath] = None
+        return True
+
+    def _precompress(self, transfer, priority, size, dumpid, abspath):
+        self._check_cancelled()
+        tempPath = os.path.join(tempfile.gettempdir(), tempfile.mktemp())
+        try:
+            hash = self._compress(FileUtils._compress_and_hash, abspath, tempPath, self._compression, self._get_level(abspath))
+        except:
+            FileUtils._try_remove(tempPath)
+            raise
+        with self._transferlock:
+            self._precompressed[abspath] = (hash, tempPath)
+        self._chain_registration(transfer, priority, size, dumpid, self._compress_and_upload, abspath)
+
+    def _take_precompressed(self, abspath):
+        with self._transferlock:
+            return self._precompressed.pop(abspath, None)
+
+    def _discard_precompressed(self, abspath):
+        with self._transferlock:
+            precompressed = self._precompressed.pop(abspath, None)
+        if precompressed is not None:
+            FileUtils._try_remove(precompressed[1])
+
+    #queues the uploads of abspaths as artifacts of the dump dumpid.  dumpid may be the future returned by QueueDumpUpload
+    #for a dump still being uploaded, the files are then compressed and uploaded straight away and only wait for the dump
+    #to be created when they register with it.  abspaths may be a FileWalker or any other iterable, the files are queued
+    #in batches as they are enumerated.  only a limited number of transfers wait in the executor, so a batch is queued
+    #once the batches before it have mostly been transferred.  debug critical modules are queued as soon as they are found
+    #rather than behind those batches, other modules found late in a large walk do wait behind them as holding back the
+    #remaining files would mean enumerating them all before any could start.  while the dump is being created no more than
+    #s_MaxWaitingForDump of the transfers wait for it, the rest are queued as it is created.
+    def QueueFileUploads(self, dumpid, abspaths):
+        futures = [ ]
+        batch = [ ]
+        for p in abspaths:
+            if os.path.basename(p).lower() in FileTransferManager.s_CriticalModules:
+                futures.extend(self._queue_upload_batch(dumpid, [ p ]))
+                continue
+            batch.append(p)
+            if len(batch) >= FileTransferManager.s_UploadBatchSize:
+                futures.extend(self._queue_upload_batch(dumpid, batch))
+                batch = [ ]
+        if len(batch) > 0:
+            futures.extend(self._queue_upload_batch(dumpid, batch))
+        return futures
+
+    def _queue_upload_batch(self, dumpid, abspaths):
+        available = self._find_available(abspaths) if self._hashcache is not None else { }
+        if len(available) > 0 and isinstance(dumpid, Future):
+            #the files are linked once the dump is created, if it isn't they can't be and the dump upload reports why
+            def created(future):
+                if not future.cancelled() and future.exception() is None:
+                    self._threadpool.submit_priority((FileTransferManager.s_PriorityDump, 0), self._link_available, future.result()['dumplingId'], available)
+            dumpid.add_done_callback(created)
+        elif len(available) > 0:
+            self._link_available(dumpid, available)
+        #each batch is sorted up front as only a limited number of transfers are queued in the executor at a time
+        uploads = sorted((FileTransferManager._get_upload_priority(p), -os.path.getsize(p), p) for p in abspaths if p not in available)
+        bundled = [ ]
+        if self._bundlesize is not None and self._compression == 'gzip':
+            bundled = [ u for u in uploads if -u[1] <= self._bundlesize ]
+            if len(bundled) >= FileTransferManager.s_BundleMinFiles:
+                uploads = [ u for u in uploads if -u[1] > self._bundlesize ]
+            else:
+                bundled = [ ]
+        futures = [ ]
+        for priority, negsize, p in uploads:
+            self._wait_for_dump_room(dumpid)
+            futures.append(self.QueueFileUpload(dumpid, p, priority, -negsize))
+        return futures + self._queue_bundles(dumpid, bundled)
+
+    #every transfer waiting for the dump to be created holds a callback, and once it is created they are all queued at
+    #once from the thread which created it, where the executor doesn't limit the queue.  so while the dump is being created
+    #the files stop being queued once s_MaxWaitingForDump transfers are waiting for it.
+    def _wait_for_dump_room(self, dumpid):
+        if not isinstance(dumpid, Future):
+            return
+        with self._waitingcond:
+            _wait_condition(self._waitingcond, lambda: self._waitingfordump < FileTransferManager.s_MaxWaitingForDump or dumpid.done() or self._threadpool.is_cancelled())
+
+    #splits the sorted uploads into bundles, each bundle is scheduled at the priority of its most urgent file
+    def _queue_bundles(self, dumpid, uploads):
+        futures = [ ]
+        while len(uploads) > 0:
+            count = 0
+            size = 0
+            while count < min(len(uploads), FileTransferManager.s_BundleMaxFiles) and size < FileTransferManager.s_BundleMaxSize:
+                size += -uploads[count][1]
+                count += 1
+            batch, uploads = uploads[:count], uploads[count:]
+            abspaths = [ p for priority, negsize, p in batch ]
+            self._wait_for_dump_room(dumpid)
+            futures.append(self._queue_registered_transfer(batch[0][0], size, '%s and %d other bundled files'%(abspaths[0], len(abspaths) - 1), dumpid, self._upload_bundle, abspaths))
+        return futures
+
+    #waits for all queued transfers.  if they haven't completed by the deadline, or within timeout seconds, any still queued
+    #are cancelled and the transfers which didn't complete are reported.  exceeding the timeout also raises TimeoutError.
+    def WaitForPendingTransfers(self, timeout = None):
+        deadline = self._deadline
+        if timeout is not None:
+            deadline = min(deadline or sys.maxint, time.time() + timeout)
+        try:
+            completed = self._wait_for_transfers(deadline)
+            with self._transferlock:
+                jobs, self._jobs = self._jobs, [ ]
+            for name, job in jobs:
+                if not job.wait(None if deadline is None else max(deadline - time.time(), 0)):
+                    Output.Critical('%s did not complete before the deadline'%(name))
+                    completed = False
+        finally:
+            self._confirmed.Save()
+        self._uploadlimiter.LogSummary()
+        self._downloadlimiter.LogSummary()
+        if not completed:
+            self.Cancel()
+            self._report_incomplete_transfers()
+            if timeout is not None:
+                raise TimeoutError('transfers did not complete within %s seconds'%(timeout))
+        return completed
+
+    #transfers waiting for the dump to be created, or for the event loop of the async engine, are completed outside the
+    #executor and can queue more work in it, so both are waited on until neither has anything pending
+    def _wait_for_transfers(self, deadline):
+        while True:
+            if not self._threadpool.wait(None if deadline is None else max(deadline - time.time(), 0)):
+                return False
+            with self._transferlock:
+                pending = [ t for t in self._transfers if not t.done() ]
+            if len(pending) == 0:
+                return True
+            for transfer in pending:
+                if not transfer.wait(None if deadline is None else max(deadline - time.time(), 0)):
+                    return False
+
+    #the future of a transfer is completed by the steps of the transfer rather than by the executor
+    def _track(self, priority, abspath):
+        transfer = Future(None, ())
+        with self._transferlock:
+            self._transfers[transfer] = (priority, abspath)
+        transfer.add_done_callback(self._transfer_done)
+        return transfer
+
+    #runs a step of the transfer in the executor, failing the transfer if the step fails or is cancelled
+    def _submit(self, transfer, priority, size, func, *args):
+        def step_done(step):
+            if step.cancelled():
+                transfer.cancel()
+            elif step.exception() is not None:
+                transfer.set_exception(step.exception())
+        self._threadpool.submit_priority((priority, -size), func, *args).add_done_callback(step_done)
+
+    #calls func with the dump id once the dump is created, without blocking if dumpid is the future of a dump being created
+    def _when_created(self, transfer, dumpid, func, *args):
+        if not isinstance(dumpid, Future):
+            return func(*args + (dumpid,))
+        with self._waitingcond:
+            self._waitingfordump += 1
+        def created(future):
+            with self._waitingcond:
+                self._waitingfordump -= 1
+                self._waitingcond.notify_all()
+            try:
+                dumplingid = future.result()['dumplingId']
+            except Exception as e:
+                transfer.set_exception(e)
+                return
+            func(*args + (dumplingid,))
+        dumpid.add_done_callback(created)
+
+    #queues func with the dump id as its first argument.  if dumpid is the future of a dump still being created, func is
+    #queued once the dump has been created so no executor thread waits for it.
+    def _queue_registered_transfer(self, priority, size, abspath, dumpid, func, *args):
+        if not isinstance(dumpid, Future) or dumpid.done():
+            return self._queue_transfer(priority, size, abspath, func, dumpid, *args)
+        transfer = self._track(priority, abspath)
+        self._chain_registration(transfer, priority, size, dumpid, func, *args)
+        return transfer
+
+    def _chain_registration(self, transfer, priority, size, dumpid, func, *args):
+        def created(dumplingid):
+            self._submit(transfer, priority, size, self._run_registered, transfer, func, (dumplingid,) + args)
+        self._when_created(transfer, dumpid, created)
+
+    def _run_registered(self, transfer, func, args):
+        transfer.set_result(func(*args))
+
+    #runs func on its own thread alongside the transfers, for long running work such as triage which shouldn't hold one
+    #of the transfer threads.  WaitForPendingTransfers joins the job along with the transfers.
+    def QueueJob(self, name, func, *args):
+        future = Future(func, args)
+        thread = threading.Thread(target=future.execute, name=name)
+        thread.setDaemon(True)
+        with self._transferlock:
+            self._jobs.append((name, future))
+        thread.start()
+        return future
+
+    def _queue_transfer(self, priority, size, abspath, func, *args):
+        future = self._threadpool.submit_priority((priority, -size), func, *args)
+        with self._transferlock:
+            self._transfers[future] = (priority, abspath)
+        future.add_done_callback(self._transfer_done)
+        return future
+
+    def _transfer_done(self, future):
+        with self._transferlock:
+            self._transfers.pop(future, None)
+
+    def LogCacheSummary(self):
+        if self._cache is not None:
+            self._cache.LogSummary()
+
+    def _report_incomplete_transfers(self):
+        with self._transferlock:
+            incomplete = sorted(self._transfers.values())
+        if len(incomplete) > 0:
+            Output.Critical('%d transfers did not complete before the deadline:'%(len(incomplete)))
+            for priority, abspath in incomplete:
+                Output.Critical('   %s (%s)'%(abspath, FileTransferManager.s_PriorityNames[priority]))
+
+    @staticmethod
+    def _get_upload_priority(abspath):
+        name = os.path.basename(abspath).lower()
+        if name in FileTransferManager.s_CriticalModules:
+            return FileTransferManager.s_PriorityCritical
+        if os.path.splitext(name)[1] in FileTransferManager.s_ModuleExtensions or '.so.' in name:
+            return FileTransferManager.s_PriorityModule
+        try:
+            with open(abspath, 'rb') as f:
+                magic = f.read(4)
+        except IOError:
+            return FileTransferManager.s_PriorityOther
+        if any(magic.startswith(m) for m in FileTransferManager.s_ModuleMagic):
+            return FileTransferManager.s_PriorityModule
+        return FileTransferManager.s_PriorityOther
 
-    def WaitForPendingTransfers(self):
-        self._threadpool.wait_on_pending_work()
+    @staticmethod
+    def _get_download_priority(dumpArtifact):
+        if dumpArtifact['hash'] == dumpArtifact.get('dumpId'):
+            return FileTransferManager.s_PriorityDump
+        if dumpArtifact.get('debugCritical') or dumpArtifact.get('executableImage'):
+            return FileTransferManager.s_PriorityCritical
+        name = os.path.basename(dumpArtifact['relativePath']).lower()
+        if os.path.splitext(name)[1] in FileTransferManager.s_ModuleExtensions or '.so.' in name:
+            return FileTransferManager.s_PriorityModule
+        return FileTransferManager.s_PriorityOther
+
+    #cancels all queued transfers, transfers in progress stop at their next chunk boundary
+    def Cancel(self):
+        cancelled = self._threadpool.cancel()
+        Output.Message('cancelled %d queued transfers'%(cancelled))
+        self._confirmed.Save()
+
+    def _check_cancelled(self):
+        if self._threadpool.is_cancelled():
+            raise CancelledError('transfers were cancelled')
+
+    #returns the files whose cached artifact hash the service already has, which only need registering with the dump.
+    #hashes in the bloom filter of confirmed hashes skip the existence query, a false positive is caught by the link
+    #request which reports any artifacts the service doesn't have.
+    def _find_available(self, abspaths):
+        candidates = { }
+        for p in abspaths:
+            key, entry = self._hashcache.Get(p)
+            if entry is not None and entry['comphash'] is not None:
+                candidates[p] = entry['comphash']
+        unconfirmed = [ h for h in set(candidates.values()) if h not in self._confirmed ]
+        if len(unconfirmed) > 0:
+            for h in self._dumpSvc.QueryArtifacts(unconfirmed):
+                self._confirmed.Add(h)
+        available = dict((p, h) for p, h in candidates.iteritems() if h in self._confirmed)
+        Output.Diagnostic('%d of %d files are likely already available on the service'%(len(available), len(abspaths)))
+        return available
+
+    #registers the available files with the dump without uploading them, queuing uploads of any the service doesn't have
+    def _link_available(self, dumpid, available):
+        missing = set(self._dumpSvc.LinkArtifacts(FileTransferManager._resolve_dumpid(dumpid), available))
+        self._unavailable.update(missing)
+        Output.Diagnostic('registered %d available files, %d were not available'%(len(available) - len(missing), len(missing)))
+        for p, h in available.iteritems():
+            if h in missing:
+                self.QueueFileUpload(dumpid, p)
+
+    #registers the artifact hash as the file abspath without its content, returning False if the service doesn't have the
+    #artifact.  artifacts are never registered by uploading them without content, the service would record the artifact
+    #before finding the content missing.
+    def _link_artifact(self, dumpid, abspath, hash):
+        return hash not in self._dumpSvc.LinkArtifacts(FileTransferManager._resolve_dumpid(dumpid), { abspath: hash })
+
+    #the dump id of files uploaded with the dump is the future for the creation of the dump
+    @staticmethod
+    def _resolve_dumpid(dumpid):
+        return dumpid.result()['dumplingId'] if isinstance(dumpid, Future) else dumpid
 
     def _compress_and_upload(self, dumpid, abspath):              
+        self._check_cancelled()
+        if self._hashcache is None:
+            return self._upload_content(dumpid, abspath)
+        key, entry = self._hashcache.Get(abspath)
+        contenthash = entry['hash'] if entry is not None and entry['hash'] is not None else FileUtils._hash(abspath)
+        #the first file seen with this content in the run uploads it, any others wait and then register under their own path
+        with self._hashlock:
+            first = self._hashmap.get(contenthash)
+            if first is None:
+                first = self._hashmap[contenthash] = Future(self._upload_cached_content, (dumpid, abspath, key, contenthash, entry))
+                task = first
+            else:
+                task = None
+        if task is not None:
+            task.execute()
+        try:
+            hash = first.result()
+        except CancelledError:
+            raise
+        except Exception:
+            self._check_cancelled()
+            return self._upload_content(dumpid, abspath)
+        if task is None:
+            Output.Diagnostic('content of %s was already uploaded as %s'%(abspath, hash))
+            if not self._link_artifact(dumpid, abspath, hash):
+                return self._upload_content(dumpid, abspath)
+            self._hashcache.Set(HashCache._get_key(abspath), contenthash, hash)
+        return hash
+
+    def _upload_cached_content(self, dumpid, abspath, key, contenthash, entry):
+        if entry is not None and entry['comphash'] is not None and entry['comphash'] not in self._unavailable:
+            #linking only succeeds if the service still has the artifact, otherwise upload it again
+            if self._link_artifact(dumpid, abspath, entry['comphash']):
+                Output.Diagnostic('hash cache hit %s %s'%(entry['comphash'], abspath))
+                self._confirmed.Add(entry['comphash'])
+                return entry['comphash']
+            Output.Diagnostic('cached artifact %s for %s is not available'%(entry['comphash'], abspath))
+            self._unavailable.add(entry['comphash'])
+        hash = self._upload_content(dumpid, abspath)
+        self._hashcache.Set(key, contenthash, hash)
+        self._confirmed.Add(hash)
+        return hash
+
+    def _upload_content(self, dumpid, abspath):
+        if self._transfermode == 'stream':
+            return self._stream_upload(dumpid, abspath)
+        if self._transfermode == 'chunked':
+            journal = self._begin_chunked_upload(abspath)
+            return self._chunked_upload(dumpid, journal)
+        if self._transfermode == 'dedup':
+            return self._dedup_upload(dumpid, abspath)
         hash = None
         Output.Diagnostic('uncompressed file size: %s Kb'%(str(os.path.getsize(abspath) / 1024)))
-        tempPath = os.path.join(tempfile.gettempdir(), tempfile.mktemp())
+        precompressed = self._take_precompressed(abspath)
+        tempPath = precompressed[1] if precompressed is not None else os.path.join(tempfile.gettempdir(), tempfile.mktemp())
         try:
-            hash = FileUtils._compress_and_hash(abspath, tempPath)
+            hash = precompressed[0] if precompressed is not None else self._compress(FileUtils._compress_and_hash, abspath, tempPath, self._compression, self._get_level(abspath))
             Output.Diagnostic('compressed file size:   %s Kb'%(str(os.path.getsize(tempPath) / 1024)))
             with open(tempPath, 'rb') as fUpld:
-                self._dumpSvc.UploadArtifact(dumpid, abspath, hash, fUpld)   
+                self._transfer(self._uploadlimiter, os.path.getsize(tempPath), self._dumpSvc.UploadArtifact, FileTransferManager._resolve_dumpid(dumpid), abspath, hash, fUpld)   
         finally:
             try:
                 os.remove(tempPath)
@@ -509,24 +3185,622 @@ class FileTransferManager:
                 Output.Message('WARNING: failed to remove temp file %s'%(tempPath))
         return hash  
 
+    #compresses the files into a bundle uploaded as a single request, returning the artifact hash of each file by path.  any
+    #files the service didn't store from the bundle are uploaded on their own.
+    def _upload_bundle(self, dumpid, abspaths):
+        self._check_cancelled()
+        bundle, contenthashes = self._compress(self._build_bundle, abspaths)
+        missing = set(self._transfer(self._uploadlimiter, bundle.size, self._dumpSvc.UploadArtifactBundle, FileTransferManager._resolve_dumpid(dumpid), bundle))
+        Output.Diagnostic('uploaded %d files in a bundle of %d Kb'%(len(abspaths) - len(missing), bundle.size / 1024))
+        hashes = { }
+        for entry in bundle.manifest:
+            abspath, hash = entry['localpath'], entry['hash']
+            if hash in missing:
+                hash = self._compress_and_upload(dumpid, abspath)
+            else:
+                self._confirmed.Add(hash)
+                if self._hashcache is not None:
+                    self._hashcache.Set(HashCache._get_key(abspath), contenthashes[abspath], hash)
+            hashes[abspath] = hash
+        return hashes
+
+    def _build_bundle(self, abspaths):
+        bundle = ArtifactBundle()
+        contenthashes = { }
+        for p in abspaths:
+            with open(p, 'rb') as f:
+                data = f.read()
+            contenthashes[p] = hashlib.sha1(data).hexdigest()
+            hash, compressed = FileUtils._compress_data(data, self._get_level(p))
+            bundle.Add(p, hash, compressed)
+        return bundle, contenthashes
+
     def UploadDump(self, dumppath, incpaths, origin, displayname):
-        #
-        hash = None                                                      
+        created, transfer = self.QueueDumpUpload(dumppath, origin, displayname)
+        transfer.result()
+        return created.result()
+
+    #queues the upload of the dump returning two futures, the first completes with the dump data as soon as the dump has
+    #been created on the service, the second when the dump has been uploaded.  the first can be passed as the dump id to
+    #QueueFileUploads so the files of the dump don't wait for the dump to be uploaded.
+    def QueueDumpUpload(self, dumppath, origin, displayname):
         Output.Message('processing dump file %s'%(dumppath))
+        created = Future(None, ())
+        transfer = self._queue_transfer(FileTransferManager.s_PriorityDump, os.path.getsize(dumppath), dumppath, self._upload_dump, dumppath, origin, displayname, created)
+        #anything waiting for the dump to be created must fail rather than wait forever if the dump upload fails first
+        def dump_upload_done(future):
+            if not created.done():
+                created.set_exception(CancelledError('the dump upload was cancelled') if future.cancelled() else future.exception() or IOError('the dump was not created'))
+        transfer.add_done_callback(dump_upload_done)
+        return created, transfer
+
+    def _upload_dump(self, dumppath, origin, displayname, created):
+        if self._hashcache is None:
+            return self._upload_dump_content(dumppath, origin, displayname, created)
+        key, entry = self._hashcache.Get(dumppath)
+        if entry is not None and entry['comphash'] is not None and self._dumpSvc.IsDumpIngested(entry['comphash']):
+            Output.Message('dump %s was already ingested as %s'%(dumppath, entry['comphash']))
+            dumpData = { 'dumplingId': entry['comphash'], 'opToken': None }
+            created.set_result(dumpData)
+            return dumpData
+        dumpData = self._upload_dump_content(dumppath, origin, displayname, created)
+        #the content hash of the dump isn't needed, computing it would mean reading the whole dump again
+        self._hashcache.Set(key, None, dumpData['dumplingId'])
+        return dumpData
+
+    def _create_dump(self, hash, origin, displayname, created):
+        dumpData = self._dumpSvc.CreateDump(hash, origin, displayname)
+        created.set_result(dumpData)
+        return dumpData
+
+    def _upload_dump_content(self, dumppath, origin, displayname, created):
+        hash = None                                                      
+        if self._transfermode == 'stream':
+            return self._stream_upload_dump(dumppath, origin, displayname, created)
+        if self._transfermode == 'chunked':
+            journal = self._begin_chunked_upload(dumppath)
+            dumpData = self._create_dump(journal.hash, origin, displayname, created)
+            self._chunked_upload(journal.hash, journal)
+            return dumpData
+        if self._transfermode == 'dedup':
+            #the service assigns the hash when it assembles the recipe so the dump can only be created afterwards
+            hash = self._dedup_upload(None, dumppath)
+            dumpData = self._create_dump(hash, origin, displayname, created)
+            #the assembled artifact is then associated with the dump
+            if not self._link_artifact(hash, dumppath, hash):
+                raise IOError('the service did not store the dump %s'%(dumppath))
+            return dumpData
         Output.Diagnostic('uncompressed file size: %s Kb'%(str(os.path.getsize(dumppath) / 1024)))
         tempPath = os.path.join(tempfile.gettempdir(), tempfile.mktemp())
-        hash = FileUtils._compress_and_hash(dumppath, tempPath)
-        Output.Diagnostic('compressed file size:   %s Kb'%(str(os.path.getsize(tempPath) / 1024)))
-        with open(tempPath, 'rb') as fUpld:
-            dumpData = self._dumpSvc.UploadDump(dumppath, hash, origin, displayname, fUpld)   
-        os.remove(tempPath)
+        try:
+            hash = self._compress(FileUtils._compress_and_hash, dumppath, tempPath, self._compression, self._get_level(dumppath))
+            Output.Diagnostic('compressed file size:   %s Kb'%(str(os.path.getsize(tempPath) / 1024)))
+            #the files of the dump can register with it as soon as it is created, while the dump itself is uploaded
+            dumpData = self._create_dump(hash, origin, displayname, created)
+            with open(tempPath, 'rb') as fUpld:
+                self._transfer(self._uploadlimiter, os.path.getsize(tempPath), self._dumpSvc.UploadDumpContent, dumppath, hash, fUpld)   
+        finally:
+            FileUtils._try_remove(tempPath)
+        return dumpData
+
+    def _begin_chunked_upload(self, abspath):
+        journal = UploadJournal.Load(abspath)
+        if journal is not None:
+            Output.Message('resuming upload of %s'%(abspath))
+        else:
+            Output.Diagnostic('uncompressed file size: %s Kb'%(str(os.path.getsize(abspath) / 1024)))
+            hash = self._compress(FileUtils._compress_and_hash, abspath, UploadJournal(abspath).comppath, self._compression, self._get_level(abspath))
+            journal = UploadJournal.Create(abspath, hash, FileTransferManager.s_ChunkSize)
+            Output.Diagnostic('compressed file size:   %s Kb'%(str(journal.length / 1024)))
+        #the service is the authority on which chunks have been received, if it no longer knows the session start over
+        session = self._dumpSvc.GetUploadSession(journal.sessionid) if journal.sessionid else None
+        if session is None:
+            journal.sessionid = self._dumpSvc.BeginUploadSession(abspath, journal.hash, journal.length, journal.chunksize)
+            journal.chunks = [ ]
+        else:
+            journal.chunks = session['chunks']
+        journal.Save()
+        return journal
+
+    def _chunked_upload(self, dumpid, journal):
+        remaining = Queue.Queue()
+        for index in range(journal.ChunkCount()):
+            if index not in journal.chunks:
+                remaining.put(index)
+        Output.Diagnostic('uploading %d of %d chunks'%(remaining.qsize(), journal.ChunkCount()))
+        failures = [ ]
+        threads = [ ]
+        for i in range(min(FileTransferManager.s_MaxChunksInFlight, remaining.qsize())):
+            thread = threading.Thread(target=self._upload_chunks, args=(journal, remaining, failures))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        #leave the journal in place so the next attempt resumes from the acknowledged chunks
+        if len(failures) > 0:
+            raise failures[0]
+        self._dumpSvc.CommitUploadSession(FileTransferManager._resolve_dumpid(dumpid), journal.path, journal.hash, journal.sessionid)
+        journal.Delete()
+        return journal.hash
+
+    def _upload_chunks(self, journal, remaining, failures):
+        with open(journal.comppath, 'rb') as fUpld:
+            while len(failures) == 0:
+                if self._threadpool.is_cancelled():
+                    failures.append(CancelledError('transfers were cancelled'))
+                    return
+                try:
+                    index = remaining.get_nowait()
+                except Queue.Empty:
+                    return
+                fUpld.seek(index * journal.chunksize)
+                data = fUpld.read(journal.chunksize)
+                for attempt in range(FileTransferManager.s_MaxChunkRetries):
+                    try:
+                        self._transfer(self._uploadlimiter, len(data), self._dumpSvc.UploadChunk, journal.sessionid, index, data)
+                        journal.Acknowledge(index)
+                        break
+                    except (requests.exceptions.RequestException, IOError) as e:
+                        Output.Diagnostic('chunk %d of %s failed attempt %d: %s'%(index, journal.path, attempt + 1, e))
+                        if attempt + 1 == FileTransferManager.s_MaxChunkRetries:
+                            failures.append(e)
+                        else:
+                            time.sleep(FileTransferManager.s_ChunkRetryDelay * (2 ** attempt))
+
+    def _dedup_upload(self, dumpid, abspath):
+        recipe = [ ]
+        batch = [ ]
+        stats = { 'size': 0, 'uploaded': 0, 'level': self._get_level(abspath) }
+        for chunk in ContentChunker.Chunks(abspath):
+            self._check_cancelled()
+            batch.append((hashlib.sha1(chunk).hexdigest(), chunk))
+            if len(batch) == FileTransferManager.s_ChunkQueryBatch:
+                self._upload_missing_chunks(batch, recipe, stats)
+                batch = [ ]
+        self._upload_missing_chunks(batch, recipe, stats)
+        Output.Diagnostic('deduplicated %s uploaded %s of %s Kb in %d chunks'%(os.path.basename(abspath), str(stats['uploaded'] / 1024), str(stats['size'] / 1024), len(recipe)))
+        return self._dumpSvc.CommitArtifactRecipe(FileTransferManager._resolve_dumpid(dumpid), abspath, recipe)
+
+    def _upload_missing_chunks(self, batch, recipe, stats):
+        missing = set(self._dumpSvc.QueryContentChunks(list(set(hash for hash, chunk in batch)))) if batch else set()
+        for hash, chunk in batch:
+            recipe.append(hash)
+            stats['size'] += len(chunk)
+            #chunks are stored as block gzip members so the assembled artifact is an indexed block gzip file
+            if hash in missing:
+                member, size = self._compress(BlockGzip._compress_block, chunk, stats['level'])
+                self._transfer(self._uploadlimiter, len(member), self._dumpSvc.PutContentChunk, hash, member)
+                stats['uploaded'] += len(member)
+                missing.discard(hash)
+
+    def _get_level(self, abspath):
+        #already compressed files are wrapped in stored gzip blocks.  gzip files can't be passed through as they are because
+        #the service stores the inflated content, so downloads would no longer match the original file.  files are only
+        #sampled for their entropy when the level is chosen adaptively, otherwise only their leading bytes are checked, and
+        #the compression time saved is only estimated for verbose output.
+        reason = FileUtils._detect_compressed(abspath, sample=self._tuner is not None)
+        if reason is None:
+            return self._tuner.ChooseLevel(abspath) if self._tuner is not None else self._level
+        if Output.s_verbose:
+            level = self._tuner.level if self._tuner is not None else self._level
+            Output.Diagnostic('storing %s without compression, %s, saved an estimated %.2fs of level %d compression'%(os.path.basename(abspath), reason, FileTransferManager._estimate_compression_time(abspath, level), level))
+        return 0
+
+    #extrapolates the time to compress the whole file from the time to compress its first block
+    @staticmethod
+    def _estimate_compression_time(abspath, level):
+        with SparseFileReader(abspath) as f:
+            sample = f.read(SparseFileReader.s_ReadSize)
+            size = f.size
+        if not sample or level == 0:
+            return 0.0
+        starttime = time.time()
+        compressor = FileUtils._deflater(level)
+        compressor.compress(sample)
+        compressor.flush()
+        return (time.time() - starttime) * size / len(sample)
+
+    #size is the compressed size of the artifact if known, artifacts of at least the range threshold are downloaded in ranges
+    def _download(self, hash, abspath, size = 0):
+        self._check_cancelled()
+        if os.path.isdir(abspath):
+            return self._transfer(self._downloadlimiter, 0, self._dumpSvc.DownloadArtifact, hash, abspath)
+        if self._cache is not None and self._cache.Get(hash, abspath):
+            Output.Message('artifact %s %s found in the cache'%(hash, os.path.basename(abspath)))
+            self._record_download(hash, abspath, None)
+            return
+        if size >= FileTransferManager.s_RangeThreshold:
+            contenthash = self._ranged_download(hash, abspath, size)
+        else:
+            #the limiter measures the link by the compressed bytes received, not the size of the inflated file
+            received = [ 0 ]
+            def count(size):
+                received[0] += size
+            contenthash = self._transfer(self._downloadlimiter, lambda: received[0], self._dumpSvc.DownloadArtifact, hash, abspath, count)
+        self._record_download(hash, abspath, contenthash)
+        if self._cache is not None:
+            self._cache.Put(hash, abspath)
+
+    #records the artifact a downloaded file came from, and the hash of its content if known, in the hash cache.  a file
+    #materialized from the artifact cache shares the entry of the file it was linked to, which is kept if it's for the same
+    #artifact as it may have the content hash.
+    def _record_download(self, hash, abspath, contenthash):
+        if self._hashcache is None:
+            return
+        key, entry = self._hashcache.Get(abspath)
+        if contenthash is None and entry is not None and entry['comphash'] == hash:
+            return
+        self._hashcache.Set(key, contenthash, hash)
+
+    #returns whether the file at abspath is the downloaded content of the artifact hash, which it is if the hash cache
+    #recorded it as that artifact when it was downloaded and it hasn't changed since.  verify also reads the file and checks
+    #its content against the content hash recorded at download.
+    def IsDownloaded(self, hash, abspath, verify = False):
+        if self._hashcache is None or not os.path.isfile(abspath):
+            return False
+        key, entry = self._hashcache.Get(abspath)
+        if entry is None or entry['comphash'] != hash:
+            return False
+        if verify and (entry['hash'] is None or FileUtils._hash(abspath) != entry['hash']):
+            Output.Diagnostic('%s does not match the content of artifact %s'%(abspath, hash))
+            return False
+        return True
+
+    #downloads the compressed artifact as ranges fetched concurrently and written at their offsets into a file sized up
+    #front.  the ranges are hashed and inflated in order as they arrive, and the file is only moved into place if the hash
+    #of the whole artifact matches.  the compressed artifact is kept in a partial file beside the download until it
+    #completes, so the download needs disk space for both the compressed and the inflated artifact.  the partial file is
+    #preallocated so a lack of space fails the download before any range is fetched.
+    def _ranged_download(self, hash, abspath, size):
+        url = self._dumpSvc.GetArtifactLocation(hash)
+        comppath = abspath + '.gz.partial'
+        FileUtils._ensure_parent_dir(comppath)
+        try:
+            with open(comppath, 'wb') as fComp:
+                FileUtils._preallocate(fComp, size)
+        except:
+            FileUtils._try_remove(comppath)
+            raise
+        ranges = [ (offset, min(FileTransferManager.s_RangeSize, size - offset)) for offset in range(0, size, FileTransferManager.s_RangeSize) ]
+        completed = [ threading.Event() for r in ranges ]
+        remaining = Queue.Queue()
+        for index in range(len(ranges)):
+            remaining.put(index)
+        Output.Diagnostic('downloading %s in %d ranges'%(os.path.basename(abspath), len(ranges)))
+        failures = [ ]
+        threads = [ ]
+        for i in range(min(FileTransferManager.s_MaxRangesInFlight, len(ranges))):
+            thread = threading.Thread(target=self._download_ranges, args=(url, comppath, ranges, remaining, completed, failures))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        writer = VerifiedFileWriter(abspath)
+        try:
+            with open(comppath, 'rb') as fComp:
+                for (offset, length), done in zip(ranges, completed):
+                    while not done.wait(Future.s_WaitSlice):
+                        if len(failures) > 0:
+                            raise failures[0]
+                    fComp.seek(offset)
+                    while length > 0:
+                        data = fComp.read(min(length, DumplingService.s_ReadSize))
+                        writer.write(data)
+                        length -= len(data)
+            writer.Commit(hash)
+        except:
+            failures.append(IOError('download of %s failed'%(abspath)))
+            writer.Abort()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            FileUtils._try_remove(comppath)
+        Output.Message('downloaded artifact %s %s'%(hash, os.path.basename(abspath)))
+        return writer.contenthexdigest()
+
+    def _download_ranges(self, url, comppath, ranges, remaining, completed, failures):
+        with open(comppath, 'r+b') as fComp:
+            while len(failures) == 0:
+                if self._threadpool.is_cancelled():
+                    failures.append(CancelledError('transfers were cancelled'))
+                    return
+                try:
+                    index = remaining.get_nowait()
+                except Queue.Empty:
+                    return
+                offset, length = ranges[index]
+                for attempt in range(FileTransferManager.s_MaxChunkRetries):
+                    try:
+                        self._transfer(self._downloadlimiter, length, self._dumpSvc.DownloadArtifactRange, url, offset, length, fComp)
+                        #the range must be on disk before it is read back through another handle
+                        fComp.flush()
+                        completed[index].set()
+                        break
+                    except (requests.exceptions.RequestException, IOError) as e:
+                        Output.Diagnostic('range %d of %s failed attempt %d: %s'%(index, url, attempt + 1, e))
+                        if attempt + 1 == FileTransferManager.s_MaxChunkRetries:
+                            failures.append(e)
+                        else:
+                            time.sleep(FileTransferManager.s_ChunkRetryDelay * (2 ** attempt))
+                    except Exception as e:
+                        failures.append(e)
+                        return
+
+    #runs a network transfer within the limiter's concurrency limit, reporting its size, or a function returning its size
+    #once complete, and whether it failed due to congestion.  the upload speeds are also reported to the compression
+    #tuner, other than those of streamed uploads which would include the compression time and are reported by the caller.
+    def _transfer(self, limiter, size, func, *args):
+        limiter.Acquire(self._threadpool.is_cancelled)
+        starttime = time.time()
+        transferred = 0
+        congested = False
+        try:
+            result = func(*args)
+            transferred = size() if callable(size) else size
+            return result
+        except requests.exceptions.RequestException as e:
+            congested = FileTransferManager._is_congestion(e)
+            raise
+        finally:
+            limiter.Release(transferred, congested)
+            if limiter is self._uploadlimiter and not callable(size) and transferred > 0:
+                self._record_upload(transferred, time.time() - starttime)
+
+    @staticmethod
+    def _is_congestion(e):
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        return isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code in FileTransferManager.s_CongestionStatusCodes
+
+    def _compress(self, func, *args):
+        with self._compressslots:
+            return func(*args)
+
+    def _record_upload(self, size, elapsed):
+        if self._tuner is not None:
+            self._tuner.RecordUpload(size, elapsed)
+
+    def _stream_upload(self, dumpid, abspath):
+        Output.Diagnostic('uncompressed file size: %s Kb'%(str(os.path.getsize(abspath) / 1024)))
+        #the stream is compressed as it is uploaded, taking a share of the cpus only while it compresses each buffer
+        stream = CompressedFileStream(abspath, self._get_level(abspath), slots=self._compressslots)
+        uploadid = self._transfer(self._uploadlimiter, lambda: stream.compressedsize, self._dumpSvc.UploadArtifactStream, abspath, stream)
+        self._record_upload(stream.compressedsize, stream.sendtime)
+        Output.Diagnostic('compressed file size:   %s Kb'%(str(stream.compressedsize / 1024)))
+        self._dumpSvc.CommitArtifactStream(FileTransferManager._resolve_dumpid(dumpid), abspath, stream.hash, uploadid)
+        return stream.hash
+
+    def _stream_upload_dump(self, dumppath, origin, displayname, created):
+        Output.Diagnostic('uncompressed file size: %s Kb'%(str(os.path.getsize(dumppath) / 1024)))
+        stream = CompressedFileStream(dumppath, self._get_level(dumppath), slots=self._compressslots)
+        uploadid = self._transfer(self._uploadlimiter, lambda: stream.compressedsize, self._dumpSvc.UploadArtifactStream, dumppath, stream)
+        self._record_upload(stream.compressedsize, stream.sendtime)
+        Output.Diagnostic('compressed file size:   %s Kb'%(str(stream.compressedsize / 1024)))
+        #the dump id is the hash of the compressed dump so the dump can only be created once the stream is complete
+        dumpData = self._create_dump(stream.hash, origin, displayname, created)
+        self._dumpSvc.CommitArtifactStream(stream.hash, dumppath, stream.hash, uploadid)
         return dumpData
 
+class AsyncFileTransferManager(FileTransferManager):
+    #transfers files with the network requests made on the event loop of an AsyncHttpClient, the executor's threads only
+    #compress, hash and decompress so the number of transfers in flight isn't bounded by the number of threads.  the
+    #limiters still decide how many requests are in flight, transfers waiting for the limit are queued in schedule order
+    #and started as others complete.  uploads in the stream, chunked and dedup transfer modes, bundles of small files,
+    #downloads to a directory, ranged downloads of large artifacts and the dump itself are transferred by the threaded engine.
+    def __init__(self, dumpSvc, client = None, maxthreads = None, **kwargs):
+        FileTransferManager.__init__(self, dumpSvc, maxthreads=maxthreads or ThreadPoolExecutor.s_MaxThreads, **kwargs)
+        self._client = client or AsyncHttpClient()
+        self._uploadlimiter = ConcurrencyLimiter('upload', self._client.maxconnections)
+        self._downloadlimiter = ConcurrencyLimiter('download', self._client.maxconnections)
+        self._limited = { self._uploadlimiter: [ ], self._downloadlimiter: [ ] }
+        self._sequence = 0
+
+    def QueueFileDownload(self, hash, abspath, priority = None, size = 0):
+        if os.path.isdir(abspath) or size >= FileTransferManager.s_RangeThreshold:
+            return FileTransferManager.QueueFileDownload(self, hash, abspath, priority, size)
+        priority = FileTransferManager.s_PriorityOther if priority is None else priority
+        transfer = self._track(priority, abspath)
+        if self._cache is not None and self._cache.Get(hash, abspath):
+            Output.Message('artifact %s %s found in the cache'%(hash, os.path.basename(abspath)))
+            self._record_download(hash, abspath, None)
+            transfer.set_result(None)
+            return transfer
+        self._limit(self._downloadlimiter, transfer, priority, size, self._start_download, transfer, priority, hash, abspath)
+        return transfer
+
+    #the first path is downloaded as any other, the rest are tracked as transfers of their own which complete once the
+    #content is linked to them
+    def _queue_shared_download(self, hash, abspaths, priority, size):
+        if size >= FileTransferManager.s_RangeThreshold:
+            return FileTransferManager._queue_shared_download(self, hash, abspaths, priority, size)
+        first = self.QueueFileDownload(hash, abspaths[0], priority, size)
+        links = [ self._track(priority, abspath) for abspath in abspaths[1:] ]
+        def downloaded(first):
+            try:
+                error = first.exception()
+                if error is None:
+                    self._link_download(hash, abspaths[0], abspaths[1:])
+            except Exception as e:
+                error = e
+            for link in links:
+                if error is None:
+                    link.set_result(None)
+                else:
+                    link.set_exception(error)
+        first.add_done_callback(downloaded)
+        return [ first ] + links
+
+    def QueueFileUpload(self, dumpid, abspath, priority = None, size = None):
+        if self._transfermode != 'file':
+            return FileTransferManager.QueueFileUpload(self, dumpid, abspath, priority, size)
+        priority = FileTransferManager._get_upload_priority(abspath) if priority is None else priority
+        size = os.path.getsize(abspath) if size is None else size
+        transfer = self._track(priority, abspath)
+        self._submit(transfer, priority, size, self._prepare_upload, transfer, priority, dumpid, abspath)
+        return transfer
+
+    def WaitForPendingTransfers(self, timeout = None):
+        try:
+            return FileTransferManager.WaitForPendingTransfers(self, timeout)
+        finally:
+            self._client.LogConnectionStats()
+
+    def Cancel(self):
+        with self._transferlock:
+            limited = [ item for queue in self._limited.itervalues() for item in queue ]
+            for queue in self._limited.itervalues():
+                del queue[:]
+        for item in limited:
+            item[3].cancel()
+        Output.Message('cancelled %d transfers waiting for the network'%(len(limited)))
+        FileTransferManager.Cancel(self)
+
+    #starts the request once the limiter allows it, the request must release the limiter when it completes
+    def _limit(self, limiter, transfer, priority, size, start, *args):
+        with self._transferlock:
+            self._sequence += 1
+            heapq.heappush(self._limited[limiter], (priority, -size, self._sequence, transfer, start, args))
+        self._start_limited(limiter)
+
+    def _start_limited(self, limiter):
+        while True:
+            with self._transferlock:
+                queue = self._limited[limiter]
+                if len(queue) == 0 or not limiter.TryAcquire():
+                    return
+                priority, negsize, sequence, transfer, start, args = heapq.heappop(queue)
+            if transfer.done():
+                limiter.Release(0)
+                continue
+            try:
+                start(*args)
+            except Exception as e:
+                limiter.Release(0)
+                transfer.set_exception(e)
+
+    #makes a request within the limiter, calling done with the response or the exception on the event loop.  size is the
+    #size of the transfer or a function returning it once complete.
+    def _request(self, limiter, size, done, method, url, body = None, sink = None, headers = None):
+        starttime = time.time()
+        def request_done(future):
+            transferred = 0
+            congested = False
+            try:
+                response = future.result()
+                response.raise_for_status()
+                transferred = size() if callable(size) else size
+            except Exception as e:
+                congested = isinstance(e, requests.exceptions.RequestException) and FileTransferManager._is_congestion(e)
+                response = e
+            limiter.Release(transferred, congested)
+            if limiter is self._uploadlimiter and transferred > 0:
+                self._record_upload(transferred, time.time() - starttime)
+            self._start_limited(limiter)
+            done(response)
+        self._client.request(method, url, body=body, headers=headers, sink=sink).add_done_callback(request_done)
+
+    def _prepare_upload(self, transfer, priority, dumpid, abspath):
+        self._check_cancelled()
+        key = entry = contenthash = None
+        if self._hashcache is not None:
+            key, entry = self._hashcache.Get(abspath)
+            contenthash = entry['hash'] if entry is not None and entry['hash'] is not None else FileUtils._hash(abspath)
+            #as with the threaded engine an artifact the service had is linked without its content
+            if entry is not None and entry['comphash'] is not None and entry['comphash'] not in self._unavailable:
+                return self._when_created(transfer, dumpid, self._limit, self._uploadlimiter, transfer, priority, 0, self._send_link, transfer, priority, abspath, entry['comphash'], key, contenthash)
+        self._compress_for_upload(transfer, priority, dumpid, abspath, key, contenthash)
+
+    def _compress_for_upload(self, transfer, priority, dumpid, abspath, key, contenthash):
+        self._check_cancelled()
+        Output.Diagnostic('uncompressed file size: %s Kb'%(str(os.path.getsize(abspath) / 1024)))
+        tempPath = os.path.join(tempfile.gettempdir(), tempfile.mktemp())
+        transfer.add_done_callback(lambda t: FileUtils._try_remove(tempPath))
+        hash = self._compress(FileUtils._compress_and_hash, abspath, tempPath, self._compression, self._get_level(abspath))
+        size = os.path.getsize(tempPath)
+        Output.Diagnostic('compressed file size:   %s Kb'%(str(size / 1024)))
+        self._when_created(transfer, dumpid, self._limit, self._uploadlimiter, transfer, priority, size, self._send_upload, transfer, priority, abspath, hash, tempPath, key, contenthash)
+
+    def _send_upload(self, transfer, priority, abspath, hash, tempPath, key, contenthash, dumpid):
+        Output.Message('uploading artifact %s %s'%(hash, os.path.basename(abspath)))
+        body = open(tempPath, 'rb')
+        def uploaded(response):
+            body.close()
+            if isinstance(response, Exception):
+                return transfer.set_exception(response)
+            self._uploaded(transfer, hash, key, contenthash)
+        try:
+            self._request(self._uploadlimiter, os.path.getsize(tempPath), uploaded, 'post', self._dumpSvc.GetArtifactUploadUrl(dumpid, abspath, hash), body=body)
+        except:
+            body.close()
+            raise
+
+    #registers the cached artifact hash as the file abspath without its content, see FileTransferManager._link_artifact
+    def _send_link(self, transfer, priority, abspath, hash, key, contenthash, dumpid):
+        def linked(response):
+            if isinstance(response, Exception):
+                return transfer.set_exception(response)
+            if hash in response.json():
+                #the service no longer has the cached artifact so it is compressed and uploaded again
+                Output.Diagnostic('cached artifact %s for %s is not available'%(hash, abspath))
+                self._unavailable.add(hash)
+                return self._submit(transfer, priority, os.path.getsize(abspath), self._compress_for_upload, transfer, priority, dumpid, abspath, key, contenthash)
+            Output.Diagnostic('hash cache hit %s %s'%(hash, abspath))
+            self._uploaded(transfer, hash, key, contenthash)
+        body = json.dumps([ { 'hash': hash, 'localpath': abspath } ])
+        self._request(self._uploadlimiter, 0, linked, 'post', self._dumpSvc.GetArtifactLinksUrl(dumpid), body=body, headers={ 'Content-Type': 'application/json' })
+
+    def _uploaded(self, transfer, hash, key, contenthash):
+        if self._hashcache is not None:
+            self._hashcache.Set(key, contenthash, hash)
+            self._confirmed.Add(hash)
+        transfer.set_result(hash)
+
+    #the event loop only writes the compressed content to a temp file, it is inflated and hashed on the executor so a large
+    #artifact doesn't hold up the other requests on the loop
+    def _start_download(self, transfer, priority, hash, abspath):
+        tempPath = os.path.join(tempfile.gettempdir(), tempfile.mktemp())
+        transfer.add_done_callback(lambda t: FileUtils._try_remove(tempPath))
+        sink = open(tempPath, 'wb')
+        def downloaded(response):
+            size = sink.tell()
+            sink.close()
+            if isinstance(response, Exception):
+                return transfer.set_exception(response)
+            self._submit(transfer, priority, size, self._finish_download, transfer, hash, tempPath, abspath)
+        try:
+            self._request(self._downloadlimiter, sink.tell, downloaded, 'get', self._dumpSvc.GetArtifactUrl(hash), sink=sink)
+        except:
+            sink.close()
+            raise
+
+    def _finish_download(self, transfer, hash, tempPath, abspath):
+        self._check_cancelled()
+        writer = VerifiedFileWriter(abspath)
+        try:
+            with open(tempPath, 'rb') as fComp:
+                data = fComp.read(DumplingService.s_ReadSize)
+                while data:
+                    writer.write(data)
+                    data = fComp.read(DumplingService.s_ReadSize)
+        except:
+            writer.Abort()
+            raise
+        writer.Commit(hash)
+        Output.Message('downloaded artifact %s %s'%(hash, os.path.basename(abspath)))
+        self._record_download(hash, abspath, writer.contenthexdigest())
+        if self._cache is not None:
+            self._cache.Put(hash, abspath)
+        transfer.set_result(None)
+
 class CommandProcessor:
     def __init__(self, filequeue, dumpSvc):
         self._dumpSvc = dumpSvc
         self._filequeue = filequeue
 
+    def Cancel(self):
+        self._filequeue.Cancel()
+
     def Process(self, config):
         if config.command == 'upload':
             self.Upload(config)
@@ -542,6 +3816,8 @@ class CommandProcessor:
             self.Debug(config)
         elif config.command == 'hang':
             self.Hang(config)
+        self._dumpSvc.LogConnectionStats()
+        self._filequeue.LogCacheSummary()
      
     def Install(self, config):
         
@@ -613,8 +3889,7 @@ class CommandProcessor:
         self.UpdateProperties(config.dumpid, config, None)
 
         if config.incpaths:
-            for f in FileUtils._enumerate_unique_files(config.incpaths):
-                self._filequeue.QueueFileUpload(config.dumpid, f)
+            self._filequeue.QueueFileUploads(config.dumpid, CommandProcessor._walk_incpaths(config))
 
     def Upload(self, config):
         dumpid = None
@@ -636,46 +3911,69 @@ class CommandProcessor:
         if config.displayname is None:
             config.displayname = str('%s.%.7f'%(getpass.getuser().lower(), time.time()))
 
-        dumpdata = self._filequeue.UploadDump(config.dumppath, config.incpaths, config.user, config.displayname)
-        
-        dumpid = dumpdata['dumplingId']   
-         
-        props = None if config.triage == 'none' else CommandProcessor._get_client_triage_properties()
+        #triage runs alongside the upload and posts its properties once the dump exists and the client properties are posted
+        posted = Future(None, ())
+        #anything waiting for the properties to be posted fails rather than waits forever if the upload fails before then
+        try:
+            triage = None
+            if config.triage == 'full':
+                triage = self._filequeue.QueueJob('triage', self._triage_dump, posted, config.dumppath, config)
 
-        self.UpdateProperties(dumpid, config, props)
+            #the dump and its files are uploaded concurrently, the files only wait for the dump to be created on the service
+            start = time.time()
+            created, transfer = self._filequeue.QueueDumpUpload(config.dumppath, config.user, config.displayname)
+            transfer.add_done_callback(lambda f: Output.Message('dump upload completed in %.1f seconds'%(time.time() - start)))
 
-        if config.triage == 'full':
-            self._triage_dump(dumpid, config.dumppath, config)
+            incpaths = set()
 
-        #the paradigm of how uploading a dump works has changed.  Now that the dump is processed offline after the api 
-        #returns we get back an operation token rather than a list of needed refpaths.  In the future this optoken will fetch
-        #will be used in an api to check the opertions state, at that time we'll need to check the state then load the manifest 
-        #to look for needed files, however since this is not available yet we'll ignore the optoken.
-        requestpaths = set() #set(dumpdata['refPaths'])      
-        
-        incpaths = set()
-          
-        if not (config.incpaths is None or len(config.incpaths) == 0):
-            incpaths = FileUtils._enumerate_unique_files(config.incpaths)
-            #if the dump file is in the incpaths remove it as it has already been uploaded
-            incpaths.discard(os.path.abspath(config.dumppath))
-            requestpaths.difference_update(incpaths)
+            #the files are queued as they are found, if the dump file is in the incpaths it is skipped as it is uploaded as the dump
+            def walk_incpaths():
+                for p in CommandProcessor._walk_incpaths(config):
+                    if p != config.dumppath:
+                        incpaths.add(p)
+                        yield p
 
-        if len(requestpaths) > 0:
-            prompt = 'The dumpling service has requested the following additional files be uploaded:\n'
-            for p in requestpaths:
-                prompt += p + '\n'
-            prompt += 'Allow upload of requested files?'
-            if Output.Prompt_YN(prompt):
-                incpaths.update(requestpaths)
-    
-        for f in incpaths:
-            self._filequeue.QueueFileUpload(dumpid, f) 
+            if not (config.incpaths is None or len(config.incpaths) == 0):
+                self._filequeue.QueueFileUploads(created, walk_incpaths())
 
-        self._filequeue.WaitForPendingTransfers();
+            dumpdata = created.result()
+
+            dumpid = dumpdata['dumplingId']   
+         
+            props = None if config.triage == 'none' else CommandProcessor._get_client_triage_properties()
+
+            try:
+                self.UpdateProperties(dumpid, config, props)
+            finally:
+                posted.set_result(dumpid)
+
+            #the paradigm of how uploading a dump works has changed.  Now that the dump is processed offline after the api 
+            #returns we get back an operation token rather than a list of needed refpaths.  In the future this optoken will fetch
+            #will be used in an api to check the opertions state, at that time we'll need to check the state then load the manifest 
+            #to look for needed files, however since this is not available yet we'll ignore the optoken.
+            requestpaths = set() #set(dumpdata['refPaths'])      
+            requestpaths.difference_update(incpaths)
+            requestpaths.discard(os.path.abspath(config.dumppath))
+
+            if len(requestpaths) > 0:
+                prompt = 'The dumpling service has requested the following additional files be uploaded:\n'
+                for p in requestpaths:
+                    prompt += p + '\n'
+                prompt += 'Allow upload of requested files?'
+                if Output.Prompt_YN(prompt):
+                    self._filequeue.QueueFileUploads(dumpid, requestpaths)
+    
+            #surfaces a failure of the dump upload itself, the dump has been created but its content is incomplete
+            if self._filequeue.WaitForPendingTransfers():
+                transfer.result()
+                if triage is not None and triage.exception() is not None:
+                    Output.Message('WARNING: Debugger triage failed: %s'%(triage.exception()))
         
-        Output.Message('dumplingid:  %s'%(dumpid))
-        Output.Critical('%sapi/dumplings/archived/%s'%(config.url, dumpid ))
+            Output.Message('dumplingid:  %s'%(dumpid))
+            Output.Critical('%sapi/dumplings/archived/%s'%(config.url, dumpid ))
+        except Exception as e:
+            posted.set_exception(e)
+            raise
 
         return dumpid
 
@@ -701,8 +3999,7 @@ class CommandProcessor:
 
     def UploadArtifacts(self, config):
         if config.incpaths:
-            for f in FileUtils._enumerate_unique_files(config.incpaths):
-                self._filequeue.QueueFileUpload(None, f)
+            self._filequeue.QueueFileUploads(None, CommandProcessor._walk_incpaths(config))
         
         self._filequeue.WaitForPendingTransfers();
     
@@ -728,10 +4025,13 @@ class CommandProcessor:
             Output.Critical('downloading artifacts from index is not yet supported')
             #self._filequeue.QueueFileIndexDownload(config.symindex, abspath)
 
-        elif config.dumpid is not None:  
-            dumpManifest = self._dumpSvc.GetDumplingManfiest(config.dumpid)
-            
-            self._download_dump(dir, dumpManifest)
+        elif config.dumpid is not None or config.dumpidfile is not None:
+            dumpids = config.dumpid or CommandProcessor._read_dumpids(config.dumpidfile)
+
+            if len(dumpids) == 1:
+                self._download_dump(dir, self._dumpSvc.GetDumplingManfiest(dumpids[0]), config.verify)
+            else:
+                self._download_dumps(dir, dumpids, config.verify)
 
     def Debug(self, config):
         if config.dbgpath is None:
@@ -757,7 +4057,7 @@ class CommandProcessor:
             return
            
         #donwload the dump
-        dumplingDir = self._download_dump(config.downdir, dumpManifest)
+        dumplingDir = self._download_dump(config.downdir, dumpManifest, config.verify)
            
         fulldumppath = os.path.join(dumplingDir, dumppath)      
             
@@ -812,7 +4112,23 @@ class CommandProcessor:
         
         os.chdir(popdir)
 
-    def _triage_dump(self, dumpid, dumppath, config):  
+    @staticmethod
+    def _walk_incpaths(config):
+        minsize = int(config.minsize * 1024 * 1024) if config.minsize else None
+        maxsize = int(config.maxsize * 1024 * 1024) if config.maxsize else None
+        return FileWalker(config.incpaths, config.include, config.exclude, minsize, maxsize)
+
+    #triages the dump and once posted completes with the dump id posts the triage properties
+    def _triage_dump(self, posted, dumppath, config):
+        start = time.time()
+        propsDict = self._run_triage(dumppath, config)
+        Output.Message('triage completed in %.1f seconds'%(time.time() - start))
+
+        dumpid = posted.result()
+        if propsDict is not None and len(propsDict) > 0: 
+            self._dumpSvc.UpdateDumpProperties(dumpid, propsDict) 
+
+    def _run_triage(self, dumppath, config):  
         if config.dbgpath is None:
             Output.Critical('dbgpath must be specified either as an argument or in the dumpling config to preform a full dump triage')
             return
@@ -841,45 +4157,102 @@ class CommandProcessor:
         #execute the debugger commands to triage the dump file
         CommandProcessor._load_debugger(config.dbgpath, dbgcmds)
 
-        #if the debugger wrote out the triage output file as expected load it and update the dump properties
+        #if the debugger wrote out the triage output file as expected load it to update the dump properties
         if os.path.isfile(triageOut):
             #load the output of analyze
             with open(triageOut, 'r') as fTriage:
                 propsDict = json.load(fTriage)
-            
-                if len(propsDict) > 0: 
-                    self._dumpSvc.UpdateDumpProperties(dumpid, propsDict) 
         
             #delete the temporary triage props file
             os.remove(triageOut)
+
+            return propsDict
         #if the debugger did not write the triage output file message and return
         else:
             Output.Message('WARNING: Debugger triage analysis failed')
 
             
-    def _download_dump(self, dir, dumpManifest):
+    def _download_dump(self, dir, dumpManifest, verify = False):
+        dumplingDir, downloads = self._prepare_dump_download(dir, dumpManifest, verify)
+
+        self._filequeue.QueueFileDownloads(downloads)
+
+        self._filequeue.WaitForPendingTransfers();
+
+        return dumplingDir
+
+    #downloads several dumps together.  the manifests are fetched concurrently and the artifacts of all the dumps are
+    #scheduled as one, so the dumps and the files needed to debug them come first and artifacts shared by the dumps are
+    #only downloaded once.  dumps whose manifest can't be retrieved are reported and skipped.
+    def _download_dumps(self, dir, dumpids, verify = False):
+        manifests = [ (dumpid, self._filequeue.QueueJob('manifest %s'%(dumpid), self._dumpSvc.GetDumplingManfiest, dumpid)) for dumpid in dumpids ]
+
+        downloads = [ ]
+        for dumpid, manifest in manifests:
+            try:
+                dumplingDir, dumpDownloads = self._prepare_dump_download(dir, manifest.result(), verify)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                Output.Critical('failed to retrieve the manifest of dump %s: %s'%(dumpid, e))
+                continue
+            downloads.extend(dumpDownloads)
+
+        self._filequeue.QueueFileDownloads(downloads)
+
+        self._filequeue.WaitForPendingTransfers();
+
+    #returns the directory of the dump in dir and the downloads of the artifacts of the dump which aren't already there
+    #from an earlier download, saving the manifest in the directory.  an artifact is skipped if the manifest saved by that
+    #download has the same artifact at its path and the file is still the one downloaded, see
+    #FileTransferManager.IsDownloaded.  verify also checks the content of those files.
+    def _prepare_dump_download(self, dir, dumpManifest, verify):
         dumplingDir = os.path.join(dir, dumpManifest['displayName'])
             
         if not os.path.exists(dumplingDir):
             FileUtils._ensure_dir(dumplingDir)
 
-        #download all the artifacts for the dump
+        manifestPath = os.path.join(dumplingDir, 'manifest.json')
+
+        saved = CommandProcessor._load_saved_artifacts(manifestPath)
+
+        #download all the artifacts for the dump, the dump and the artifacts needed to debug it first
+        downloads = [ ]
+        current = 0
         for da in dumpManifest['dumpArtifacts']:
             if 'hash' in da and 'relativePath' in da:
                 hash = da['hash']
                 relPath = da['relativePath']
                 if hash and relPath:
-                    self._filequeue.QueueFileDownload(hash, os.path.join(dumplingDir, relPath)) 
+                    abspath = os.path.join(dumplingDir, relPath)
+                    if saved.get(relPath) == hash and self._filequeue.IsDownloaded(hash, abspath, verify):
+                        current += 1
+                        continue
+                    downloads.append((hash, abspath, FileTransferManager._get_download_priority(da), da.get('compressedSize') or 0))
+        if current > 0:
+            Output.Message('%d artifacts of %s are already downloaded, downloading %d'%(current, dumpManifest['displayName'], len(downloads)))
         
         #save the manifest at the root 
-        manifestPath = os.path.join(dumplingDir, 'manifest.json')
 
         with open(manifestPath, 'w') as manFile:
             _json_format_tofile(dumpManifest, manFile)
- 
-        self._filequeue.WaitForPendingTransfers();
 
-        return dumplingDir
+        return dumplingDir, downloads
+
+    #returns the dump ids listed one per line in path, blank lines and lines starting with # are ignored
+    @staticmethod
+    def _read_dumpids(path):
+        with open(path, 'r') as idFile:
+            return [ line.strip() for line in idFile if line.strip() and not line.strip().startswith('#') ]
+
+    #returns the artifact hash of each relative path in the manifest saved by an earlier download of a dump
+    @staticmethod
+    def _load_saved_artifacts(manifestPath):
+        try:
+            with open(manifestPath, 'r') as manFile:
+                savedManifest = json.load(manFile)
+            return dict((da['relativePath'], da['hash']) for da in savedManifest['dumpArtifacts'] if da.get('hash') and da.get('relativePath'))
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            Output.Diagnostic('no saved manifest at %s: %s'%(manifestPath, e))
+            return { }
 
     def Hang(self, config):
         if os.path.exists(config.dbgpath) and os.path.isdir(config.outpath):            
@@ -998,10 +4371,14 @@ def _get_default_dbgargs():
 
 class DumplingConfig:
 
-    s_unsaved_args = { 'action', 'command', 'configpath', 'verbose', 'squelch', 'noprompt' }
+    s_unsaved_args = { 'action', 'command', 'configpath', 'verbose', 'squelch', 'noprompt', 'deadline' }
     s_default_args = { 'url': 'https://dumpling.int-dot.net/', 'installpath': os.path.join(os.path.expanduser('~'), '.dumpling'), 'dbgargs': _get_default_dbgargs() }
+    #defaults of the transfer options, which are only saved if they've been set to something else so a saved configuration
+    #picks up changes to the defaults
+    s_transfer_default_args = { 'transfermode': 'file', 'compression': 'gzip', 'nohashcache': False, 'compresslevel': '9', 'linkspeed': None, 'httptimeout': None, 'deadline': None, 'engine': 'thread', 'background': False, 'bandwidth': None, 'cpushare': None, 'nobundle': False, 'include': None, 'exclude': None, 'minsize': None, 'maxsize': None, 'nocache': False, 'cachesize': None, 'verify': False }
     def __init__(self, dictConfig):
         self.__dict__ = copy.copy(DumplingConfig.s_default_args)
+        self.__dict__.update(DumplingConfig.s_transfer_default_args)
 
         self.Merge(dictConfig)
 
@@ -1034,7 +4411,7 @@ class DumplingConfig:
             Output.Message('configuration saved to %s'%(strpath))
 
     def _persistable_args(self):
-        return dict([(key, value) for key, value in self.__dict__.iteritems() if key not in DumplingConfig.s_unsaved_args and value])
+        return dict([(key, value) for key, value in self.__dict__.iteritems() if key not in DumplingConfig.s_unsaved_args and value and DumplingConfig.s_transfer_default_args.get(key) != value])
 
     def __str__(self):
         return _json_format(self._persistable_args())
@@ -1047,6 +4424,14 @@ def _parse_key_value_pair(argStr):
 
     return kvp
 
+def _parse_cpushare(argStr):
+    share = float(argStr)
+
+    if not 0 < share <= 1:
+        raise argparse.ArgumentTypeError('the cpu share must be greater than 0 and at most 1, not %s'%(argStr))
+
+    return share
+
 def _parse_args(argv):
     sharedparser = argparse.ArgumentParser(add_help=False)
     
@@ -1060,6 +4445,12 @@ def _parse_args(argv):
 
     sharedparser.add_argument('--url', type=str, help='url of the dumpling service for the connected client')
 
+    sharedparser.add_argument('--httptimeout', type=float, default=None, help='seconds to wait for the dumpling service to respond to requests other than content transfers')
+
+    #the async engine is experimental, its HTTP client only covers the requests the client makes to the service and
+    #storage, so the option is left out of the help and the thread engine stays the default
+    sharedparser.add_argument('--engine', choices=['thread', 'async'], default=None, help=argparse.SUPPRESS)
+
     sharedparser.add_argument('--configpath', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dumpling.config.json'), help='path to the saved dumpling client configuration file')
 
     parser = argparse.ArgumentParser(parents=[sharedparser], description='dumpling client for managing core files and interacting with the dumpling service')
@@ -1086,15 +4477,45 @@ def _parse_args(argv):
 
     upload_parser.add_argument('--incpaths', nargs='*', type=str, help='paths to files or directories to be included in the upload')
 
+    upload_parser.add_argument('--include', nargs='*', type=str, help='globs of the files to include from the incpaths, matched against the file name and its path relative to the incpath')
+
+    upload_parser.add_argument('--exclude', nargs='*', type=str, help='globs of the files and directories to exclude from the incpaths, matched against the name and the path relative to the incpath')
+
+    upload_parser.add_argument('--minsize', type=float, default=None, help='the size in MB of the smallest file to include from the incpaths')
+
+    upload_parser.add_argument('--maxsize', type=float, default=None, help='the size in MB of the largest file to include from the incpaths')
+
     upload_parser.add_argument('--properties', nargs='*', type=_parse_key_value_pair, help='a list of properties to be associated with the dump in the format key=value', metavar='key=value')  
                                          
     upload_parser.add_argument('--propfile', type=argparse.FileType('r'), help='path to a file containing a json serialized dictionary of property value paires')
 
+    upload_parser.add_argument('--transfermode', choices=['file', 'stream', 'chunked', 'dedup'], default=None, help='file compresses each file to a temp file before uploading, stream compresses, hashes and uploads in a single pass with no temp files, chunked uploads in parallel resumable chunks, dedup uploads only the content defined chunks the service does not already have')
+
+    upload_parser.add_argument('--compression', choices=['gzip', 'block'], default=None, help='gzip compresses each file as a single gzip member, block compresses fixed size blocks in parallel into an indexed multi-member gzip file. ignored when --transfermode is stream')
+
+    upload_parser.add_argument('--nohashcache', default=False, action='store_true', help='do not use or update the local index of previously hashed and uploaded files')
+
+    upload_parser.add_argument('--nobundle', default=False, action='store_true', help='upload every file on its own rather than bundling small files into a single upload')
+
+    upload_parser.add_argument('--compresslevel', choices=['adaptive'] + [ str(l) for l in range(10) ], default=None, help='the gzip compression level, adaptive chooses the level for each large file from its sampled compression speed and ratio and the upload speed')
+
+    upload_parser.add_argument('--linkspeed', type=float, default=None, help='the upload speed in MB/s assumed by adaptive compression, when not specified it is measured from the uploads so far')
+
+    upload_parser.add_argument('--deadline', type=float, default=None, help='seconds within which transfers should complete, transfers are scheduled so the dump and the files needed to debug it complete first and any not started by the deadline are cancelled and reported')
+
+    upload_parser.add_argument('--background', default=False, action='store_true', help='transfer with low impact on other work on the machine, compression and transfers run at low cpu and io priority and compression uses a quarter of the cpus unless --cpushare is specified')
+
+    upload_parser.add_argument('--bandwidth', type=float, default=None, help='the upload bandwidth in MB/s shared by all transfers')
+
+    upload_parser.add_argument('--cpushare', type=_parse_cpushare, default=None, help='the share of the cpus, between 0 and 1, used to compress files')
+
     download_parser = subparsers.add_parser('download', parents=[sharedparser], help='command used for downloading dumps and files from the dumpling service')    
     
     download_idtype = download_parser.add_mutually_exclusive_group(required=True)                                                                                             
     
-    download_idtype.add_argument('--dumpid', type=str, help='the dumpling id of the dump to download for debugging')   
+    download_idtype.add_argument('--dumpid', type=str, nargs='+', help='the dumpling ids of the dumps to download for debugging, several dumps are downloaded together and artifacts they share only downloaded once')   
+
+    download_idtype.add_argument('--dumpidfile', type=str, help='a file listing the dumpling ids of the dumps to download, one per line')
 
     download_idtype.add_argument('--hash', type=str, help='the id of the artifact to download')  
 
@@ -1103,6 +4524,16 @@ def _parse_args(argv):
     download_parser.add_argument('--downpath', type=str, help='the path to download the specified content to. NOTE: if both downpath and downdir are specified downdir will be ignored')
 
     download_parser.add_argument('--downdir', type=str, default=os.getcwd(), help='the path to the directory to download the specified content')    
+
+    download_parser.add_argument('--deadline', type=float, default=None, help='seconds within which transfers should complete, transfers are scheduled so the dump and the files needed to debug it complete first and any not started by the deadline are cancelled and reported')
+
+    download_parser.add_argument('--nocache', default=False, action='store_true', help='do not use or update the local cache of downloaded artifacts')
+
+    download_parser.add_argument('--nohashcache', default=False, action='store_true', help='do not record the downloaded files in the local index of previously hashed files')
+
+    download_parser.add_argument('--cachesize', type=float, default=None, help='the size in GB the local cache of downloaded artifacts is limited to, the least recently used artifacts are evicted beyond it')
+
+    download_parser.add_argument('--verify', default=False, action='store_true', help='check the content of files already downloaded by an earlier download of the dump rather than trusting they are unchanged')
     
     update_parser = subparsers.add_parser('update', parents=[sharedparser], help='command used for updating dump properties and associated files')
                                                                                                             
@@ -1113,6 +4544,34 @@ def _parse_args(argv):
     update_parser.add_argument('--propfile', type=argparse.FileType('r'), help='path to a file containing a json serialized dictionary of property value pairs')
 
     update_parser.add_argument('--incpaths', nargs='*', type=str, help='paths to files or directories to be associated with the specified dump')
+
+    update_parser.add_argument('--include', nargs='*', type=str, help='globs of the files to include from the incpaths, matched against the file name and its path relative to the incpath')
+
+    update_parser.add_argument('--exclude', nargs='*', type=str, help='globs of the files and directories to exclude from the incpaths, matched against the name and the path relative to the incpath')
+
+    update_parser.add_argument('--minsize', type=float, default=None, help='the size in MB of the smallest file to include from the incpaths')
+
+    update_parser.add_argument('--maxsize', type=float, default=None, help='the size in MB of the largest file to include from the incpaths')
+
+    update_parser.add_argument('--transfermode', choices=['file', 'stream', 'chunked', 'dedup'], default=None, help='file compresses each file to a temp file before uploading, stream compresses, hashes and uploads in a single pass with no temp files, chunked uploads in parallel resumable chunks, dedup uploads only the content defined chunks the service does not already have')
+
+    update_parser.add_argument('--compression', choices=['gzip', 'block'], default=None, help='gzip compresses each file as a single gzip member, block compresses fixed size blocks in parallel into an indexed multi-member gzip file. ignored when --transfermode is stream')
+
+    update_parser.add_argument('--nohashcache', default=False, action='store_true', help='do not use or update the local index of previously hashed and uploaded files')
+
+    update_parser.add_argument('--nobundle', default=False, action='store_true', help='upload every file on its own rather than bundling small files into a single upload')
+
+    update_parser.add_argument('--compresslevel', choices=['adaptive'] + [ str(l) for l in range(10) ], default=None, help='the gzip compression level, adaptive chooses the level for each large file from its sampled compression speed and ratio and the upload speed')
+
+    update_parser.add_argument('--linkspeed', type=float, default=None, help='the upload speed in MB/s assumed by adaptive compression, when not specified it is measured from the uploads so far')
+
+    update_parser.add_argument('--deadline', type=float, default=None, help='seconds within which transfers should complete, transfers are scheduled so the dump and the files needed to debug it complete first and any not started by the deadline are cancelled and reported')
+
+    update_parser.add_argument('--background', default=False, action='store_true', help='transfer with low impact on other work on the machine, compression and transfers run at low cpu and io priority and compression uses a quarter of the cpus unless --cpushare is specified')
+
+    update_parser.add_argument('--bandwidth', type=float, default=None, help='the upload bandwidth in MB/s shared by all transfers')
+
+    update_parser.add_argument('--cpushare', type=_parse_cpushare, default=None, help='the share of the cpus, between 0 and 1, used to compress files')
     
     install_parser = subparsers.add_parser('install', parents=[sharedparser], help='command used for installing dumpling services and support tooling')
 
@@ -1132,6 +4591,16 @@ def _parse_args(argv):
                                                  
     debug_parser.add_argument('--downdir', type=str, default=os.getcwd(), help='the path to the directory to download the specified content')
 
+    debug_parser.add_argument('--deadline', type=float, default=None, help='seconds within which transfers should complete, transfers are scheduled so the dump and the files needed to debug it complete first and any not started by the deadline are cancelled and reported')
+
+    debug_parser.add_argument('--nocache', default=False, action='store_true', help='do not use or update the local cache of downloaded artifacts')
+
+    debug_parser.add_argument('--nohashcache', default=False, action='store_true', help='do not record the downloaded files in the local index of previously hashed files')
+
+    debug_parser.add_argument('--cachesize', type=float, default=None, help='the size in GB the local cache of downloaded artifacts is limited to, the least recently used artifacts are evicted beyond it')
+
+    debug_parser.add_argument('--verify', default=False, action='store_true', help='check the content of files already downloaded by an earlier download of the dump rather than trusting they are unchanged')
+
     hung_parser = subparsers.add_parser('hang', parents=[sharedparser], help='Creating the dump for the hang or timeout process')   
     
     hung_parser.add_argument('--pid', type=str, required=True, help='the pid of the process')   
@@ -1148,10 +4617,60 @@ def _parse_args(argv):
 
     return config
 
+#lowers the cpu and io scheduling priority of the client so background transfers yield to other work on the machine.  this
+#is done before any threads are started as threads inherit the priority of the thread which creates them.
+def _set_background_priority():
+    process = psutil.Process()
+    try:
+        if platform.system() == 'Windows':
+            process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+            process.ionice(getattr(psutil, 'IOPRIO_VERYLOW', 0))
+        else:
+            process.nice(max(process.nice(), 10))
+            if hasattr(process, 'ionice'):
+                process.ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (psutil.Error, OSError) as e:
+        Output.Diagnostic('unable to lower the scheduling priority of the client: %s'%(e))
+
 def _create_command_processor(config):
-    dumplingsvc = DumplingService(config.url)
+    if config.background:
+        _set_background_priority()
+
+    #in the background compression defaults to a quarter of the cpus, block compression parallelism is capped to match
+    cpushare = config.cpushare or (FileTransferManager.s_BackgroundCpuShare if config.background else None)
+    compressthreads = max(int(multiprocessing.cpu_count() * cpushare), 1) if cpushare else None
+    if compressthreads is not None:
+        BlockGzip.s_MaxThreads = compressthreads
+
+    bandwidth = TokenBucket(config.bandwidth * 1024 * 1024) if config.bandwidth else None
+
+    #the concurrency limiters cap the transfers in flight, including the chunks of chunked transfers
+    dumplingsvc = DumplingService(config.url, maxconnections=ConcurrencyLimiter.s_MaxLimit, timeout=config.httptimeout, bandwidth=bandwidth)
+
+    deadline = time.time() + config.deadline if config.deadline else None
     
-    filequeue = FileTransferManager(dumplingsvc)
+    hashcache = None if config.nohashcache else HashCache()
+
+    confirmed = None if config.nohashcache else BloomFilter(BloomFilter.s_FilterPath)
+
+    bundlesize = None if config.nobundle else FileTransferManager.s_BundleFileSize
+
+    cache = None if config.nocache else ArtifactCache(maxsize=int(config.cachesize * 1024 * 1024 * 1024) if config.cachesize else None)
+
+    #the requests of the async engine are made on its event loop which can't wait on the bandwidth cap, and are made
+    #directly to the service and storage so it's only used where they're reached without a proxy
+    engine = config.engine
+    if engine == 'async' and bandwidth is not None:
+        Output.Message('the bandwidth cap is not supported by the async engine, the thread engine will be used')
+        engine = 'thread'
+    if engine == 'async' and AsyncHttpClient.GetProxies(config.url):
+        Output.Message('proxies are not supported by the async engine, the thread engine will be used')
+        engine = 'thread'
+
+    if engine == 'async':
+        filequeue = AsyncFileTransferManager(dumplingsvc, transfermode=config.transfermode, compression=config.compression, hashcache=hashcache, confirmed=confirmed, compresslevel=config.compresslevel, linkspeed=config.linkspeed, deadline=deadline, compressthreads=compressthreads, bundlesize=bundlesize, cache=cache)
+    else:
+        filequeue = FileTransferManager(dumplingsvc, transfermode=config.transfermode, compression=config.compression, hashcache=hashcache, confirmed=confirmed, compresslevel=config.compresslevel, linkspeed=config.linkspeed, deadline=deadline, compressthreads=compressthreads, bundlesize=bundlesize, cache=cache)
     
     return CommandProcessor(filequeue, dumplingsvc)
 
@@ -1174,7 +4693,12 @@ def main(argv):
 
     cmdProc = _create_command_processor(config)
 
-    cmdProc.Process(config)
+    try:
+        cmdProc.Process(config)
+    except KeyboardInterrupt:
+        cmdProc.Cancel()
+        Output.Message('operation cancelled after %s'%(datetime.datetime.now() - starttime))
+        sys.exit(130)
 
     Output.Message('total elapsed time %s'%(datetime.datetime.now() - starttime))
 
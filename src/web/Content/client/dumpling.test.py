@@ -1,12 +1,245 @@
 import unittest
 import dumpling
+import argparse
 import sys
 import tempfile
 import random
 import os
+import errno
+import threading
+import urlparse
+import json
+import hashlib
+import gzip
+import shutil
+import StringIO
+import BaseHTTPServer
+import SocketServer
+import struct
+import subprocess
+import time
+import tarfile
 
 DUMPLING_HOSTURL = 'https://dumpling-dev.azurewebsites.net/'
 
+#a minimal in process stand-in for the dumpling service used to test the client transfer protocols offline
+class LocalDumplingService(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), LocalDumplingRequestHandler)
+        self.lock = threading.Lock()
+        self.artifacts = { }
+        self.dumpartifacts = { }
+        self.sessions = { }
+        self.chunks = { }
+        self.dumps = { }
+        self.properties = { }
+        self.manifests = { }
+        self.requests = [ ]
+        #seconds each request is delayed to simulate the latency of the service
+        self.latency = 0
+        #cleared to hold the upload of dump content until set
+        self.dumpcontent = threading.Event()
+        self.dumpcontent.set()
+        #chunk index -> number of times the chunk put should fail before succeeding
+        self.failchunks = { }
+        #if not None the number of chunk puts accepted before all further chunk puts fail
+        self.chunklimit = None
+        #whether storage serves range requests
+        self.ranges = True
+        self.url = 'http://127.0.0.1:%d/'%(self.server_address[1])
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def add_artifact(self, dumpid, localpath, hash, content):
+        self.artifacts[hash] = content
+        if dumpid is not None:
+            self.dumpartifacts[(dumpid, localpath)] = hash
+
+class LocalDumplingRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def _dispatch(self, method):
+        url = urlparse.urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        qargs = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+        if self.headers.getheader('transfer-encoding') == 'chunked':
+            body = self._read_chunked()
+        dumpid = None
+        with self.server.lock:
+            self.server.requests.append((method, url.path))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if parts[:2] == ['api', 'dumplings'] and len(parts) > 3 and parts[3] == 'artifacts':
+            dumpid = parts[2]
+            parts = ['api'] + parts[3:]
+        if method == 'GET' and parts == ['api', 'dumplings', 'create']:
+            with self.server.lock:
+                self.server.dumps[qargs['hash']] = qargs['displayname']
+            return self._respond(200)
+        if method == 'GET' and parts[:2] == ['api', 'dumplings'] and parts[3:] == ['manifest']:
+            if parts[2] not in self.server.manifests:
+                return self._respond(404)
+            return self._respond(200, json.dumps(self.server.manifests[parts[2]]))
+        if method == 'POST' and parts[:2] == ['api', 'dumplings'] and parts[3:] == ['properties']:
+            with self.server.lock:
+                self.server.properties.setdefault(parts[2], { }).update(urlparse.parse_qsl(body))
+            return self._respond(200)
+        if method == 'POST' and parts == ['api', 'dumplings', 'uploads']:
+            self.server.dumpcontent.wait(5)
+            if qargs['hash'] not in self.server.dumps or hashlib.sha1(body).hexdigest() != qargs['hash']:
+                return self._respond(400)
+            with self.server.lock:
+                self.server.add_artifact(qargs['hash'], qargs['localpath'], qargs['hash'], body)
+            return self._respond(200, json.dumps(qargs['hash']))
+        if method == 'POST' and parts == ['api', 'artifacts', 'uploads']:
+            #as with the service content is only read when the artifact doesn't already exist, the client links artifacts it
+            #expects the service to have rather than uploading them without content
+            if len(body) == 0 or (qargs['hash'] not in self.server.artifacts and hashlib.sha1(body).hexdigest() != qargs['hash']):
+                return self._respond(400)
+            with self.server.lock:
+                self.server.add_artifact(dumpid, qargs['localpath'], qargs['hash'], self.server.artifacts.get(qargs['hash'], body))
+            return self._respond(200, json.dumps(qargs['hash']))
+        #as with the service artifacts are downloaded from storage by redirect, storage responds with chunked encoding
+        if method == 'GET' and parts[:2] == ['api', 'artifacts'] and len(parts) == 3:
+            if parts[2] not in self.server.artifacts:
+                return self._respond(404)
+            self.send_response(302)
+            self.send_header('Location', '/storage/' + parts[2])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if method == 'GET' and parts[0] == 'storage':
+            content = self.server.artifacts[parts[1]]
+            byterange = self.headers.getheader('range')
+            if byterange is not None and self.server.ranges:
+                start, end = [ int(o) for o in byterange.split('=')[1].split('-') ]
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d'%(start, end, len(content)))
+                return self._respond(206, content[start:end + 1], False)
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(content), 4096):
+                self.wfile.write('%x\r\n%s\r\n'%(len(content[i:i + 4096]), content[i:i + 4096]))
+            self.wfile.write('0\r\n\r\n')
+            return
+        if method == 'POST' and parts == ['api', 'artifacts', 'query']:
+            return self._respond(200, json.dumps([ h for h in json.loads(body) if h in self.server.artifacts ]))
+        if method == 'POST' and parts == ['api', 'artifacts', 'links']:
+            links = json.loads(body)
+            with self.server.lock:
+                for link in links:
+                    if link['hash'] in self.server.artifacts:
+                        self.server.add_artifact(dumpid, link['localpath'], link['hash'], self.server.artifacts[link['hash']])
+            return self._respond(200, json.dumps([ l['hash'] for l in links if l['hash'] not in self.server.artifacts ]))
+        if method == 'POST' and parts == ['api', 'artifacts', 'bundles']:
+            bundle = tarfile.open(fileobj=StringIO.StringIO(body), mode='r:')
+            members = bundle.getmembers()
+            manifest = json.loads(bundle.extractfile(members[0]).read())
+            for member in members[1:]:
+                content = bundle.extractfile(member).read()
+                if hashlib.sha1(content).hexdigest() != member.name:
+                    return self._respond(400)
+                with self.server.lock:
+                    for link in manifest:
+                        if link['hash'] == member.name:
+                            self.server.add_artifact(dumpid, link['localpath'], link['hash'], content)
+            names = set(m.name for m in members[1:])
+            return self._respond(200, json.dumps([ l['hash'] for l in manifest if l['hash'] not in names ]))
+        if method == 'POST' and parts == ['api', 'chunks', 'query']:
+            return self._respond(200, json.dumps([ h for h in json.loads(body) if h not in self.server.chunks ]))
+        if method == 'PUT' and parts[:2] == ['api', 'chunks'] and len(parts) == 3:
+            if hashlib.sha1(gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()).hexdigest() != parts[2]:
+                return self._respond(400)
+            with self.server.lock:
+                self.server.chunks.setdefault(parts[2], body)
+            return self._respond(200)
+        if method == 'POST' and parts == ['api', 'artifacts', 'recipes']:
+            content = ''.join(self.server.chunks[h] for h in json.loads(body)['chunks'])
+            hash = hashlib.sha1(content).hexdigest()
+            with self.server.lock:
+                self.server.add_artifact(dumpid, qargs['localpath'], hash, content)
+            return self._respond(200, json.dumps(hash))
+        if method == 'POST' and parts == ['api', 'artifacts', 'sessions']:
+            sessionid = hashlib.sha1(str(random.random())).hexdigest()
+            session = { 'sessionId': sessionid, 'hash': qargs['hash'], 'length': int(qargs['length']), 'chunkSize': int(qargs['chunksize']), 'chunks': { } }
+            with self.server.lock:
+                self.server.sessions[sessionid] = session
+            return self._respond(200, self._session_json(session))
+        if parts[:3] == ['api', 'artifacts', 'sessions'] and len(parts) > 3:
+            session = self.server.sessions.get(parts[3])
+            if session is None:
+                return self._respond(404)
+            if method == 'GET' and len(parts) == 4:
+                return self._respond(200, self._session_json(session))
+            if method == 'PUT' and len(parts) == 6 and parts[4] == 'chunks':
+                return self._put_chunk(session, int(parts[5]), qargs['hash'], body)
+            if method == 'POST' and parts[4:] == ['commit']:
+                content = ''.join(session['chunks'][i] for i in sorted(session['chunks']))
+                if hashlib.sha1(content).hexdigest() != session['hash']:
+                    return self._respond(400)
+                with self.server.lock:
+                    self.server.add_artifact(dumpid, qargs['localpath'], session['hash'], content)
+                    del self.server.sessions[session['sessionId']]
+                return self._respond(200, json.dumps(session['hash']))
+        self._respond(404)
+
+    def _read_chunked(self):
+        chunks = [ ]
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            if size == 0:
+                return ''.join(chunks)
+
+    def _put_chunk(self, session, index, hash, body):
+        with self.server.lock:
+            if self.server.chunklimit is not None:
+                if self.server.chunklimit <= 0:
+                    return self._respond(503)
+                self.server.chunklimit -= 1
+            if self.server.failchunks.get(index, 0) > 0:
+                self.server.failchunks[index] -= 1
+                return self._respond(503)
+            if hashlib.sha1(body).hexdigest() != hash:
+                return self._respond(400)
+            session['chunks'][index] = body
+        self._respond(200)
+
+    def _session_json(self, session):
+        return json.dumps({ 'sessionId': session['sessionId'], 'hash': session['hash'], 'length': session['length'], 'chunkSize': session['chunkSize'], 'chunks': sorted(session['chunks']) })
+
+    def _respond(self, status, content = '', start = True):
+        if start:
+            self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
 class dumpling_testcase(unittest.TestCase):
     
     def rand_file(self, len = None):
@@ -55,6 +288,19 @@ class test_dumpling_argparser(dumpling_testcase):
             dumpling.main(self._parse_cmdline('dumpling debug -h'))
 
 class test_dumpling_fileutils(dumpling_testcase):
+    def test_preallocate(self):
+        path = tempfile.mktemp()
+        size = 1024 * 1024 * 4
+        try:
+            with open(path, 'wb') as f:
+                dumpling.FileUtils._preallocate(f, size)
+            self.assertEqual(size, os.path.getsize(path))
+            #where the space can be reserved the file isn't sparse
+            if dumpling._posix_fallocate is not None and hasattr(os.stat(path), 'st_blocks'):
+                self.assertGreaterEqual(os.stat(path).st_blocks * 512, size)
+        finally:
+            dumpling.FileUtils._try_remove(path)
+
     def test_compress_uncompress(self):
         #create a test file
         origpath = self.rand_file()
@@ -76,6 +322,1218 @@ class test_dumpling_fileutils(dumpling_testcase):
         self.assertEqual(size1, size2)
         self.assertTrue(zipsize < size1)
 
+    def test_compressed_stream_shares_slots(self):
+        origpath = self.rand_file(1024 * 64)
+        slots = threading.BoundedSemaphore(1)
+        stream = dumpling.CompressedFileStream(origpath, buffsize = 1024 * 4, buffcount = 2, slots = slots)
+        chunks = iter(stream)
+        data = [ next(chunks) ]
+        #the slot is only held while a buffer is compressed, not while the consumer is busy with a chunk
+        deadline = time.time() + 5
+        while not slots.acquire(False):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        slots.release()
+        data.extend(chunks)
+        with open(origpath, 'rb') as f:
+            self.assertEqual(f.read(), gzip.GzipFile(fileobj=StringIO.StringIO(''.join(data))).read())
+
+    def test_cpushare_validated(self):
+        self.assertEqual(0.5, dumpling._parse_cpushare('0.5'))
+        self.assertEqual(1, dumpling._parse_cpushare('1'))
+        for share in [ '0', '-0.5', '1.5' ]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                dumpling._parse_cpushare(share)
+
+    def test_compressed_stream(self):
+        origpath = self.rand_file(1024 * 64)
+        zippedpath = origpath + '.gzip'
+        unzippedpath = origpath + '.gunzip'
+
+        stream = dumpling.CompressedFileStream(origpath, buffsize = 1024 * 4)
+        
+        with open(zippedpath, 'wb') as fComp:
+            for chunk in stream:
+                fComp.write(chunk)
+
+        dumpling.FileUtils._decompress(zippedpath, unzippedpath)
+
+        with open(origpath, 'rb') as fOrig:
+            with open(unzippedpath, 'rb') as fDecomp:
+                self.assertEqual(fOrig.read(), fDecomp.read())
+
+        self.assertEqual(stream.hash, dumpling.FileUtils._hash(zippedpath))
+        self.assertEqual(stream.size, os.path.getsize(origpath))
+        self.assertEqual(stream.compressedsize, os.path.getsize(zippedpath))
+
+        os.remove(origpath)
+        os.remove(zippedpath)
+        os.remove(unzippedpath)
+
+    def test_block_compress_uncompress(self):
+        origpath = self.rand_file(1024 * 64)
+        zippedpath = origpath + '.gzip'
+        unzippedpath = origpath + '.gunzip'
+
+        hash, index = dumpling.BlockGzip.Compress(origpath, zippedpath, blocksize = 1024 * 4)
+
+        dumpling.FileUtils._decompress(zippedpath, unzippedpath)
+
+        with open(origpath, 'rb') as fOrig:
+            orig = fOrig.read()
+
+        with open(unzippedpath, 'rb') as fDecomp:
+            self.assertEqual(orig, fDecomp.read())
+
+        self.assertEqual(hash, dumpling.FileUtils._hash(zippedpath))
+        self.assertEqual(len(index), 16)
+        self.assertEqual(index, dumpling.BlockGzip.ReadIndex(zippedpath))
+        self.assertEqual(orig[5000:15000], dumpling.BlockGzip.Read(zippedpath, 5000, 10000))
+
+        os.remove(origpath)
+        os.remove(zippedpath)
+        os.remove(unzippedpath)
+
+    def test_sparse_file_reader(self):
+        sparsepath = self.rand_file()
+        with open(sparsepath, 'r+b') as f:
+            f.seek(1024 * 1024 * 4)
+            f.write(self.rand_bytes(1024))
+            f.seek(1024 * 1024 * 9)
+            f.write(self.rand_bytes(1))
+
+        with open(sparsepath, 'rb') as f:
+            expected = f.read()
+
+        densepath = self.rand_file(1)
+        with open(densepath, 'wb') as f:
+            f.write(expected)
+
+        with dumpling.SparseFileReader(sparsepath) as reader:
+            chunks = [ ]
+            chunk = reader.read(1024 * 1000)
+            while chunk:
+                chunks.append(chunk)
+                chunk = reader.read(1024 * 1000)
+
+        try:
+            self.assertEqual(expected, ''.join(chunks))
+            self.assertTrue(all(len(c) == 1024 * 1000 for c in chunks[:-1]))
+            #where the filesystem left the file sparse its holes are returned without being read
+            if hasattr(os.stat(sparsepath), 'st_blocks') and os.stat(sparsepath).st_blocks * 512 < len(expected) and dumpling.SparseFileReader.s_SeekHole is not None:
+                self.assertGreater(reader.holebytes, 0)
+
+            #the compressed output is identical to compressing a file with the same content which isn't sparse
+            for compression in [ None, 'block' ]:
+                outputs = [ ]
+                for path in [ sparsepath, densepath ]:
+                    dumpling.FileUtils._compress_and_hash(path, path + '.gz', compression)
+                    with open(path + '.gz', 'rb') as f:
+                        outputs.append(f.read())
+                self.assertEqual(outputs[0], outputs[1])
+        finally:
+            for p in [ sparsepath, densepath, sparsepath + '.gz', densepath + '.gz' ]:
+                dumpling.FileUtils._try_remove(p)
+
+    def test_detect_compressed(self):
+        textpath = self.rand_file(1024 * 256)
+        randpath = self.rand_file(1)
+        with open(randpath, 'wb') as f:
+            f.write(os.urandom(1024 * 256))
+        gzpath = randpath + '.gz'
+        try:
+            with gzip.open(gzpath, 'wb') as f:
+                f.write(str(self.rand_bytes(1024)))
+
+            self.assertIsNone(dumpling.FileUtils._detect_compressed(textpath))
+            self.assertIsNotNone(dumpling.FileUtils._detect_compressed(randpath))
+            self.assertEqual('gzip format', dumpling.FileUtils._detect_compressed(gzpath))
+
+            #without sampling only the leading bytes identify compressed files
+            self.assertIsNone(dumpling.FileUtils._detect_compressed(randpath, sample=False))
+            self.assertEqual('gzip format', dumpling.FileUtils._detect_compressed(gzpath, sample=False))
+
+            #the level is only chosen from the entropy of the content when it's chosen adaptively
+            transmgr = dumpling.FileTransferManager(None)
+            self.assertEqual(9, transmgr._get_level(randpath))
+            self.assertEqual(0, transmgr._get_level(gzpath))
+            transmgr = dumpling.FileTransferManager(None, compresslevel='adaptive')
+            self.assertEqual(0, transmgr._get_level(randpath))
+
+            #stored files still round trip through the gzip wrapper
+            comppath = randpath + '.stored.gz'
+            dumpling.FileUtils._compress_and_hash(randpath, comppath, level=0)
+            self.assertGreater(os.path.getsize(comppath), os.path.getsize(randpath))
+            dumpling.FileUtils._decompress(comppath, randpath + '.out')
+            with open(randpath, 'rb') as f1, open(randpath + '.out', 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+        finally:
+            for p in (textpath, randpath, gzpath, randpath + '.stored.gz', randpath + '.out'):
+                if os.path.exists(p):
+                    os.remove(p)
+
+    def test_compression_tuner(self):
+        path = self.rand_file(1024 * 1024 * 2)
+        minsize = dumpling.CompressionTuner.s_MinSampledSize
+        dumpling.CompressionTuner.s_MinSampledSize = 0
+        try:
+            #without a known upload speed the default level is kept
+            self.assertEqual(7, dumpling.CompressionTuner(level=7).ChooseLevel(path))
+
+            #the sampled speed and ratio of each level are fixed so the choice doesn't depend on the speed of the machine
+            speeds = { 1: (0.01, 0.9), 3: (0.02, 0.7), 6: (0.05, 0.5), 9: (0.2, 0.3) }
+            def compress_samples(level, samples):
+                elapsed, ratio = speeds[level]
+                return elapsed, int(sum(len(s) for s in samples) * ratio)
+
+            #a slow link favors the best ratio, a fast link the fastest compression
+            for linkspeed, level in [ (0.0001, 9), (100000, 1) ]:
+                tuner = dumpling.CompressionTuner(linkspeed=linkspeed)
+                tuner._compress_samples = compress_samples
+                self.assertEqual(level, tuner.ChooseLevel(path))
+
+            tuner = dumpling.CompressionTuner(level=7)
+            tuner._compress_samples = compress_samples
+            tuner.RecordUpload(1024, 10.0)
+            self.assertEqual(9, tuner.ChooseLevel(path))
+        finally:
+            dumpling.CompressionTuner.s_MinSampledSize = minsize
+            os.remove(path)
+
+    def test_streamed_upload_speed_recorded(self):
+        path = self.rand_file(1024 * 64)
+        class StreamService:
+            def UploadArtifactStream(self, abspath, stream):
+                for chunk in stream:
+                    pass
+                return 'uploadid'
+            def CommitArtifactStream(self, dumpid, abspath, hash, uploadid):
+                pass
+        transmgr = dumpling.FileTransferManager(StreamService(), transfermode='stream', compresslevel='adaptive')
+        recorded = [ ]
+        transmgr._record_upload = lambda size, elapsed: recorded.append((size, elapsed))
+        try:
+            starttime = time.time()
+            transmgr._stream_upload('dumpid', path)
+            #the compressed size is recorded with the time spent sending, which excludes waiting for compression
+            self.assertEqual(1, len(recorded))
+            self.assertGreater(recorded[0][0], 0)
+            self.assertLessEqual(recorded[0][1], time.time() - starttime)
+        finally:
+            os.remove(path)
+
+class test_dumpling_deterministic_gzip(dumpling_testcase):
+    def setUp(self):
+        self.paths = [ ]
+
+    def tearDown(self):
+        for p in self.paths:
+            if os.path.exists(p):
+                os.remove(p)
+
+    def _copy_file(self, path, mtime):
+        copypath = self.rand_file(1)
+        shutil.copyfile(path, copypath)
+        os.utime(copypath, (mtime, mtime))
+        self.paths.append(copypath)
+        return copypath
+
+    def _compress(self, path, compression = None, level = 9):
+        comppath = path + '.%d.gz'%(len(self.paths))
+        self.paths.append(comppath)
+        hash = dumpling.FileUtils._compress_and_hash(path, comppath, compression, level)
+        with open(comppath, 'rb') as f:
+            return hash, f.read()
+
+    def test_identical_content_has_identical_hash(self):
+        origpath = self.rand_file(1024 * 128)
+        self.paths.append(origpath)
+        copypath = self._copy_file(origpath, 1000000)
+
+        for level in (0, 1, 6, 9):
+            hash1, comp1 = self._compress(origpath, level=level)
+            hash2, comp2 = self._compress(copypath, level=level)
+            self.assertEqual(comp1, comp2)
+            self.assertEqual(hash1, hash2)
+            self.assertEqual(hashlib.sha1(comp1).hexdigest(), hash1)
+
+        hash1, comp1 = self._compress(origpath, compression='block')
+        hash2, comp2 = self._compress(copypath, compression='block')
+        self.assertEqual(hash1, hash2)
+
+    def test_canonical_header(self):
+        origpath = self.rand_file(1024 * 16)
+        self.paths.append(origpath)
+        hash, comp = self._compress(origpath)
+
+        magic1, magic2, method, flags, mtime, xfl, ostype = struct.unpack('<BBBBLBB', comp[:10])
+        self.assertEqual((0x1f, 0x8b, 8), (magic1, magic2, method))
+        #no file name or any other optional header fields
+        self.assertEqual(0, flags)
+        self.assertEqual(0, mtime)
+        self.assertEqual(255, ostype)
+
+        with open(origpath, 'rb') as f:
+            self.assertEqual(f.read(), gzip.GzipFile(fileobj=StringIO.StringIO(comp)).read())
+
+    def test_stream_matches_file(self):
+        origpath = self.rand_file(1024 * 128)
+        self.paths.append(origpath)
+        hash, comp = self._compress(origpath, level=6)
+
+        stream = dumpling.CompressedFileStream(origpath, 6, buffsize = 1024 * 4)
+        self.assertEqual(comp, ''.join(stream))
+        self.assertEqual(hash, stream.hash)
+
+    def test_hash_reproducible_across_processes(self):
+        origpath = self.rand_file(1024 * 64)
+        self.paths.append(origpath)
+        hash, comp = self._compress(origpath)
+
+        script = 'import sys, dumpling; dumpling.Output.s_quiet = True; dumpling.Output.s_logPath = None; sys.stdout.write(dumpling.FileUtils._compress_and_hash(sys.argv[1], sys.argv[2]))'
+        comppath = origpath + '.subprocess.gz'
+        self.paths.append(comppath)
+        output = subprocess.check_output([ sys.executable, '-c', script, origpath, comppath ], cwd=os.path.dirname(os.path.abspath(dumpling.__file__)))
+        self.assertEqual(hash, output.strip())
+
+class test_dumpling_filewalker(dumpling_testcase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _create_file(self, relpath, size):
+        path = os.path.join(self.tempdir, relpath)
+        dumpling.FileUtils._ensure_parent_dir(path)
+        with open(path, 'wb') as f:
+            f.write('a' * size)
+        return path
+
+    def _walk(self, paths, **kwargs):
+        return sorted(os.path.relpath(p, self.tempdir) for p in dumpling.FileWalker(paths, **kwargs))
+
+    def test_walk_filters(self):
+        for i in range(50):
+            self._create_file(os.path.join('d%d'%(i % 5), 'sub', 'f%d.so'%(i)), i)
+        self._create_file(os.path.join('d0', 'obj', 'x.so'), 10)
+        self._create_file(os.path.join('d0', 'readme.txt'), 10)
+
+        self.assertEqual(len(self._walk([ self.tempdir ])), 52)
+        self.assertEqual(self._walk([ self.tempdir ], include=[ '*.txt' ]), [ os.path.join('d0', 'readme.txt') ])
+        self.assertEqual(len(self._walk([ self.tempdir ], exclude=[ 'obj', '*.txt' ])), 50)
+        self.assertEqual(len(self._walk([ self.tempdir ], exclude=[ 'd0/obj' ])), 51)
+        self.assertEqual(len(self._walk([ self.tempdir ], include=[ '*.so' ], minsize=10, maxsize=19)), 11)
+
+    def test_walk_dedups_links(self):
+        path = self._create_file(os.path.join('a', 'f.so'), 100)
+        self._create_file(os.path.join('a', 'g.so'), 100)
+        os.link(path, os.path.join(self.tempdir, 'a', 'hardlink.so'))
+        os.symlink(path, os.path.join(self.tempdir, 'symlink.so'))
+        os.symlink(os.path.join(self.tempdir, 'a'), os.path.join(self.tempdir, 'dirlink'))
+        os.symlink(os.path.join(self.tempdir, 'missing'), os.path.join(self.tempdir, 'broken.so'))
+
+        #each file is found once however many paths lead to it, and symlinked directories aren't followed
+        self.assertEqual(len(self._walk([ self.tempdir, os.path.join(self.tempdir, 'a'), path ])), 2)
+
+class test_dumpling_executor(dumpling_testcase):
+    def test_bounded_queue_blocks_producer(self):
+        executor = dumpling.ThreadPoolExecutor(1, 2)
+        release = threading.Event()
+        futures = [ executor.submit(release.wait) ]
+        #wait for the worker to take the first item so the queue is empty
+        while not futures[0].running():
+            release.wait(0.01)
+        producer = threading.Thread(target=lambda: futures.extend(executor.submit(lambda i: i, i) for i in range(3)))
+        producer.setDaemon(True)
+        producer.start()
+        producer.join(0.5)
+        #two items fit in the queue, the third submission waits for room
+        self.assertTrue(producer.is_alive())
+        release.set()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual([ 0, 1, 2 ], [ f.result(5) for f in futures[1:] ])
+
+    def test_as_completed_and_callbacks(self):
+        executor = dumpling.ThreadPoolExecutor(4)
+        events = [ threading.Event() for i in range(3) ]
+        futures = [ executor.submit(lambda i: events[i].wait(5) and i, i) for i in range(3) ]
+        done = [ ]
+        for f in futures:
+            f.add_done_callback(lambda f: done.append(f.result()))
+        completed = dumpling.as_completed(futures, 5)
+        for i in (2, 0, 1):
+            events[i].set()
+            self.assertEqual(i, next(completed).result())
+        self.assertTrue(executor.wait(5))
+        self.assertEqual([ 2, 0, 1 ], done)
+        blocked = threading.Event()
+        with self.assertRaises(dumpling.TimeoutError):
+            list(dumpling.as_completed([ executor.submit(blocked.wait, 5) ], 0.1))
+        blocked.set()
+        self.assertTrue(executor.wait(5))
+
+    def test_cancel(self):
+        executor = dumpling.ThreadPoolExecutor(1)
+        release = threading.Event()
+        running = executor.submit(release.wait, 5)
+        while not running.running():
+            release.wait(0.01)
+        queued = [ executor.submit(lambda: 1) for i in range(3) ]
+        self.assertEqual(3, executor.cancel())
+        self.assertTrue(executor.is_cancelled())
+        release.set()
+        self.assertTrue(running.result(5))
+        for f in queued:
+            self.assertTrue(f.cancelled())
+            with self.assertRaises(dumpling.CancelledError):
+                f.result()
+        self.assertTrue(executor.submit(lambda: 1).cancelled())
+        self.assertTrue(executor.wait(5))
+        blocked = threading.Event()
+        with self.assertRaises(dumpling.TimeoutError):
+            dumpling.ThreadPoolExecutor(1).submit(blocked.wait, 5).result(0.1)
+        blocked.set()
+
+    def test_priority_order(self):
+        executor = dumpling.ThreadPoolExecutor(1)
+        release = threading.Event()
+        blocking = executor.submit(release.wait, 5)
+        while not blocking.running():
+            release.wait(0.01)
+        order = [ ]
+        for priority in (3, 1, 2, 1):
+            executor.submit_priority(priority, order.append, priority)
+        release.set()
+        self.assertTrue(executor.wait(5))
+        self.assertEqual([ 1, 1, 2, 3 ], order)
+
+    def test_workers_reused(self):
+        executor = dumpling.ThreadPoolExecutor(4)
+        threads = set()
+        for i in range(50):
+            executor.submit(lambda: threads.add(threading.current_thread())).result(5)
+        self.assertEqual(1, len(threads))
+        self.assertTrue(executor.wait(5))
+
+    def test_threadpool_shim(self):
+        pool = dumpling.ThreadPool(2)
+        tasks = [ pool.queue_work(lambda x, y: x * y, args=(i, 2)) for i in range(10) ]
+        pool.wait_on_pending_work()
+        self.assertEqual([ i * 2 for i in range(10) ], [ t.await_result() for t in tasks ])
+        self.assertTrue(all(t.completed for t in tasks))
+        task = dumpling.Task(lambda: 5, ())
+        self.assertFalse(task.completed)
+        task.execute()
+        self.assertTrue(task.completed)
+        self.assertEqual(5, task.await_result())
+
+    def test_threadpool_shim_max_threads(self):
+        maxthreads = dumpling.ThreadPool.s_MaxThreads
+        dumpling.ThreadPool.s_MaxThreads = 3
+        try:
+            self.assertEqual(3, dumpling.ThreadPool()._maxthreads)
+        finally:
+            dumpling.ThreadPool.s_MaxThreads = maxthreads
+
+class test_dumpling_service(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def test_connections_reused(self):
+        dumpsvc = dumpling.DumplingService(self.service.url, maxconnections=2)
+        for i in range(10):
+            self.assertEqual([ ], dumpsvc.QueryArtifacts([ str(i) ]))
+        stats = dumpsvc.GetConnectionStats()
+        self.assertEqual(10, stats['requests'])
+        self.assertEqual(1, stats['connections'])
+
+    def test_concurrent_connections_pooled(self):
+        dumpsvc = dumpling.DumplingService(self.service.url, maxconnections=4)
+        executor = dumpling.ThreadPoolExecutor(4)
+        futures = [ executor.submit(dumpsvc.QueryArtifacts, [ str(i) ]) for i in range(40) ]
+        for f in dumpling.as_completed(futures, 30):
+            self.assertEqual([ ], f.result())
+        stats = dumpsvc.GetConnectionStats()
+        self.assertEqual(40, stats['requests'])
+        self.assertLessEqual(stats['connections'], 4)
+
+class test_dumpling_asyncengine(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.tempdir = tempfile.mkdtemp()
+        self.client = dumpling.AsyncHttpClient(maxconnections=64)
+        self.transmgr = dumpling.AsyncFileTransferManager(dumpling.DumplingService(self.service.url), self.client)
+
+    def tearDown(self):
+        self.client.close()
+        self.service.stop()
+        shutil.rmtree(self.tempdir)
+
+    def _create_files(self, count):
+        paths = [ ]
+        for i in range(count):
+            paths.append(os.path.join(self.tempdir, 'file%d.txt'%(i)))
+            with open(paths[-1], 'wb') as f:
+                f.write(self.rand_bytes(random.randint(1, 1024 * 16)))
+        return paths
+
+    def test_upload_download(self):
+        paths = self._create_files(20)
+        hashes = [ f.result(30) for f in [ self.transmgr.QueueFileUpload(None, p) for p in paths ] ]
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        self.assertEqual(len(set(hashes)), len(self.service.artifacts))
+
+        downpaths = [ p + '.down' for p in paths ]
+        self.transmgr.QueueFileDownloads([ (h, d, 0, 0) for h, d in zip(hashes, downpaths) ])
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        for p, d in zip(paths, downpaths):
+            with open(p, 'rb') as f, open(d, 'rb') as fd:
+                self.assertEqual(f.read(), fd.read())
+
+    def test_download_inflated_off_event_loop(self):
+        paths = self._create_files(4)
+        hashes = [ f.result(30) for f in [ self.transmgr.QueueFileUpload(None, p) for p in paths ] ]
+        threads = set()
+        write = dumpling.VerifiedFileWriter.write
+        def recording_write(writer, data):
+            threads.add(threading.current_thread().name)
+            write(writer, data)
+        dumpling.VerifiedFileWriter.write = recording_write
+        try:
+            self.transmgr.QueueFileDownloads([ (h, p + '.down', 0, 0) for h, p in zip(hashes, paths) ])
+            self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        finally:
+            dumpling.VerifiedFileWriter.write = write
+        self.assertTrue(threads)
+        self.assertNotIn('dumpling-eventloop', threads)
+
+    def test_many_requests_in_flight(self):
+        self.service.latency = 0.2
+        paths = self._create_files(100)
+        self.transmgr._uploadlimiter.limit = 64
+        starttime = time.time()
+        self.transmgr.QueueFileUploads(None, paths)
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        #with a request at a time on each of the executor's threads this would take several times as long
+        self.assertLess(time.time() - starttime, 100 * 0.2 / 4)
+        self.assertEqual(100, len(self.service.artifacts))
+        self.assertEqual(100, self.client.GetConnectionStats()['requests'])
+
+    def test_uploads_wait_for_dump_creation(self):
+        paths = self._create_files(4)
+        created = dumpling.Future(None, ())
+        futures = self.transmgr.QueueFileUploads(created, paths)
+        self.assertFalse(any(f.done() for f in futures))
+        created.set_result({ 'dumplingId': 'dumpid' })
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        self.assertEqual(sorted(paths), sorted(p for d, p in self.service.dumpartifacts if d == 'dumpid'))
+
+    def test_failed_request(self):
+        futures = self.transmgr.QueueFileDownloads([ ('missing', os.path.join(self.tempdir, 'missing'), 0, 0) ])
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        self.assertEqual(404, futures[0].exception().response.status_code)
+
+    def test_failed_connection(self):
+        self.service.stop()
+        futures = self.transmgr.QueueFileUploads(None, self._create_files(2))
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        self.assertTrue(all(isinstance(f.exception(), dumpling.requests.exceptions.ConnectionError) for f in futures))
+
+    def test_idle_request_times_out(self):
+        self.service.latency = 2
+        client = dumpling.AsyncHttpClient(idletimeout=0.5)
+        try:
+            transmgr = dumpling.AsyncFileTransferManager(dumpling.DumplingService(self.service.url), client)
+            futures = transmgr.QueueFileUploads(None, self._create_files(1))
+            self.assertTrue(transmgr.WaitForPendingTransfers())
+            self.assertTrue(isinstance(futures[0].exception(), dumpling.requests.exceptions.ReadTimeout))
+        finally:
+            client.close()
+
+    def test_proxied_host_rejected(self):
+        environ = dict(os.environ)
+        os.environ['http_proxy'] = 'http://127.0.0.1:1'
+        os.environ.pop('no_proxy', None)
+        os.environ.pop('NO_PROXY', None)
+        try:
+            futures = self.transmgr.QueueFileUploads(None, self._create_files(1))
+            self.assertTrue(self.transmgr.WaitForPendingTransfers())
+            self.assertTrue(isinstance(futures[0].exception(), dumpling.requests.exceptions.ProxyError))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_deadline_cancels_waiting_transfers(self):
+        self.service.latency = 0.5
+        self.transmgr._uploadlimiter.limit = 1
+        self.transmgr._deadline = time.time() + 0.25
+        futures = self.transmgr.QueueFileUploads(None, self._create_files(4))
+        self.assertFalse(self.transmgr.WaitForPendingTransfers())
+        self.assertGreater(sum(f.cancelled() for f in futures), 0)
+        self.transmgr._deadline = None
+        self.transmgr.WaitForPendingTransfers()
+
+class test_dumpling_verifieddownload(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.tempdir = tempfile.mkdtemp()
+        self.dumpSvc = dumpling.DumplingService(self.service.url)
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.tempdir)
+
+    def _add_artifact(self, content, blocksize = None):
+        path = os.path.join(self.tempdir, 'content')
+        with open(path, 'wb') as f:
+            f.write(content)
+        hash, index = dumpling.BlockGzip.Compress(path, path + '.gz', blocksize=blocksize)
+        with open(path + '.gz', 'rb') as f:
+            self.service.add_artifact(None, path, hash, f.read())
+        return hash
+
+    def test_download_inflates_members(self):
+        content = self.rand_bytes(1024 * 64)
+        hash = self._add_artifact(content, 1024 * 4)
+        downpath = os.path.join(self.tempdir, 'down', 'content')
+
+        self.dumpSvc.DownloadArtifact(hash, downpath)
+
+        with open(downpath, 'rb') as f:
+            self.assertEqual(content, f.read())
+        self.assertFalse(os.path.exists(downpath + '.partial'))
+
+    def test_corrupt_download_not_published(self):
+        hash = self._add_artifact(self.rand_bytes(1024))
+        self.service.artifacts[hash] = self.service.artifacts[self._add_artifact(self.rand_bytes(1024))]
+        downpath = os.path.join(self.tempdir, 'down')
+        with open(downpath, 'wb') as f:
+            f.write('original')
+
+        with self.assertRaises(IOError):
+            self.dumpSvc.DownloadArtifact(hash, downpath)
+
+        client = dumpling.AsyncHttpClient()
+        try:
+            transfer = dumpling.AsyncFileTransferManager(self.dumpSvc, client).QueueFileDownload(hash, downpath)
+            self.assertTrue(isinstance(transfer.exception(30), IOError))
+        finally:
+            client.close()
+
+        #the existing file is left as it was and the partial download removed
+        with open(downpath, 'rb') as f:
+            self.assertEqual('original', f.read())
+        self.assertFalse(os.path.exists(downpath + '.partial'))
+
+    def test_ranged_download(self):
+        content = self.rand_bytes(1024 * 256)
+        hash = self._add_artifact(content, 1024 * 16)
+        size = len(self.service.artifacts[hash])
+        downpath = os.path.join(self.tempdir, 'down')
+        self._set_ranges(1024 * 16)
+
+        transmgr = dumpling.FileTransferManager(self.dumpSvc)
+        transmgr.QueueFileDownload(hash, downpath, size=size).result(30)
+
+        with open(downpath, 'rb') as f:
+            self.assertEqual(content, f.read())
+        self.assertEqual((size + 1024 * 16 - 1) / (1024 * 16), len([ r for r in self.service.requests if r[1].startswith('/storage') ]))
+        self.assertEqual([ 'content', 'content.gz', 'down' ], sorted(os.listdir(self.tempdir)))
+
+        #if storage doesn't serve ranges the download fails without leaving partial files
+        self.service.ranges = False
+        os.remove(downpath)
+        with self.assertRaises(IOError):
+            transmgr.QueueFileDownload(hash, downpath, size=size).result(30)
+        self.assertEqual([ 'content', 'content.gz' ], sorted(os.listdir(self.tempdir)))
+
+    def _set_ranges(self, rangesize):
+        saved = (dumpling.FileTransferManager.s_RangeThreshold, dumpling.FileTransferManager.s_RangeSize, dumpling.FileTransferManager.s_ChunkRetryDelay)
+        def restore():
+            dumpling.FileTransferManager.s_RangeThreshold, dumpling.FileTransferManager.s_RangeSize, dumpling.FileTransferManager.s_ChunkRetryDelay = saved
+        self.addCleanup(restore)
+        dumpling.FileTransferManager.s_RangeThreshold = rangesize
+        dumpling.FileTransferManager.s_RangeSize = rangesize
+        dumpling.FileTransferManager.s_ChunkRetryDelay = 0
+
+class test_dumpling_artifactcache(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.tempdir = tempfile.mkdtemp()
+        self.dumpSvc = dumpling.DumplingService(self.service.url)
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.tempdir)
+
+    def _add_artifact(self, content):
+        path = os.path.join(self.tempdir, 'content')
+        with open(path, 'wb') as f:
+            f.write(content)
+        hash, data = dumpling.FileUtils._compress_data(str(content), 6)
+        self.service.add_artifact(None, path, hash, data)
+        return hash
+
+    def test_cached_download_not_requested(self):
+        content = self.rand_bytes(1024 * 16)
+        hash = self._add_artifact(content)
+        cache = dumpling.ArtifactCache(os.path.join(self.tempdir, 'cache'))
+        transmgr = dumpling.FileTransferManager(self.dumpSvc, cache=cache)
+
+        transmgr.QueueFileDownload(hash, os.path.join(self.tempdir, 'first')).result(30)
+        requested = len(self.service.requests)
+        transmgr.QueueFileDownload(hash, os.path.join(self.tempdir, 'second')).result(30)
+
+        client = dumpling.AsyncHttpClient()
+        try:
+            dumpling.AsyncFileTransferManager(self.dumpSvc, client, cache=cache).QueueFileDownload(hash, os.path.join(self.tempdir, 'third')).result(30)
+        finally:
+            client.close()
+
+        self.assertEqual(requested, len(self.service.requests))
+        for name in [ 'second', 'third' ]:
+            with open(os.path.join(self.tempdir, name), 'rb') as f:
+                self.assertEqual(content, f.read())
+        self.assertEqual((2, 1, 1024 * 32), (cache.hits, cache.misses, cache.savedbytes))
+
+    def test_changed_content_not_served(self):
+        cache = dumpling.ArtifactCache(os.path.join(self.tempdir, 'cache'))
+        path = os.path.join(self.tempdir, 'content')
+        with open(path, 'wb') as f:
+            f.write(self.rand_bytes(1024))
+        cache.Put('0' * 40, path)
+
+        #editing a downloaded file hardlinked to the cached content changes the cached content too
+        with open(cache._get_path('0' * 40), 'ab') as f:
+            f.write('changed')
+
+        self.assertFalse(cache.Get('0' * 40, os.path.join(self.tempdir, 'got')))
+        self.assertFalse(os.path.exists(cache._get_path('0' * 40)))
+
+    def test_failed_eviction_reported(self):
+        cache = dumpling.ArtifactCache(os.path.join(self.tempdir, 'cache'), maxsize=1024 * 8)
+        tryremove = dumpling.FileUtils._try_remove
+        def remove(path):
+            #temp files are removed as the content is cached, only the cached content can't be removed
+            if path.endswith('.partial'):
+                return tryremove(path)
+            raise OSError(errno.EACCES, 'access denied', path)
+        self.addCleanup(setattr, dumpling.FileUtils, '_try_remove', staticmethod(tryremove))
+        dumpling.FileUtils._try_remove = staticmethod(remove)
+        for i in range(3):
+            path = os.path.join(self.tempdir, 'content%d'%(i))
+            with open(path, 'wb') as f:
+                f.write(self.rand_bytes(1024 * 2))
+            cache.Put(str(i) * 40, path)
+
+        #the content which couldn't be evicted is still cached and accounted for
+        self.assertEqual(3, cache._execute('SELECT COUNT(*) FROM artifacts', ()).fetchone()[0])
+        self.assertTrue(cache.Get('0' * 40, os.path.join(self.tempdir, 'got')))
+
+    def test_repeat_download_only_fetches_changes(self):
+        contents = [ self.rand_bytes(1024 * 4) for i in range(3) ]
+        hashes = [ self._add_artifact(c) for c in contents ]
+        manifest = { 'displayName': 'dump', 'dumpArtifacts': [ { 'hash': h, 'relativePath': 'file%d'%(i) } for i, h in enumerate(hashes) ] }
+        hashcache = dumpling.HashCache(os.path.join(self.tempdir, 'hashcache.db'))
+        transmgr = dumpling.FileTransferManager(self.dumpSvc, hashcache=hashcache)
+        cmdProc = dumpling.CommandProcessor(transmgr, self.dumpSvc)
+        downdir = os.path.join(self.tempdir, 'down')
+
+        def downloaded():
+            requested = len(self.service.requests)
+            cmdProc._download_dump(downdir, manifest, verify)
+            return (len(self.service.requests) - requested) / 2
+
+        verify = False
+        self.assertEqual(3, downloaded())
+        self.assertEqual(0, downloaded())
+
+        #a changed artifact in the manifest and a locally modified file are downloaded again
+        manifest['dumpArtifacts'][0]['hash'] = hashes[0] = self._add_artifact(self.rand_bytes(1024 * 4))
+        with open(os.path.join(downdir, 'dump', 'file1'), 'ab') as f:
+            f.write('changed')
+        self.assertEqual(2, downloaded())
+
+        #verify finds changed content the hash cache doesn't see, simulated by recording the changed file as downloaded
+        path = os.path.join(downdir, 'dump', 'file2')
+        key, entry = hashcache.Get(path)
+        with open(path, 'r+b') as f:
+            f.write('x')
+        hashcache.Set(dumpling.HashCache._get_key(path), entry['hash'], entry['comphash'])
+        self.assertEqual(0, downloaded())
+        verify = True
+        self.assertEqual(1, downloaded())
+        with open(path, 'rb') as f:
+            self.assertEqual(contents[2], f.read())
+
+    def test_least_recently_used_evicted(self):
+        cache = dumpling.ArtifactCache(os.path.join(self.tempdir, 'cache'), maxsize=1024 * 40)
+        hashes = [ ]
+        for i in range(4):
+            path = os.path.join(self.tempdir, 'content%d'%(i))
+            with open(path, 'wb') as f:
+                f.write(self.rand_bytes(1024 * 10))
+            hashes.append(str(i) * 40)
+            cache.Put(hashes[i], path)
+            time.sleep(0.01)
+
+        #using the first artifact makes the second the least recently used, which is evicted when a fifth is added
+        self.assertTrue(cache.Get(hashes[0], os.path.join(self.tempdir, 'used')))
+        path = os.path.join(self.tempdir, 'content4')
+        with open(path, 'wb') as f:
+            f.write(self.rand_bytes(1024 * 10))
+        cache.Put('4' * 40, path)
+
+        self.assertFalse(cache.Get(hashes[1], os.path.join(self.tempdir, 'evicted')))
+        self.assertTrue(all(cache.Get(hash, os.path.join(self.tempdir, 'kept')) for hash in [ hashes[0], hashes[2], hashes[3], '4' * 40 ]))
+
+class test_dumpling_batchdownload(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.tempdir = tempfile.mkdtemp()
+        self.dumpSvc = dumpling.DumplingService(self.service.url)
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.tempdir)
+
+    def test_shared_artifacts_downloaded_once(self):
+        self._download_dumps(dumpling.FileTransferManager(self.dumpSvc))
+
+    def test_shared_artifacts_downloaded_once_async(self):
+        client = dumpling.AsyncHttpClient()
+        try:
+            self._download_dumps(dumpling.AsyncFileTransferManager(self.dumpSvc, client))
+        finally:
+            client.close()
+
+    def test_download_throughput_counts_received_bytes(self):
+        content = '\0' * 1024 * 256
+        hash, data = dumpling.FileUtils._compress_data(content, 6)
+        self.service.add_artifact(None, 'zeros', hash, data)
+        transmgr = dumpling.FileTransferManager(self.dumpSvc)
+        transmgr.QueueFileDownload(hash, os.path.join(self.tempdir, 'zeros')).result(30)
+        #the limiter measures the compressed bytes which crossed the network, not the inflated file
+        self.assertEqual(len(data), transmgr._downloadlimiter._totalbytes)
+
+    def _download_dumps(self, transmgr):
+        contents = { }
+        for name in [ 'shared', 'first', 'second' ]:
+            content = self.rand_bytes(1024 * 8)
+            hash, data = dumpling.FileUtils._compress_data(str(content), 6)
+            self.service.add_artifact(None, name, hash, data)
+            contents[name] = (hash, content)
+        for dumpid, own in [ ('dump1', 'first'), ('dump2', 'second') ]:
+            self.service.manifests[dumpid] = { 'displayName': dumpid, 'dumpArtifacts': [ { 'hash': contents[name][0], 'relativePath': 'lib/' + name } for name in [ 'shared', own ] ] }
+        downdir = os.path.join(self.tempdir, 'down')
+
+        #the dump without a manifest is skipped
+        dumpling.CommandProcessor(transmgr, self.dumpSvc)._download_dumps(downdir, [ 'dump1', 'missing', 'dump2' ])
+
+        storage = [ r[1] for r in self.service.requests if r[1].startswith('/storage') ]
+        self.assertEqual(sorted('/storage/' + hash for hash, content in contents.values()), sorted(storage))
+        self.assertEqual([ 'dump1', 'dump2' ], sorted(os.listdir(downdir)))
+        for dumpid, own in [ ('dump1', 'first'), ('dump2', 'second') ]:
+            for name in [ 'shared', own ]:
+                with open(os.path.join(downdir, dumpid, 'lib', name), 'rb') as f:
+                    self.assertEqual(contents[name][1], f.read())
+
+@unittest.skipUnless(os.environ.get('DUMPLING_BENCHMARK'), 'set DUMPLING_BENCHMARK to compare the throughput of the transfer engines')
+class test_dumpling_enginebenchmark(dumpling_testcase):
+    s_FileCount = 2000
+    s_Latency = 0.05
+
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.service.latency = test_dumpling_enginebenchmark.s_Latency
+        self.tempdir = tempfile.mkdtemp()
+        self.paths = [ ]
+        for i in range(test_dumpling_enginebenchmark.s_FileCount):
+            self.paths.append(os.path.join(self.tempdir, 'file%d.txt'%(i)))
+            with open(self.paths[-1], 'wb') as f:
+                f.write(self.rand_bytes(1024))
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.tempdir)
+
+    #the ceiling of each engine is measured with the concurrency limit at its maximum rather than ramping up to it
+    def _files_per_second(self, transmgr):
+        self.service.artifacts = { }
+        transmgr._uploadlimiter.limit = transmgr._uploadlimiter._maxlimit
+        starttime = time.time()
+        transmgr.QueueFileUploads(None, self.paths)
+        self.assertTrue(transmgr.WaitForPendingTransfers())
+        self.assertEqual(len(self.paths), len(self.service.artifacts))
+        return len(self.paths) / (time.time() - starttime)
+
+    def test_async_engine_throughput(self):
+        dumpsvc = dumpling.DumplingService(self.service.url, maxconnections=dumpling.ConcurrencyLimiter.s_MaxLimit)
+        threaded = self._files_per_second(dumpling.FileTransferManager(dumpsvc))
+        client = dumpling.AsyncHttpClient()
+        try:
+            evented = self._files_per_second(dumpling.AsyncFileTransferManager(dumpsvc, client))
+        finally:
+            client.close()
+        sys.stderr.write('\n%d files of 1KB with %dms latency: thread engine %.0f files/sec, async engine %.0f files/sec\n'%(len(self.paths), test_dumpling_enginebenchmark.s_Latency * 1000, threaded, evented))
+        self.assertGreater(evented, threaded)
+
+class test_dumpling_background(dumpling_testcase):
+    def test_token_bucket_shared_rate(self):
+        bucket = dumpling.TokenBucket(1024 * 1024)
+        executor = dumpling.ThreadPoolExecutor(4)
+        starttime = time.time()
+        #the burst is a quarter of a second so sending 1.25 seconds worth of data takes at least a second
+        futures = [ executor.submit(bucket.Consume, 1024 * 64) for i in range(20) ]
+        for f in dumpling.as_completed(futures, 10):
+            f.result()
+        self.assertGreaterEqual(time.time() - starttime, 0.95)
+        self.assertLess(time.time() - starttime, 2)
+
+    def test_throttled_upload(self):
+        service = LocalDumplingService()
+        try:
+            dumpsvc = dumpling.DumplingService(service.url, bandwidth=dumpling.TokenBucket(1024 * 256))
+            content = self.rand_bytes(1024 * 128)
+            compressed = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+                f.write(str(content))
+            path = self.rand_file(1)
+            with open(path, 'wb') as f:
+                f.write(compressed.getvalue() * 4)
+            hash = hashlib.sha1(compressed.getvalue() * 4).hexdigest()
+            starttime = time.time()
+            with open(path, 'rb') as f:
+                dumpsvc.UploadArtifact(None, path, hash, f)
+            #the file is sent with its content length within the bandwidth, less the initial burst
+            self.assertGreaterEqual(time.time() - starttime, (len(compressed.getvalue()) * 4 - 1024 * 64) / (1024.0 * 256) - 0.05)
+            self.assertEqual(compressed.getvalue() * 4, service.artifacts[hash])
+            dumpling.FileUtils._try_remove(path)
+        finally:
+            service.stop()
+
+    def test_compression_share(self):
+        transmgr = dumpling.FileTransferManager(dumpling.DumplingService('http://127.0.0.1:1/'), maxthreads=8, compressthreads=2)
+        lock = threading.Lock()
+        state = { 'active': 0, 'max': 0 }
+        def compress():
+            with lock:
+                state['active'] += 1
+                state['max'] = max(state['max'], state['active'])
+            time.sleep(0.02)
+            with lock:
+                state['active'] -= 1
+        futures = [ transmgr._threadpool.submit(transmgr._compress, compress) for i in range(16) ]
+        for f in dumpling.as_completed(futures, 10):
+            f.result()
+        self.assertEqual(2, state['max'])
+
+class test_dumpling_concurrencylimiter(dumpling_testcase):
+    def setUp(self):
+        self.interval = dumpling.ConcurrencyLimiter.s_Interval
+        #adjust the limit on every release
+        dumpling.ConcurrencyLimiter.s_Interval = 0
+
+    def tearDown(self):
+        dumpling.ConcurrencyLimiter.s_Interval = self.interval
+
+    def _acquire_async(self, limiter):
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (limiter.Acquire(), acquired.set()))
+        thread.setDaemon(True)
+        thread.start()
+        return acquired
+
+    def test_additive_increase_when_saturated(self):
+        limiter = dumpling.ConcurrencyLimiter('test', maxlimit=3, initial=2)
+        limiter.Acquire()
+        limiter.Acquire()
+        acquired = self._acquire_async(limiter)
+        self.assertFalse(acquired.wait(0.3))
+        limiter.Release(1024 * 1024)
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(3, limiter.limit)
+
+        #the limit never exceeds the maximum
+        limiter.Acquire()
+        acquired = self._acquire_async(limiter)
+        self.assertFalse(acquired.wait(0.3))
+        limiter.Release(1024 * 1024)
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(3, limiter.limit)
+
+    def test_multiplicative_decrease_on_congestion(self):
+        limiter = dumpling.ConcurrencyLimiter('test', maxlimit=16, initial=8)
+        limiter.Acquire()
+        limiter.Release(0, congested=True)
+        self.assertEqual(4, limiter.limit)
+        limiter.Acquire()
+        limiter.Release(0, congested=True)
+        self.assertEqual(2, limiter.limit)
+
+    def test_no_increase_when_not_saturated(self):
+        limiter = dumpling.ConcurrencyLimiter('test', maxlimit=16, initial=4)
+        for i in range(5):
+            limiter.Acquire()
+            limiter.Release(1024)
+        self.assertEqual(4, limiter.limit)
+
+    def test_cancelled_acquire(self):
+        limiter = dumpling.ConcurrencyLimiter('test', maxlimit=1)
+        limiter.Acquire()
+        with self.assertRaises(dumpling.CancelledError):
+            limiter.Acquire(lambda: True)
+
+class test_dumpling_scheduling(dumpling_testcase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.transmgr = dumpling.FileTransferManager(dumpling.DumplingService('http://127.0.0.1:1/'), maxthreads=1)
+        self.release = threading.Event()
+        self.order = [ ]
+        self.transmgr._compress_and_upload = lambda dumpid, abspath: self.order.append(os.path.basename(abspath))
+
+    def tearDown(self):
+        self.release.set()
+        shutil.rmtree(self.tempdir)
+
+    def _create_file(self, name, size):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(self.rand_bytes(size))
+        return path
+
+    def _block_transfers(self):
+        blocking = self.transmgr._threadpool.submit(self.release.wait, 5)
+        while not blocking.running():
+            self.release.wait(0.01)
+
+    def test_priority_classes(self):
+        FTM = dumpling.FileTransferManager
+        self.assertEqual(FTM.s_PriorityCritical, FTM._get_upload_priority(self._create_file('libcoreclr.so', 16)))
+        self.assertEqual(FTM.s_PriorityModule, FTM._get_upload_priority(self._create_file('libfoo.so.1', 16)))
+        with open(os.path.join(self.tempdir, 'app'), 'wb') as f:
+            f.write('\x7fELF' + '\0' * 16)
+        self.assertEqual(FTM.s_PriorityModule, FTM._get_upload_priority(os.path.join(self.tempdir, 'app')))
+        self.assertEqual(FTM.s_PriorityOther, FTM._get_upload_priority(self._create_file('test.log', 16)))
+
+        self.assertEqual(FTM.s_PriorityDump, FTM._get_download_priority({ 'hash': 'a', 'dumpId': 'a', 'relativePath': 'core' }))
+        self.assertEqual(FTM.s_PriorityCritical, FTM._get_download_priority({ 'hash': 'b', 'dumpId': 'a', 'relativePath': 'app', 'executableImage': True }))
+        self.assertEqual(FTM.s_PriorityModule, FTM._get_download_priority({ 'hash': 'c', 'dumpId': 'a', 'relativePath': 'lib/libfoo.so' }))
+        self.assertEqual(FTM.s_PriorityOther, FTM._get_download_priority({ 'hash': 'd', 'dumpId': 'a', 'relativePath': 'out.txt' }))
+
+    def test_uploads_scheduled_by_priority_and_size(self):
+        paths = [ self._create_file('small.log', 16), self._create_file('large.log', 1024), self._create_file('libfoo.so', 16), self._create_file('libcoreclr.so', 16) ]
+        self._block_transfers()
+        self.transmgr.QueueFileUploads(None, paths)
+        self.release.set()
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        self.assertEqual([ 'libcoreclr.so', 'libfoo.so', 'large.log', 'small.log' ], self.order)
+
+    def test_critical_modules_queued_as_found(self):
+        batches = [ ]
+        self.transmgr._queue_upload_batch = lambda dumpid, abspaths: batches.append([ os.path.basename(p) for p in abspaths ]) or [ ]
+        batchsize = dumpling.FileTransferManager.s_UploadBatchSize
+        dumpling.FileTransferManager.s_UploadBatchSize = 2
+        try:
+            self.transmgr.QueueFileUploads(None, [ os.path.join(self.tempdir, n) for n in [ 'a.log', 'b.log', 'c.log', 'libcoreclr.so', 'd.log' ] ])
+        finally:
+            dumpling.FileTransferManager.s_UploadBatchSize = batchsize
+        self.assertEqual([ [ 'a.log', 'b.log' ], [ 'libcoreclr.so' ], [ 'c.log', 'd.log' ] ], batches)
+
+    def test_deadline_cancels_incomplete_transfers(self):
+        self.transmgr._deadline = time.time() + 0.2
+        self._block_transfers()
+        futures = self.transmgr.QueueFileUploads(None, [ self._create_file('a.log', 16), self._create_file('b.log', 16) ])
+        self.assertFalse(self.transmgr.WaitForPendingTransfers())
+        self.assertTrue(all(f.cancelled() for f in futures))
+        self.assertEqual([ ], self.order)
+
+class test_dumpling_dumpupload(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), maxthreads=4)
+        self.dumppath = self.rand_file()
+        self.incpaths = [ self.rand_file() for i in range(3) ]
+
+    def tearDown(self):
+        self.service.dumpcontent.set()
+        self.service.stop()
+        for p in [ self.dumppath ] + self.incpaths:
+            dumpling.FileUtils._try_remove(p)
+
+    def test_files_upload_while_dump_uploads(self):
+        self.service.dumpcontent.clear()
+        created, transfer = self.transmgr.QueueDumpUpload(self.dumppath, 'user', 'dump')
+        futures = self.transmgr.QueueFileUploads(created, self.incpaths)
+        for f in futures:
+            f.result(5)
+        #the files are registered with the dump while the dump content is still being uploaded
+        dumpid = created.result()['dumplingId']
+        self.assertFalse(transfer.done())
+        self.assertEqual(sorted(self.incpaths), sorted(p for d, p in self.service.dumpartifacts if d == dumpid))
+        self.service.dumpcontent.set()
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        self.assertEqual(created.result(), transfer.result())
+        self.assertIn((dumpid, self.dumppath), self.service.dumpartifacts)
+
+    def test_files_wait_for_dump_without_threads(self):
+        transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), maxthreads=1)
+        created = dumpling.Future(None, ())
+        futures = transmgr.QueueFileUploads(created, self.incpaths)
+        #the only executor thread is free for other work while the files wait for the dump to be created
+        self.assertEqual(1, transmgr._threadpool.submit(lambda: 1).result(5))
+        self.assertFalse(any(f.done() for f in futures))
+        self.assertEqual(1, len(transmgr._precompressed))
+        created.set_result({ 'dumplingId': 'dumpid' })
+        self.assertTrue(transmgr.WaitForPendingTransfers())
+        self.assertEqual(sorted(self.incpaths), sorted(p for d, p in self.service.dumpartifacts if d == 'dumpid'))
+        self.assertEqual({ }, transmgr._precompressed)
+
+    def test_files_waiting_for_dump_limited(self):
+        transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), maxthreads=1)
+        paths = [ self.rand_file() for i in range(6) ]
+        created = dumpling.Future(None, ())
+        queued = [ ]
+        maxwaiting = dumpling.FileTransferManager.s_MaxWaitingForDump
+        dumpling.FileTransferManager.s_MaxWaitingForDump = 2
+        try:
+            producer = threading.Thread(target=lambda: queued.extend(transmgr.QueueFileUploads(created, paths)))
+            producer.start()
+            producer.join(0.5)
+            #the producer waits once the limit of transfers are waiting for the dump
+            self.assertTrue(producer.is_alive())
+            self.assertLessEqual(transmgr._waitingfordump, 2 + 1)
+            created.set_result({ 'dumplingId': 'dumpid' })
+            producer.join(5)
+            self.assertFalse(producer.is_alive())
+        finally:
+            dumpling.FileTransferManager.s_MaxWaitingForDump = maxwaiting
+        self.assertTrue(transmgr.WaitForPendingTransfers())
+        self.assertEqual(len(paths), len(queued))
+        self.assertEqual(sorted(paths), sorted(p for d, p in self.service.dumpartifacts if d == 'dumpid'))
+
+    def test_upload_dump(self):
+        dumpdata = self.transmgr.UploadDump(self.dumppath, self.incpaths, 'user', 'dump')
+        self.assertEqual('dump', self.service.dumps[dumpdata['dumplingId']])
+        self.assertIn((dumpdata['dumplingId'], self.dumppath), self.service.dumpartifacts)
+
+    def test_files_fail_when_dump_fails(self):
+        self.service.stop()
+        created, transfer = self.transmgr.QueueDumpUpload(self.dumppath, 'user', 'dump')
+        futures = self.transmgr.QueueFileUploads(created, self.incpaths)
+        self.assertTrue(self.transmgr.WaitForPendingTransfers())
+        self.assertIsNotNone(transfer.exception())
+        self.assertIsNotNone(created.exception())
+        self.assertTrue(all(f.exception() is not None for f in futures))
+
+    def test_triage_overlaps_upload(self):
+        cmdProc = dumpling.CommandProcessor(self.transmgr, self.transmgr._dumpSvc)
+        def run_triage(dumppath, config):
+            #triage only completes once the files are uploaded so would never complete if it ran before the upload
+            while len(self.service.dumpartifacts) < len(self.incpaths):
+                time.sleep(0.01)
+            return { 'TRIAGE_RESULT': 'ok', 'CLIENT_NAME': 'triage' }
+        cmdProc._run_triage = run_triage
+        config = argparse.Namespace(dumppath=self.dumppath, displayname='dump', user='user', incpaths=self.incpaths, triage='full', 
+                                    properties=[ ('CLIENT_NAME', 'client') ], propfile=None, url=self.service.url,
+                                    include=None, exclude=None, minsize=None, maxsize=None)
+        dumpid = cmdProc.UploadDump(config)
+        #triage properties are posted after the client properties so take precedence
+        self.assertEqual({ 'TRIAGE_RESULT': 'ok', 'CLIENT_NAME': 'triage' }, dict((k, v) for k, v in self.service.properties[dumpid].iteritems() if k in ('TRIAGE_RESULT', 'CLIENT_NAME')))
+        self.assertEqual(len(self.incpaths) + 1, len(self.service.dumpartifacts))
+
+    def test_triage_fails_when_upload_fails(self):
+        cmdProc = dumpling.CommandProcessor(self.transmgr, self.transmgr._dumpSvc)
+        cmdProc._run_triage = lambda dumppath, config: { 'TRIAGE_RESULT': 'ok' }
+        def fail_uploads(dumpid, abspaths):
+            raise IOError('walk failed')
+        self.transmgr.QueueFileUploads = fail_uploads
+        config = argparse.Namespace(dumppath=self.dumppath, displayname='dump', user='user', incpaths=self.incpaths, triage='full',
+                                    properties=None, propfile=None, url=self.service.url,
+                                    include=None, exclude=None, minsize=None, maxsize=None)
+        with self.assertRaises(IOError):
+            cmdProc.UploadDump(config)
+        #triage waits for the properties to be posted, which fails rather than leaving it waiting
+        name, job = self.transmgr._jobs[0]
+        self.assertTrue(isinstance(job.exception(5), IOError))
+        self.transmgr.WaitForPendingTransfers()
+
+    def test_jobs_joined(self):
+        release = threading.Event()
+        job = self.transmgr.QueueJob('job', release.wait, 5)
+        self.transmgr._deadline = time.time() + 0.1
+        self.assertFalse(self.transmgr.WaitForPendingTransfers())
+        release.set()
+        self.transmgr._deadline = None
+        self.assertTrue(job.result(5))
+
+class test_dumpling_bundleupload(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.tempdir = tempfile.mkdtemp()
+        self.maxfiles = dumpling.FileTransferManager.s_BundleMaxFiles
+
+    def tearDown(self):
+        dumpling.FileTransferManager.s_BundleMaxFiles = self.maxfiles
+        self.service.stop()
+        shutil.rmtree(self.tempdir)
+
+    def _create_files(self, count, size):
+        paths = [ ]
+        for i in range(count):
+            paths.append(os.path.join(self.tempdir, '%d_%d.txt'%(size, i)))
+            with open(paths[-1], 'wb') as f:
+                f.write(self.rand_bytes(size))
+        return paths
+
+    def _upload(self, paths):
+        transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), bundlesize=dumpling.FileTransferManager.s_BundleFileSize)
+        for t in transmgr.QueueFileUploads('dumpid', paths):
+            t.result()
+        self.assertTrue(transmgr.WaitForPendingTransfers())
+        return [ r[1].split('/')[-1] for r in self.service.requests if r[0] == 'POST' ]
+
+    def test_small_files_bundled(self):
+        small = self._create_files(20, 1024)
+        large = self._create_files(1, 1024 * 128)
+        shutil.copyfile(small[0], small[1])
+
+        self.assertEqual(sorted(self._upload(small + large)), [ 'bundles', 'uploads' ])
+
+        #each bundled file is stored under the same hash as if it had been uploaded on its own
+        self.assertEqual(len(self.service.dumpartifacts), 21)
+        self.assertEqual(len(self.service.artifacts), 20)
+        for p in small:
+            hash = self.service.dumpartifacts[('dumpid', p)]
+            self.assertEqual(hash, dumpling.FileUtils._compress_and_hash(p, os.path.join(self.tempdir, 'compressed.gz')))
+            with open(p, 'rb') as f:
+                self.assertEqual(gzip.GzipFile(fileobj=StringIO.StringIO(self.service.artifacts[hash])).read(), f.read())
+
+    def test_uploads_queued_in_batches(self):
+        paths = self._create_files(30, 1024 * 128)
+        batchsize = dumpling.FileTransferManager.s_UploadBatchSize
+        dumpling.FileTransferManager.s_UploadBatchSize = 8
+        try:
+            self.assertEqual(self._upload(dumpling.FileWalker([ self.tempdir ])), [ 'uploads' ] * 30)
+        finally:
+            dumpling.FileTransferManager.s_UploadBatchSize = batchsize
+        self.assertEqual(sorted(p for d, p in self.service.dumpartifacts), sorted(paths))
+
+    def test_bundle_limits(self):
+        #too few small files are uploaded on their own
+        self.assertEqual(self._upload(self._create_files(dumpling.FileTransferManager.s_BundleMinFiles - 1, 1024)), [ 'uploads' ] * (dumpling.FileTransferManager.s_BundleMinFiles - 1))
+
+        #bundles are split at the file count
+        self.service.requests = [ ]
+        dumpling.FileTransferManager.s_BundleMaxFiles = 8
+        self.assertEqual(self._upload(self._create_files(20, 2048)), [ 'bundles' ] * 3)
+        self.assertEqual(len(self.service.dumpartifacts), 27)
+
 class test_dumpling_filetransfer(dumpling_testcase):
     def test_upload_download_artifact(self):
         origpath = self.rand_file()
@@ -99,6 +1557,216 @@ class test_dumpling_filetransfer(dumpling_testcase):
         
 
 
+class test_dumpling_chunkedupload(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.journaldir = tempfile.mkdtemp()
+        self.origpath = self.rand_file(1024 * 64)
+        self._saved = (dumpling.UploadJournal.s_JournalDir, dumpling.FileTransferManager.s_ChunkSize, dumpling.FileTransferManager.s_MaxChunkRetries, dumpling.FileTransferManager.s_ChunkRetryDelay)
+        dumpling.UploadJournal.s_JournalDir = self.journaldir
+        dumpling.FileTransferManager.s_ChunkSize = 1024 * 4
+        dumpling.FileTransferManager.s_ChunkRetryDelay = 0
+        
+    def tearDown(self):
+        dumpling.UploadJournal.s_JournalDir, dumpling.FileTransferManager.s_ChunkSize, dumpling.FileTransferManager.s_MaxChunkRetries, dumpling.FileTransferManager.s_ChunkRetryDelay = self._saved
+        self.service.stop()
+        shutil.rmtree(self.journaldir)
+        dumpling.FileUtils._try_remove(self.origpath)
+
+    def _upload(self):
+        transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), transfermode='chunked')
+        return transmgr.QueueFileUpload(None, self.origpath).await_result()
+
+    def _assert_uploaded(self, hash):
+        with open(self.origpath, 'rb') as fOrig:
+            self.assertEqual(fOrig.read(), gzip.GzipFile(fileobj=StringIO.StringIO(self.service.artifacts[hash])).read())
+        self.assertEqual(os.listdir(self.journaldir), [ ])
+
+    def test_chunked_upload_retries_failed_chunks(self):
+        self.service.failchunks = { 0: 2, 3: 1 }
+
+        hash = self._upload()
+
+        self._assert_uploaded(hash)
+
+    def test_chunked_upload_resumes_from_journal(self):
+        dumpling.FileTransferManager.s_MaxChunkRetries = 1
+        self.service.chunklimit = 3
+        
+        with self.assertRaises(Exception):
+            self._upload()
+        
+        self.assertEqual(len(self.service.sessions.values()[0]['chunks']), 3)
+
+        self.service.chunklimit = None
+        self.service.requests = [ ]
+
+        hash = self._upload()
+
+        chunkputs = [ r for r in self.service.requests if r[0] == 'PUT' ]
+        self.assertEqual(len(chunkputs), len(self.service.artifacts[hash]) // (1024 * 4) + 1 - 3)
+        self._assert_uploaded(hash)
+
+class test_dumpling_dedupupload(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def _upload(self, content):
+        path = self.rand_file(1)
+        with open(path, 'wb') as f:
+            f.write(content)
+        try:
+            self.service.requests = [ ]
+            transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), transfermode='dedup')
+            hash = transmgr.QueueFileUpload(None, path).await_result()
+            self.assertEqual(content, gzip.GzipFile(fileobj=StringIO.StringIO(self.service.artifacts[hash])).read())
+            return len([ r for r in self.service.requests if r[0] == 'PUT' ])
+        finally:
+            dumpling.FileUtils._try_remove(path)
+
+    def test_dedup_upload_skips_known_chunks(self):
+        content = os.urandom(1024 * 1024)
+
+        firstputs = self._upload(content)
+
+        #insert a few pages into the middle of the content, only the chunks around the insertion should be uploaded
+        secondputs = self._upload(content[:300000] + os.urandom(1024 * 8) + content[300000:])
+
+        self.assertEqual(firstputs, len(self.service.chunks) - secondputs)
+        self.assertTrue(secondputs <= 2)
+
+class test_dumpling_hashcache(dumpling_testcase):
+    def setUp(self):
+        self.service = LocalDumplingService()
+        self.tempdir = tempfile.mkdtemp()
+        self.hashcache = dumpling.HashCache(os.path.join(self.tempdir, 'hashcache.db'))
+        self.confirmedpath = os.path.join(self.tempdir, 'confirmed.bloom')
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.tempdir)
+
+    def _upload(self, paths, client = None):
+        self.service.requests = [ ]
+        if client is None:
+            transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), hashcache=self.hashcache)
+        else:
+            transmgr = dumpling.AsyncFileTransferManager(dumpling.DumplingService(self.service.url), client, hashcache=self.hashcache)
+        hashes = [ transmgr.QueueFileUpload('dumpid', p) for p in paths ]
+        return [ t.await_result() for t in hashes ]
+
+    def test_hashcache_dedups_content(self):
+        content = self.rand_bytes(1024 * 16)
+        paths = [ os.path.join(self.tempdir, name) for name in ('a', 'b', 'c') ]
+        for p in paths:
+            with open(p, 'wb') as f:
+                f.write(content)
+
+        hashes = self._upload(paths)
+
+        self.assertEqual(len(set(hashes)), 1)
+        self.assertEqual(len(self.service.artifacts), 1)
+        self.assertEqual(len(self.service.dumpartifacts), 3)
+
+        #a later run finds every file in the cache and only registers the existing artifact
+        self.service.dumpartifacts = { }
+        self.assertEqual(self._upload(paths), hashes)
+        self.assertEqual(len(self.service.dumpartifacts), 3)
+
+        #if the service no longer has the artifact the file is compressed and uploaded again
+        self.service.artifacts = { }
+        self.assertEqual(len(set(self._upload(paths))), 1)
+        self.assertEqual(len(self.service.artifacts), 1)
+
+    def test_hashcache_links_async(self):
+        paths = [ self.rand_file() for i in range(2) ]
+        client = dumpling.AsyncHttpClient()
+        try:
+            hashes = self._upload(paths)
+
+            #cached files are linked rather than uploaded
+            self.service.dumpartifacts = { }
+            self.assertEqual(self._upload(paths, client), hashes)
+            self.assertEqual([ 'links', 'links' ], [ r[1].split('/')[-1] for r in self.service.requests if r[0] == 'POST' ])
+            self.assertEqual(len(self.service.dumpartifacts), 2)
+
+            #if the service no longer has an artifact the file is compressed and uploaded again
+            del self.service.artifacts[hashes[0]]
+            self.assertEqual(self._upload(paths, client), hashes)
+            self.assertIn(hashes[0], self.service.artifacts)
+        finally:
+            client.close()
+            for p in paths:
+                dumpling.FileUtils._try_remove(p)
+
+    def test_negotiate_uploads(self):
+        paths = [ self.rand_file() for i in range(4) ]
+        try:
+            self._upload(paths[:3])
+
+            def queue_uploads():
+                self.service.requests = [ ]
+                self.service.dumpartifacts = { }
+                transmgr = dumpling.FileTransferManager(dumpling.DumplingService(self.service.url), hashcache=self.hashcache, confirmed=dumpling.BloomFilter(self.confirmedpath))
+                for t in transmgr.QueueFileUploads('dumpid', paths):
+                    t.await_result()
+                transmgr.WaitForPendingTransfers()
+                return [ r[1].split('/')[-1] for r in self.service.requests if r[0] == 'POST' ]
+
+            #the cached files are found with a single query and registered with a single link, only the new file is uploaded
+            self.assertEqual(sorted(queue_uploads()), [ 'links', 'query', 'uploads' ])
+            self.assertEqual(len(self.service.dumpartifacts), 4)
+
+            #once confirmed the query is skipped altogether
+            self.assertEqual(queue_uploads(), [ 'links' ])
+            self.assertEqual(len(self.service.dumpartifacts), 4)
+
+            #a hash confirmed locally which the service no longer has is still uploaded
+            del self.service.artifacts[self.hashcache.Get(paths[0])[1]['comphash']]
+            self.assertEqual(sorted(queue_uploads()), [ 'links', 'uploads' ])
+            self.assertEqual(len(self.service.dumpartifacts), 4)
+        finally:
+            for p in paths:
+                dumpling.FileUtils._try_remove(p)
+
+    def test_bloomfilter(self):
+        confirmed = dumpling.BloomFilter(self.confirmedpath)
+        hashes = [ hashlib.sha1(str(i)).hexdigest() for i in range(1000) ]
+        for h in hashes:
+            confirmed.Add(h)
+        confirmed.Save()
+
+        loaded = dumpling.BloomFilter(self.confirmedpath)
+        self.assertTrue(all(h in loaded for h in hashes))
+        self.assertTrue(sum(hashlib.sha1(str(-i)).hexdigest() in loaded for i in range(1, 1000)) < 5)
+
+class test_dumpling_config(dumpling_testcase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.configpath = os.path.join(self.tempdir, 'dumpling.config.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_transfer_defaults_not_saved(self):
+        config = dumpling._parse_args([ 'config', 'save', '--configpath', self.configpath, '--httptimeout', '30' ])
+        config.Save(self.configpath)
+        with open(self.configpath, 'r') as f:
+            saved = json.load(f)
+        self.assertEqual(30, saved['httptimeout'])
+        for key in [ 'compresslevel', 'transfermode', 'compression', 'engine' ]:
+            self.assertNotIn(key, saved)
+
+    def test_downloads_opt_out_of_caches(self):
+        for command in [ [ 'download', '--dumpid', 'dumpid' ], [ 'debug', '--dumpid', 'dumpid' ] ]:
+            config = dumpling._parse_args(command + [ '--configpath', self.configpath, '--nocache', '--nohashcache' ])
+            self.assertTrue(config.nocache)
+            self.assertTrue(config.nohashcache)
+
 if __name__ == '__main__':
     dumpling.Output.s_quiet = True
+    dumpling.Output.s_logPath = None
     unittest.main(verbosity=2)
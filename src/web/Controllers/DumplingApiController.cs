@@ -13,6 +13,7 @@ using Newtonsoft.Json;
 using Newtonsoft.Json.Linq;
 using System;
 using System.Collections.Generic;
+using System.Data.Entity;
 using System.Data.Entity.Infrastructure;
 using System.Data.Entity.Migrations;
 using System.Data.Entity.Validation;
@@ -35,6 +36,22 @@ namespace dumpling.web.Controllers
     {
         private const int BUFF_SIZE = 1024 * 4;
 
+        private const int TAR_BLOCK_SIZE = 512;
+
+        private const string BUNDLE_MANIFEST_NAME = "manifest.json";
+
+        private static readonly TimeSpan STREAM_UPLOAD_EXPIRY = TimeSpan.FromHours(24);
+
+        private static readonly TimeSpan UPLOAD_SESSION_EXPIRY = TimeSpan.FromHours(24);
+
+        private const long MAX_SESSION_CHUNK_SIZE = 1024 * 1024 * 64;
+
+        private const long MAX_SESSION_LENGTH = 1024L * 1024 * 1024 * 256;
+
+        private const long MAX_CONTENT_CHUNK_SIZE = 1024 * 1024;
+
+        private const int MAX_CONTENT_CHUNK_QUERY = 1024;
+
         [Route("api/client/{*filename}")]
         [HttpGet]
         public HttpResponseMessage GetClientTools(string filename)
@@ -82,7 +99,8 @@ namespace dumpling.web.Controllers
                     {
                         using (var op3 = new TrackedOperation("LoadDumpArtifactsAsync"))
                         {
-                            await dumplingDb.Entry(dump).Collection(d => d.DumpArtifacts).LoadAsync();
+                            //the artifacts are loaded with the dump artifacts so the manifest can include their sizes
+                            await dumplingDb.Entry(dump).Collection(d => d.DumpArtifacts).Query().Include(da => da.Artifact).LoadAsync();
                         }
                     }
 
@@ -235,6 +253,314 @@ namespace dumpling.web.Controllers
             return hash;
         }
 
+        public class StreamUploadResponse
+        {
+            public string uploadId { get; set; }
+            public string hash { get; set; }
+        }
+
+        [Route("api/artifacts/streams")]
+        [HttpPost]
+        public async Task<StreamUploadResponse> UploadArtifactStream(CancellationToken cancelToken)
+        {
+            ExpireStreamUploads();
+
+            var uploadId = GetOperationToken();
+
+            var partialPath = GetStreamUploadPath(uploadId);
+
+            string hash = null;
+
+            try
+            {
+                using (var contentStream = await Request.Content.ReadAsStreamAsync())
+                using (var fileStream = new FileStream(partialPath, FileMode.CreateNew, FileAccess.Write, FileShare.None, BUFF_SIZE, FileOptions.Asynchronous))
+                {
+                    hash = await CopyAndHashAsync(contentStream, fileStream, cancelToken);
+                }
+
+                //the hash is part of the stored file name so the commit can only succeed with the hash the server computed
+                File.Move(partialPath, GetStreamUploadPath(uploadId, hash));
+            }
+            catch (Exception)
+            {
+                File.Delete(partialPath);
+
+                throw;
+            }
+
+            return new StreamUploadResponse() { uploadId = uploadId, hash = hash };
+        }
+
+        [Route("api/dumplings/{dumplingid}/artifacts/streams/{uploadId}/commit")]
+        [HttpPost]
+        public async Task<string> CommitArtifactStream(string dumplingid, string uploadId, [FromUri] string hash, [FromUri] string localpath, CancellationToken cancelToken)
+        {
+            await StoreArtifactStreamAsync(uploadId, hash, dumplingid, localpath, cancelToken);
+
+            return hash;
+        }
+
+        [Route("api/artifacts/streams/{uploadId}/commit")]
+        [HttpPost]
+        public async Task<string> CommitArtifactStream(string uploadId, [FromUri] string hash, [FromUri] string localpath, CancellationToken cancelToken)
+        {
+            await StoreArtifactStreamAsync(uploadId, hash, null, localpath, cancelToken);
+
+            return hash;
+        }
+
+        public class UploadSession
+        {
+            public string sessionId { get; set; }
+            public string hash { get; set; }
+            public long length { get; set; }
+            public long chunkSize { get; set; }
+            public int[] chunks { get; set; }
+        }
+
+        [Route("api/artifacts/sessions")]
+        [HttpPost]
+        public UploadSession BeginUploadSession([FromUri] string hash, [FromUri] long length, [FromUri] long chunksize)
+        {
+            //if the specified hash is not formatted properly throw an exception
+            if (!ValidateHashFormat(hash))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash is improperly formatted"));
+            }
+
+            if (length <= 0 || chunksize <= 0)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified length and chunk size must be positive"));
+            }
+
+            if (length > MAX_SESSION_LENGTH || chunksize > MAX_SESSION_CHUNK_SIZE)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, string.Format("The specified length and chunk size must not exceed {0} and {1} bytes", MAX_SESSION_LENGTH, MAX_SESSION_CHUNK_SIZE)));
+            }
+
+            //the number of chunks must fit the chunk indexes of the session
+            if ((length + chunksize - 1) / chunksize > int.MaxValue)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified chunk size is too small for the length"));
+            }
+
+            ExpireUploadSessions();
+
+            var session = new UploadSession() { sessionId = GetOperationToken(), hash = hash, length = length, chunkSize = chunksize, chunks = new int[0] };
+
+            var sessionDir = GetUploadSessionPath(session.sessionId);
+
+            Directory.CreateDirectory(sessionDir);
+
+            File.WriteAllText(Path.Combine(sessionDir, "session.json"), JsonConvert.SerializeObject(session));
+
+            return session;
+        }
+
+        [Route("api/artifacts/sessions/{sessionId}")]
+        [HttpGet]
+        public UploadSession GetUploadSession(string sessionId)
+        {
+            return LoadUploadSession(sessionId);
+        }
+
+        [Route("api/artifacts/sessions/{sessionId}/chunks/{index}")]
+        [HttpPut]
+        public async Task<HttpResponseMessage> UploadSessionChunk(string sessionId, int index, [FromUri] string hash, CancellationToken cancelToken)
+        {
+            var session = LoadUploadSession(sessionId);
+
+            if (!ValidateHashFormat(hash) || index < 0 || index >= GetChunkCount(session))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified chunk index or hash is invalid"));
+            }
+
+            var chunkPath = Path.Combine(GetUploadSessionPath(sessionId), index + ".chunk");
+
+            //chunks are written to a unique partial file so concurrent retries of the same chunk don't collide
+            var partialPath = chunkPath + "." + GetOperationToken();
+
+            try
+            {
+                string chunkHash = null;
+
+                using (var contentStream = await Request.Content.ReadAsStreamAsync())
+                using (var fileStream = new FileStream(partialPath, FileMode.CreateNew, FileAccess.Write, FileShare.None, BUFF_SIZE, FileOptions.Asynchronous))
+                {
+                    chunkHash = await CopyAndHashAsync(contentStream, fileStream, cancelToken);
+                }
+
+                var expectedLength = Math.Min(session.chunkSize, session.length - index * session.chunkSize);
+
+                if (chunkHash != hash || new FileInfo(partialPath).Length != expectedLength)
+                {
+                    throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash does not match hash of the uploaded chunk."));
+                }
+
+                //a retried chunk may have already been stored by an earlier attempt whose response was lost
+                if (!File.Exists(chunkPath))
+                {
+                    File.Move(partialPath, chunkPath);
+                }
+            }
+            finally
+            {
+                File.Delete(partialPath);
+            }
+
+            return Request.CreateResponse(HttpStatusCode.OK);
+        }
+
+        [Route("api/dumplings/{dumplingid}/artifacts/sessions/{sessionId}/commit")]
+        [HttpPost]
+        public async Task<string> CommitUploadSession(string dumplingid, string sessionId, [FromUri] string localpath, CancellationToken cancelToken)
+        {
+            return await StoreUploadSessionAsync(sessionId, dumplingid, localpath, cancelToken);
+        }
+
+        [Route("api/artifacts/sessions/{sessionId}/commit")]
+        [HttpPost]
+        public async Task<string> CommitUploadSession(string sessionId, [FromUri] string localpath, CancellationToken cancelToken)
+        {
+            return await StoreUploadSessionAsync(sessionId, null, localpath, cancelToken);
+        }
+
+        [Route("api/artifacts/query")]
+        [HttpPost]
+        public async Task<string[]> QueryArtifacts([FromBody] string[] hashes, CancellationToken cancelToken)
+        {
+            if (hashes == null || !hashes.All(ValidateHashFormat))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hashes are improperly formatted"));
+            }
+
+            using (DumplingDb dumplingDb = new DumplingDb())
+            {
+                return await FindStoredArtifactsAsync(dumplingDb, hashes, cancelToken);
+            }
+        }
+
+        public class ArtifactLink
+        {
+            public string hash { get; set; }
+            public string localpath { get; set; }
+        }
+
+        [Route("api/dumplings/{dumplingid}/artifacts/links")]
+        [HttpPost]
+        public async Task<string[]> LinkArtifacts(string dumplingid, [FromBody] ArtifactLink[] links, CancellationToken cancelToken)
+        {
+            return await LinkArtifactsAsync(links, dumplingid, cancelToken);
+        }
+
+        [Route("api/artifacts/links")]
+        [HttpPost]
+        public async Task<string[]> LinkArtifacts([FromBody] ArtifactLink[] links, CancellationToken cancelToken)
+        {
+            return await LinkArtifactsAsync(links, null, cancelToken);
+        }
+
+        [Route("api/dumplings/{dumplingid}/artifacts/bundles")]
+        [HttpPost]
+        public async Task<string[]> UploadArtifactBundle(string dumplingid, CancellationToken cancelToken)
+        {
+            return await StoreArtifactBundleAsync(dumplingid, cancelToken);
+        }
+
+        [Route("api/artifacts/bundles")]
+        [HttpPost]
+        public async Task<string[]> UploadArtifactBundle(CancellationToken cancelToken)
+        {
+            return await StoreArtifactBundleAsync(null, cancelToken);
+        }
+
+        [Route("api/chunks/query")]
+        [HttpPost]
+        public async Task<string[]> QueryContentChunks([FromBody] string[] hashes, CancellationToken cancelToken)
+        {
+            if (hashes == null || !hashes.All(ValidateHashFormat))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hashes are improperly formatted"));
+            }
+
+            //each hash is looked up in storage concurrently so the number queried at once is limited
+            if (hashes.Length > MAX_CONTENT_CHUNK_QUERY)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, string.Format("No more than {0} chunks can be queried at once", MAX_CONTENT_CHUNK_QUERY)));
+            }
+
+            var exists = await Task.WhenAll(hashes.Select(h => DumplingStorageClient.ContentChunkExistsAsync(h, cancelToken)));
+
+            return hashes.Where((h, i) => !exists[i]).ToArray();
+        }
+
+        [Route("api/chunks/{hash}")]
+        [HttpPut]
+        public async Task<HttpResponseMessage> UploadContentChunk(string hash, CancellationToken cancelToken)
+        {
+            //if the specified hash is not formatted properly throw an exception
+            if (!ValidateHashFormat(hash))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash is improperly formatted"));
+            }
+
+            //chunks are small so they are validated in memory, the size is checked before the content is read so a large
+            //body is never buffered
+            if (!Request.Content.Headers.ContentLength.HasValue)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.LengthRequired, "The length of the chunk must be specified"));
+            }
+
+            if (Request.Content.Headers.ContentLength.Value > MAX_CONTENT_CHUNK_SIZE)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.RequestEntityTooLarge, string.Format("Chunks must not exceed {0} bytes", MAX_CONTENT_CHUNK_SIZE)));
+            }
+
+            //the chunk hash is the hash of its decompressed content
+            var compressed = new MemoryStream(await Request.Content.ReadAsByteArrayAsync());
+
+            string chunkHash = null;
+
+            using (var gzStream = new GZipStream(compressed, CompressionMode.Decompress, true))
+            {
+                chunkHash = await CopyAndHashAsync(gzStream, Stream.Null, cancelToken);
+            }
+
+            if (chunkHash != hash)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash does not match hash of the uploaded chunk."));
+            }
+
+            if (!await DumplingStorageClient.ContentChunkExistsAsync(hash, cancelToken))
+            {
+                compressed.Position = 0;
+
+                await DumplingStorageClient.StoreContentChunkAsync(compressed, hash, cancelToken);
+            }
+
+            return Request.CreateResponse(HttpStatusCode.OK);
+        }
+
+        public class ArtifactRecipe
+        {
+            public string[] chunks { get; set; }
+        }
+
+        [Route("api/dumplings/{dumplingid}/artifacts/recipes")]
+        [HttpPost]
+        public async Task<string> CommitArtifactRecipe(string dumplingid, [FromUri] string localpath, [FromBody] ArtifactRecipe recipe, CancellationToken cancelToken)
+        {
+            return await StoreArtifactRecipeAsync(recipe, dumplingid, localpath, cancelToken);
+        }
+
+        [Route("api/artifacts/recipes")]
+        [HttpPost]
+        public async Task<string> CommitArtifactRecipe([FromUri] string localpath, [FromBody] ArtifactRecipe recipe, CancellationToken cancelToken)
+        {
+            return await StoreArtifactRecipeAsync(recipe, null, localpath, cancelToken);
+        }
+
         [Route("api/artifacts/{hash}")]
         [HttpGet]
         public async Task<HttpResponseMessage> DownloadArtifact(string hash, CancellationToken cancelToken)
@@ -332,7 +658,7 @@ namespace dumpling.web.Controllers
                     {
                         await blob.DownloadToStreamAsync(compStream, cancelToken);
                         compStream.Position = 0;
-                        using (var gunzipStream = new GZipStream(compStream, CompressionMode.Decompress, false))
+                        using (var gunzipStream = new MultiMemberGZipStream(compStream, false))
                         {
                             await gunzipStream.CopyToAsync(tempStream);
                         }
@@ -444,14 +770,343 @@ namespace dumpling.web.Controllers
                 throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash is improperly formatted"));
             }
 
+            await StoreArtifactAsync(() => UploadContentValidateHashAsync(content, hash, cancelToken), hash, dumpId, localPath, cancelToken);
+        }
+
+        private async Task StoreArtifactStreamAsync(string uploadId, string hash, string dumpId, string localPath, CancellationToken cancelToken)
+        {
+            //if the specified hash is not formatted properly throw an exception
+            if (!ValidateHashFormat(hash))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash is improperly formatted"));
+            }
+
+            Guid uploadGuid;
+
+            var uploadPath = Guid.TryParseExact(uploadId, "N", out uploadGuid) ? GetStreamUploadPath(uploadId, hash) : null;
+
+            //if the upload doesn't exist or was stored under a different hash the streamed content didn't match
+            if (uploadPath == null || !File.Exists(uploadPath))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified upload does not exist or does not match the specified hash."));
+            }
+
+            //the uploaded file is deleted on close whether or not the artifact already existed
+            using (var uploaded = new FileStream(uploadPath, FileMode.Open, FileAccess.Read, FileShare.None, BUFF_SIZE, FileOptions.Asynchronous | FileOptions.DeleteOnClose))
+            {
+                await StoreArtifactAsync(() => Task.FromResult<Stream>(uploaded), hash, dumpId, localPath, cancelToken);
+            }
+        }
+
+        private async Task<string> StoreUploadSessionAsync(string sessionId, string dumpId, string localPath, CancellationToken cancelToken)
+        {
+            var session = LoadUploadSession(sessionId);
+
+            if (session.chunks.Length != GetChunkCount(session))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The upload session is missing chunks."));
+            }
+
+            var sessionDir = GetUploadSessionPath(sessionId);
+
+            using (var assembled = CreateTempFile())
+            {
+                string hash = null;
+
+                //assemble the chunks in order hashing the complete content as it is written
+                using (var sha1 = SHA1.Create())
+                {
+                    var buff = new byte[BUFF_SIZE];
+
+                    foreach (var index in session.chunks)
+                    {
+                        using (var chunk = File.OpenRead(Path.Combine(sessionDir, index + ".chunk")))
+                        {
+                            int cbyte;
+
+                            while ((cbyte = await chunk.ReadAsync(buff, 0, buff.Length)) > 0)
+                            {
+                                cancelToken.ThrowIfCancellationRequested();
+
+                                sha1.TransformBlock(buff, 0, cbyte, buff, 0);
+
+                                await assembled.WriteAsync(buff, 0, cbyte);
+                            }
+                        }
+                    }
+
+                    await assembled.FlushAsync();
+
+                    sha1.TransformFinalBlock(buff, 0, 0);
+
+                    hash = string.Concat(sha1.Hash.Select(b => b.ToString("x2"))).ToLowerInvariant();
+                }
+
+                //the session can't be completed once the assembled content is known to be invalid so remove it either way
+                Directory.Delete(sessionDir, true);
+
+                if (hash != session.hash)
+                {
+                    throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash does not match hash of the uploaded content."));
+                }
+
+                await StoreArtifactAsync(() => Task.FromResult<Stream>(assembled), hash, dumpId, localPath, cancelToken);
+
+                return hash;
+            }
+        }
+
+        //returns the hashes of the links which could not be associated because the artifact is not stored
+        private async Task<string[]> LinkArtifactsAsync(ArtifactLink[] links, string dumpId, CancellationToken cancelToken)
+        {
+            if (links == null || !links.All(l => l != null && ValidateHashFormat(l.hash) && !string.IsNullOrEmpty(l.localpath)))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified links are invalid"));
+            }
+
+            using (DumplingDb dumplingDb = new DumplingDb())
+            {
+                var stored = new HashSet<string>(await FindStoredArtifactsAsync(dumplingDb, links.Select(l => l.hash).Distinct().ToArray(), cancelToken));
+
+                if (dumpId != null)
+                {
+                    foreach (var link in links.Where(l => stored.Contains(l.hash)))
+                    {
+                        await AddDumpArtifactToDbAsync(dumplingDb, dumpId, link.localpath, link.hash, cancelToken);
+                    }
+                }
+
+                return links.Select(l => l.hash).Where(h => !stored.Contains(h)).Distinct().ToArray();
+            }
+        }
+
+        //a bundle is a tar stream whose first member is a manifest of the hash and local path of each bundled file, followed by
+        //the compressed content of each distinct file named by its hash.  each member is stored as it arrives under every local
+        //path with its hash.  returns the hashes in the manifest which had no member in the bundle.
+        private async Task<string[]> StoreArtifactBundleAsync(string dumpId, CancellationToken cancelToken)
+        {
+            ArtifactLink[] manifest = null;
+
+            var stored = new HashSet<string>();
+
+            using (var contentStream = await Request.Content.ReadAsStreamAsync())
+            {
+                var header = new byte[TAR_BLOCK_SIZE];
+
+                string name;
+
+                while ((name = await ReadTarHeaderAsync(contentStream, header, cancelToken)) != null)
+                {
+                    var size = ParseTarSize(header);
+
+                    if (manifest == null)
+                    {
+                        manifest = await ReadBundleManifestAsync(contentStream, name, size, cancelToken);
+                    }
+                    else
+                    {
+                        if (!ValidateHashFormat(name) || !manifest.Any(l => l.hash == name))
+                        {
+                            throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The bundle contains an artifact which is not in its manifest."));
+                        }
+
+                        using (var member = CreateTempFile())
+                        {
+                            var hash = await CopyAndHashAsync(contentStream, member, cancelToken, size);
+
+                            if (hash != name)
+                            {
+                                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified hash does not match hash of the uploaded content."));
+                            }
+
+                            //only the first local path stores the content, the others find the artifact already exists
+                            foreach (var link in manifest.Where(l => l.hash == hash))
+                            {
+                                await StoreArtifactAsync(() => Task.FromResult<Stream>(member), hash, dumpId, link.localpath, cancelToken);
+                            }
+
+                            stored.Add(hash);
+                        }
+                    }
+
+                    //member content is padded to a whole number of blocks
+                    await ReadFullyAsync(contentStream, header, (int)((TAR_BLOCK_SIZE - size % TAR_BLOCK_SIZE) % TAR_BLOCK_SIZE), cancelToken);
+                }
+            }
+
+            if (manifest == null)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The bundle has no manifest."));
+            }
+
+            return manifest.Select(l => l.hash).Where(h => !stored.Contains(h)).Distinct().ToArray();
+        }
+
+        private async Task<ArtifactLink[]> ReadBundleManifestAsync(Stream contentStream, string name, long size, CancellationToken cancelToken)
+        {
+            if (name != BUNDLE_MANIFEST_NAME || size > int.MaxValue)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The bundle has no manifest."));
+            }
+
+            var buff = new byte[size];
+
+            if (await ReadFullyAsync(contentStream, buff, buff.Length, cancelToken) != buff.Length)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The bundle is truncated."));
+            }
+
+            var manifest = JsonConvert.DeserializeObject<ArtifactLink[]>(Encoding.UTF8.GetString(buff));
+
+            if (manifest == null || !manifest.All(l => l != null && ValidateHashFormat(l.hash) && !string.IsNullOrEmpty(l.localpath)))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The bundle manifest is invalid."));
+            }
+
+            return manifest;
+        }
+
+        //returns the name of the next member of the tar stream, or null at the end of the archive
+        private async Task<string> ReadTarHeaderAsync(Stream contentStream, byte[] header, CancellationToken cancelToken)
+        {
+            var cbyte = await ReadFullyAsync(contentStream, header, TAR_BLOCK_SIZE, cancelToken);
+
+            //the archive ends with zeroed blocks, tolerate them being left off
+            if (cbyte == 0 || header.All(b => b == 0))
+            {
+                return null;
+            }
+
+            if (cbyte != TAR_BLOCK_SIZE)
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The bundle is truncated."));
+            }
+
+            return Encoding.ASCII.GetString(header, 0, 100).TrimEnd('\0');
+        }
+
+        //the size is stored as octal digits terminated by a null or space
+        private static long ParseTarSize(byte[] header)
+        {
+            var digits = Encoding.ASCII.GetString(header, 124, 12).Trim('\0', ' ');
+
+            return digits.Length == 0 ? 0 : Convert.ToInt64(digits, 8);
+        }
+
+        private static async Task<int> ReadFullyAsync(Stream contentStream, byte[] buff, int count, CancellationToken cancelToken)
+        {
+            int total = 0;
+
+            int cbyte;
+
+            while (total < count && (cbyte = await contentStream.ReadAsync(buff, total, count - total, cancelToken)) > 0)
+            {
+                total += cbyte;
+            }
+
+            return total;
+        }
+
+        private static async Task<string[]> FindStoredArtifactsAsync(DumplingDb dumplingDb, string[] hashes, CancellationToken cancelToken)
+        {
+            //artifacts whose upload never completed have no url and are treated as missing
+            return await dumplingDb.Artifacts.Where(a => hashes.Contains(a.Hash) && a.Url != null).Select(a => a.Hash).ToArrayAsync(cancelToken);
+        }
+
+        private async Task<string> StoreArtifactRecipeAsync(ArtifactRecipe recipe, string dumpId, string localPath, CancellationToken cancelToken)
+        {
+            if (recipe == null || recipe.chunks == null || recipe.chunks.Length == 0 || !recipe.chunks.All(ValidateHashFormat))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.BadRequest, "The specified recipe is invalid"));
+            }
+
+            using (var assembled = CreateTempFile())
+            {
+                //each chunk is stored as a gzip member so concatenating them produces the compressed artifact
+                foreach (var chunkHash in recipe.chunks)
+                {
+                    await DumplingStorageClient.DownloadContentChunkAsync(chunkHash, assembled, cancelToken);
+                }
+
+                await assembled.FlushAsync();
+
+                assembled.Position = 0;
+
+                //the artifact hash is the hash of the assembled compressed content, as for any other upload
+                var hash = await CopyAndHashAsync(assembled, Stream.Null, cancelToken);
+
+                await StoreArtifactAsync(() => Task.FromResult<Stream>(assembled), hash, dumpId, localPath, cancelToken);
+
+                return hash;
+            }
+        }
+
+        private UploadSession LoadUploadSession(string sessionId)
+        {
+            Guid sessionGuid;
+
+            var sessionDir = Guid.TryParseExact(sessionId, "N", out sessionGuid) ? GetUploadSessionPath(sessionId) : null;
+
+            if (sessionDir == null || !File.Exists(Path.Combine(sessionDir, "session.json")))
+            {
+                throw new HttpResponseException(Request.CreateErrorResponse(HttpStatusCode.NotFound, "The specified upload session does not exist."));
+            }
+
+            var session = JsonConvert.DeserializeObject<UploadSession>(File.ReadAllText(Path.Combine(sessionDir, "session.json")));
+
+            //the received chunks are whatever chunk files have been completely stored
+            session.chunks = Directory.EnumerateFiles(sessionDir, "*.chunk").Select(f => int.Parse(Path.GetFileNameWithoutExtension(f))).OrderBy(i => i).ToArray();
+
+            return session;
+        }
+
+        private static int GetChunkCount(UploadSession session)
+        {
+            return (int)((session.length + session.chunkSize - 1) / session.chunkSize);
+        }
+
+        private static string GetUploadSessionPath(string sessionId)
+        {
+            return HttpContext.Current.Server.MapPath("~/App_Data/temp/sessions/" + sessionId);
+        }
+
+        //sessions which are never committed are deleted once no chunk has been stored for the expiry.  adding or removing
+        //a chunk file updates the session directory so its write time is the last activity of the session.  sessions with
+        //a chunk still being written or assembled have open files and can't be deleted so they're skipped.
+        private static void ExpireUploadSessions()
+        {
+            var root = new DirectoryInfo(HttpContext.Current.Server.MapPath("~/App_Data/temp/sessions"));
+
+            if (!root.Exists)
+            {
+                return;
+            }
+
+            var expired = DateTime.UtcNow - UPLOAD_SESSION_EXPIRY;
+
+            foreach (var sessionDir in root.EnumerateDirectories().Where(d => d.LastWriteTimeUtc < expired))
+            {
+                try
+                {
+                    sessionDir.Delete(true);
+                }
+                catch (IOException)
+                {
+                }
+            }
+        }
+
+        private async Task StoreArtifactAsync(Func<Task<Stream>> getContentAsync, string hash, string dumpId, string localPath, CancellationToken cancelToken)
+        {
             using (DumplingDb dumplingDb = new DumplingDb())
             {
                 var artifact = await AddArtifactToDbAsync(dumplingDb, hash, localPath, cancelToken);
 
-                //if the artifact didn't already exist and we added it to the db upload the file
-                if (artifact != null)
+                //if the artifact didn't already exist, or its content was never stored because an earlier upload of it failed
+                //validation or didn't complete, upload the file
+                if (artifact.Url == null)
                 {
-                    using (var uploaded = await UploadContentValidateHashAsync(content, hash, cancelToken))
+                    using (var uploaded = await getContentAsync())
                     {
                         artifact.CompressedSize = uploaded.Length;
 
@@ -485,7 +1140,7 @@ namespace dumpling.web.Controllers
                     Uuid = null
                 };
 
-                return await dumplingDb.TryAddAsync(artifact, cancelToken) ? artifact : null;
+                return await dumplingDb.GetOrAddAsync(artifact, cancelToken);
             }
         }
 
@@ -533,31 +1188,11 @@ namespace dumpling.web.Controllers
 
                     try
                     {
-                        using (var sha1 = SHA1.Create())
-                        {
-                            var buff = new byte[BUFF_SIZE];
-
-                            int cbyte;
-
-                            while ((cbyte = await contentStream.ReadAsync(buff, 0, buff.Length)) > 0)
-                            {
-                                cancelToken.ThrowIfCancellationRequested();
-
-                                length += cbyte;
-
-                                sha1.TransformBlock(buff, 0, cbyte, buff, 0);
-
-                                await fileStream.WriteAsync(buff, 0, cbyte);
-                            }
-
-                            await fileStream.FlushAsync();
+                        hash = await CopyAndHashAsync(contentStream, fileStream, cancelToken);
 
-                            sha1.TransformFinalBlock(buff, 0, 0);
+                        length = fileStream.Length;
 
-                            hash = string.Concat(sha1.Hash.Select(b => b.ToString("x2"))).ToLowerInvariant();
-
-                            operationMetrics["FileLength"] = Convert.ToDouble(length);
-                        }
+                        operationMetrics["FileLength"] = Convert.ToDouble(length);
                     }
                     //if an exception was thrown while uploading delete the file and rethrow to prevent leaking the incomplete file
                     catch (Exception)
@@ -580,6 +1215,72 @@ namespace dumpling.web.Controllers
             }
         }
 
+        //copies the rest of the content stream, or only length bytes of it if a length is specified
+        private static async Task<string> CopyAndHashAsync(Stream contentStream, Stream fileStream, CancellationToken cancelToken, long length = -1)
+        {
+            using (var sha1 = SHA1.Create())
+            {
+                var buff = new byte[BUFF_SIZE];
+
+                int cbyte;
+
+                long remaining = length < 0 ? long.MaxValue : length;
+
+                while (remaining > 0 && (cbyte = await contentStream.ReadAsync(buff, 0, (int)Math.Min(buff.Length, remaining))) > 0)
+                {
+                    cancelToken.ThrowIfCancellationRequested();
+
+                    sha1.TransformBlock(buff, 0, cbyte, buff, 0);
+
+                    await fileStream.WriteAsync(buff, 0, cbyte);
+
+                    remaining -= cbyte;
+                }
+
+                await fileStream.FlushAsync();
+
+                sha1.TransformFinalBlock(buff, 0, 0);
+
+                return string.Concat(sha1.Hash.Select(b => b.ToString("x2"))).ToLowerInvariant();
+            }
+        }
+
+        //streamed uploads are persisted between the upload and commit requests so they are not created delete on close
+        private static string GetStreamUploadPath(string uploadId, string hash = null)
+        {
+            return Path.Combine(GetStreamUploadRoot(), hash == null ? uploadId + ".partial" : uploadId + "." + hash);
+        }
+
+        private static string GetStreamUploadRoot()
+        {
+            string root = HttpContext.Current.Server.MapPath("~/App_Data/temp/streams");
+
+            if (!Directory.Exists(root))
+            {
+                Directory.CreateDirectory(root);
+            }
+
+            return root;
+        }
+
+        //streamed uploads which are never committed, or whose upload stalled, are deleted once they haven't been written
+        //for the expiry.  uploads still being written or committed are open and can't be deleted so they're skipped.
+        private static void ExpireStreamUploads()
+        {
+            var expired = DateTime.UtcNow - STREAM_UPLOAD_EXPIRY;
+
+            foreach (var file in new DirectoryInfo(GetStreamUploadRoot()).EnumerateFiles().Where(f => f.LastWriteTimeUtc < expired))
+            {
+                try
+                {
+                    file.Delete();
+                }
+                catch (IOException)
+                {
+                }
+            }
+        }
+
         private static Stream CreateTempFile(string path = null)
         {
             path = path ?? Path.GetTempFileName();
@@ -366,7 +366,7 @@ namespace dumpling.web.Storage
             string hash = null;
 
             using (var sha1 = SHA1.Create())
-            using (var gzStream = new GZipStream(compressed, CompressionMode.Decompress, true))
+            using (var gzStream = new MultiMemberGZipStream(compressed, true))
             {
                 var buff = new byte[BUFF_SIZE];
 
@@ -78,6 +78,30 @@ namespace dumpling.web.Storage
             }
         }
 
+        public static async Task<bool> ContentChunkExistsAsync(string hash, CancellationToken cancelToken)
+        {
+            var blob = _instance._artifactContainer.GetBlockBlobReference("chunks/" + hash);
+
+            return await blob.ExistsAsync(cancelToken);
+        }
+
+        public static async Task StoreContentChunkAsync(Stream stream, string hash, CancellationToken cancelToken)
+        {
+            using (var opTracker = new TrackedOperation("StoreContentChunkBlob", new Dictionary<string, string>() { { "Hash", hash } }))
+            {
+                var blob = _instance._artifactContainer.GetBlockBlobReference("chunks/" + hash);
+
+                await blob.UploadFromStreamAsync(stream, cancelToken);
+            }
+        }
+
+        public static async Task DownloadContentChunkAsync(string hash, Stream stream, CancellationToken cancelToken)
+        {
+            var blob = _instance._artifactContainer.GetBlockBlobReference("chunks/" + hash);
+
+            await blob.DownloadToStreamAsync(stream, cancelToken);
+        }
+
         public static async Task<bool> DeleteArtifactAsync(string hash, string fileName, CancellationToken cancelToken)
         {
             using (var opTracker = new TrackedOperation("DeleteArtifactBlob", new Dictionary<string, string>() { { "Hash", hash } }))
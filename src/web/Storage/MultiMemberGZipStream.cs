@@ -0,0 +1,200 @@
+﻿using System;
+using System.IO;
+using System.IO.Compression;
+using System.Threading;
+using System.Threading.Tasks;
+
+namespace dumpling.web.Storage
+{
+    //decompresses every member of a gzip stream which is a sequence of independent gzip members, such as the block gzip and
+    //dedup recipe artifacts uploaded by the client.  GZipStream stops at the end of the first member, having read ahead of
+    //it, so the end of each member is found from its trailer, which holds the size of the decompressed member, followed by
+    //either the end of the stream or the start of the next member.  the compressed stream must be seekable.
+    public class MultiMemberGZipStream : Stream
+    {
+        //GZipStream reads ahead of the end of a member by at most its buffer size, which is well below this
+        private const int READ_AHEAD = 1024 * 64;
+        private const int TRAILER_SIZE = 8;
+        private static readonly byte[] GZIP_MAGIC = { 0x1f, 0x8b, 0x08 };
+
+        private Stream _compressed;
+        private bool _leaveOpen;
+        private GZipStream _member;
+        private long _memberSize;
+
+        public MultiMemberGZipStream(Stream compressed, bool leaveOpen = false)
+        {
+            if (!compressed.CanSeek)
+            {
+                throw new ArgumentException("The compressed stream must be seekable.", "compressed");
+            }
+
+            _compressed = compressed;
+
+            _leaveOpen = leaveOpen;
+
+            _member = new GZipStream(compressed, CompressionMode.Decompress, true);
+        }
+
+        public override bool CanRead { get { return true; } }
+
+        public override bool CanSeek { get { return false; } }
+
+        public override bool CanWrite { get { return false; } }
+
+        public override long Length { get { throw new NotSupportedException(); } }
+
+        public override long Position
+        {
+            get { throw new NotSupportedException(); }
+            set { throw new NotSupportedException(); }
+        }
+
+        public override int Read(byte[] buffer, int offset, int count)
+        {
+            while (_member != null)
+            {
+                int read = _member.Read(buffer, offset, count);
+
+                if (read > 0)
+                {
+                    _memberSize += read;
+
+                    return read;
+                }
+
+                NextMember();
+            }
+
+            return 0;
+        }
+
+        public override async Task<int> ReadAsync(byte[] buffer, int offset, int count, CancellationToken cancellationToken)
+        {
+            while (_member != null)
+            {
+                int read = await _member.ReadAsync(buffer, offset, count, cancellationToken);
+
+                if (read > 0)
+                {
+                    _memberSize += read;
+
+                    return read;
+                }
+
+                NextMember();
+            }
+
+            return 0;
+        }
+
+        public override void Flush()
+        {
+        }
+
+        public override long Seek(long offset, SeekOrigin origin)
+        {
+            throw new NotSupportedException();
+        }
+
+        public override void SetLength(long value)
+        {
+            throw new NotSupportedException();
+        }
+
+        public override void Write(byte[] buffer, int offset, int count)
+        {
+            throw new NotSupportedException();
+        }
+
+        protected override void Dispose(bool disposing)
+        {
+            if (disposing)
+            {
+                if (_member != null)
+                {
+                    _member.Dispose();
+
+                    _member = null;
+                }
+
+                if (!_leaveOpen)
+                {
+                    _compressed.Dispose();
+                }
+            }
+
+            base.Dispose(disposing);
+        }
+
+        //positions the compressed stream at the start of the next member and starts decompressing it, if there is one
+        private void NextMember()
+        {
+            var consumed = _compressed.Position;
+
+            _member.Dispose();
+
+            _member = null;
+
+            var end = FindMemberEnd(Math.Max(consumed - READ_AHEAD, 0), consumed);
+
+            if (end > 0 && end < _compressed.Length)
+            {
+                _compressed.Position = end;
+
+                _memberSize = 0;
+
+                _member = new GZipStream(_compressed, CompressionMode.Decompress, true);
+            }
+        }
+
+        //returns the offset following the trailer of the member which ended between start and consumed, or -1 if it isn't
+        //followed by another member.  a readahead that reached the end of the stream ends at the end of the stream.
+        private long FindMemberEnd(long start, long consumed)
+        {
+            var length = (int)(Math.Min(consumed + GZIP_MAGIC.Length, _compressed.Length) - start);
+
+            var buff = new byte[length];
+
+            _compressed.Position = start;
+
+            int read = 0;
+
+            while (read < length)
+            {
+                int cbyte = _compressed.Read(buff, read, length - read);
+
+                if (cbyte == 0)
+                {
+                    break;
+                }
+
+                read += cbyte;
+            }
+
+            var size = (uint)_memberSize;
+
+            for (int i = 0; i + TRAILER_SIZE <= read && start + i + TRAILER_SIZE <= consumed; i++)
+            {
+                if (BitConverter.ToUInt32(buff, i + 4) != size)
+                {
+                    continue;
+                }
+
+                var next = i + TRAILER_SIZE;
+
+                if (start + next == _compressed.Length)
+                {
+                    return start + next;
+                }
+
+                if (next + GZIP_MAGIC.Length <= read && buff[next] == GZIP_MAGIC[0] && buff[next + 1] == GZIP_MAGIC[1] && buff[next + 2] == GZIP_MAGIC[2])
+                {
+                    return start + next;
+                }
+            }
+
+            return -1;
+        }
+    }
+}